@@ -0,0 +1,17 @@
+# Generated by Django 3.2.5 on 2026-10-18 07:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('_db', '0054_admintoken_name'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-weight', '-created', '-id'], name='post_feed_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 3.2.5 on 2026-10-18 07:39
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_flats_location(apps, schema_editor):
+    Floor = apps.get_model('_db', 'Floor')
+    Flat = apps.get_model('_db', 'Flat')
+    floors = Floor.objects.values_list('pk', 'number', 'section__number', 'section__building__number',
+                                       'section__building__house')
+    for pk, floor_number, section_number, building_number, house in floors.iterator():
+        Flat.objects.filter(floor=pk).update(floor_number=floor_number, section_number=section_number,
+                                             building_number=building_number, house=house)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('_db', '0055_post_feed_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='flat',
+            name='building_number',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='flat',
+            name='floor_number',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='flat',
+            name='house',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='house_flats', to='_db.house'),
+        ),
+        migrations.AddField(
+            model_name='flat',
+            name='section_number',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='flat',
+            index=models.Index(fields=['house', 'building_number', 'section_number', 'floor_number'], name='flat_location_idx'),
+        ),
+        migrations.RunPython(fill_flats_location, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 3.2.5 on 2026-10-18 07:41
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    """ GIN index and tsvector functions exist only in PostgreSQL """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE INDEX post_search_vector_idx ON _db_post USING GIN (search_vector)')
+    schema_editor.execute(
+        "UPDATE _db_post SET search_vector = "
+        "setweight(to_tsvector(COALESCE(h.city, '')), 'A') || "
+        "setweight(to_tsvector(COALESCE(h.address, '')), 'B') || "
+        "setweight(to_tsvector(COALESCE(h.name, '')), 'B') || "
+        "setweight(to_tsvector(COALESCE(_db_post.description, '')), 'C') "
+        "FROM _db_house h WHERE h.id = _db_post.house_id"
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS post_search_vector_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('_db', '0056_flat_location'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 3.2.5 on 2026-10-18 07:53
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def fill_house_counters(apps, schema_editor):
+    """ The same UPDATE as 'HouseQuerySet.recount', on models of this migration """
+    db = schema_editor.connection.alias
+
+    def count(model_name, house_lookup, **filters):
+        model = apps.get_model('_db', model_name)
+        subquery = model.objects.using(db).filter(**{house_lookup: models.OuterRef('pk')}, **filters)\
+            .order_by().values(house_lookup).annotate(count=models.Count('pk')).values('count')
+        return Coalesce(models.Subquery(subquery, output_field=models.IntegerField()), 0)
+
+    apps.get_model('_db', 'House').objects.using(db).update(
+        building_count=count('Building', 'house'),
+        section_count=count('Section', 'building__house'),
+        floor_count=count('Floor', 'section__building__house'),
+        flat_count=count('Flat', 'house'),
+        booked_flat_count=count('Flat', 'house', booked=True))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('_db', '0057_post_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='house',
+            name='booked_flat_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='house',
+            name='building_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='house',
+            name='flat_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='house',
+            name='floor_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='house',
+            name='section_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_house_counters, migrations.RunPython.noop),
+    ]
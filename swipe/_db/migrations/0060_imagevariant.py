@@ -0,0 +1,34 @@
+# Generated by Django 3.2.5 on 2026-10-18 08:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('_db', '0059_backgroundjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageVariant',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('field', models.CharField(max_length=30)),
+                ('source', models.CharField(max_length=255)),
+                ('variant', models.CharField(choices=[('ORIGINAL', 'Оригинал'), ('SMALL', 'Маленькое'), ('MEDIUM', 'Среднее'), ('LARGE', 'Большое')], max_length=8)),
+                ('format', models.CharField(blank=True, choices=[('WEBP', 'WebP'), ('JPEG', 'JPEG')], max_length=4, null=True)),
+                ('file', models.FileField(blank=True, null=True, upload_to='media/variants')),
+                ('width', models.IntegerField()),
+                ('height', models.IntegerField()),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='imagevariant',
+            index=models.Index(fields=['content_type', 'object_id'], name='image_variant_object_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.5 on 2026-10-18 08:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('_db', '0061_filedeletion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='house',
+            name='hidden',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='backgroundjob',
+            name='kind',
+            field=models.CharField(choices=[('IMPORT_FLATS', 'Импорт квартир'), ('PURGE_HOUSE', 'Удаление дома'), ('PURGE_USER', 'Удаление пользователя')], max_length=12),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 3.2.5 on 2026-10-18 08:13
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_conversations(apps, schema_editor):
+    """
+    Conversations start without unread messages - history is considered as read.
+    Last message of pair is taken from both directions by one subquery, so its time and id belong to one row
+    """
+    Message = apps.get_model('_db', 'Message')
+    Conversation = apps.get_model('_db', 'Conversation')
+    using = schema_editor.connection.alias
+    last = Message.objects.using(using).filter(
+        models.Q(sender=models.OuterRef('sender'), receiver=models.OuterRef('receiver'))
+        | models.Q(sender=models.OuterRef('receiver'), receiver=models.OuterRef('sender'))
+    ).order_by('-created', '-id')
+    rows = Message.objects.using(using).filter(sender__isnull=False, receiver__isnull=False)\
+        .values('sender', 'receiver')\
+        .annotate(last_id=models.Subquery(last.values('id')[:1]),
+                  last_activity=models.Subquery(last.values('created')[:1]))\
+        .order_by().distinct()
+    pairs = {}
+    for row in rows.iterator():
+        for owner, counterpart in ((row['sender'], row['receiver']), (row['receiver'], row['sender'])):
+            pairs[(owner, counterpart)] = (row['last_activity'], row['last_id'])
+    Conversation.objects.using(using).bulk_create([
+        Conversation(owner_id=owner, counterpart_id=counterpart, last_activity=last_activity,
+                     last_message_id=last_id)
+        for (owner, counterpart), (last_activity, last_id) in pairs.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('_db', '0063_message_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Conversation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_activity', models.DateTimeField()),
+                ('unread_count', models.IntegerField(default=0)),
+                ('counterpart', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('last_message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='_db.message')),
+                ('owner', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='conversations', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['owner', '-last_activity', '-id'], name='conversation_inbox_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='conversation',
+            constraint=models.UniqueConstraint(fields=('owner', 'counterpart'), name='unique_conversation'),
+        ),
+        migrations.RunPython(fill_conversations, migrations.RunPython.noop),
+    ]
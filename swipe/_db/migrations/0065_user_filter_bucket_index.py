@@ -0,0 +1,17 @@
+# Generated by Django 3.2.5 on 2026-10-18 08:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('_db', '0064_conversation'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='userfilter',
+            index=models.Index(fields=['city', 'status', 'number_of_rooms', 'min_price'], name='user_filter_bucket_idx'),
+        ),
+    ]
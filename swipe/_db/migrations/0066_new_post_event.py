@@ -0,0 +1,23 @@
+# Generated by Django 3.2.5 on 2026-10-18 08:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('_db', '0065_user_filter_bucket_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NewPostEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('host', models.CharField(max_length=255)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='_db.post')),
+            ],
+        ),
+    ]
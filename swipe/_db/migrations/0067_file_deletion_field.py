@@ -0,0 +1,18 @@
+# Generated by Django 3.2.5 on 2026-10-18 12:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('_db', '0066_new_post_event'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filedeletion',
+            name='field',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+    ]
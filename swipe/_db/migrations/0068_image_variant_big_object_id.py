@@ -0,0 +1,18 @@
+# Generated by Django 3.2.5 on 2026-10-18 12:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('_db', '0067_file_deletion_field'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='imagevariant',
+            name='object_id',
+            field=models.PositiveBigIntegerField(),
+        ),
+    ]
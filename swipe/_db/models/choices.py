@@ -136,3 +136,30 @@ color_choices = (
     ('PINK', _('Розовый')),
     ('GREEN', _('Зеленый'))
 )
+
+# Background job only
+job_kind_choices = (
+    ('IMPORT_FLATS', _('Импорт квартир')),
+    ('PURGE_HOUSE', _('Удаление дома')),
+    ('PURGE_USER', _('Удаление пользователя')),
+)
+
+job_status_choices = (
+    ('PENDING', _('В очереди')),
+    ('RUNNING', _('Выполняется')),
+    ('DONE', _('Завершено')),
+    ('FAILED', _('Ошибка'))
+)
+
+# Image variants only
+image_variant_choices = (
+    ('ORIGINAL', _('Оригинал')),
+    ('SMALL', _('Маленькое')),
+    ('MEDIUM', _('Среднее')),
+    ('LARGE', _('Большое'))
+)
+
+image_format_choices = (
+    ('WEBP', 'WebP'),
+    ('JPEG', 'JPEG')
+)
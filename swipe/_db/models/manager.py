@@ -1,4 +1,6 @@
 from django.contrib.auth.base_user import BaseUserManager
+from django.db import models
+from django.db.models.functions import Coalesce
 
 
 class UserManager(BaseUserManager):
@@ -20,3 +22,61 @@ class UserManager(BaseUserManager):
         if extra_fields.get('is_superuser') is not True:
             raise ValueError('Superuser must have is_superuser=True')
         return self.create_user(email, password, **extra_fields)
+
+
+class PostQuerySet(models.QuerySet):
+    def with_related(self):
+        """
+        Query plan for 'main.serializers.post_serializers.PostSerializer'.
+        Any page of posts is serialized with the same number of queries: one for posts with
+        flat -> house and promotion, plus one per prefetched relation.
+        Likers and favorites aren`t loaded - reactions of current user are annotated by 'with_user_flags'.
+        """
+        return self.select_related('flat__house', 'promotion').prefetch_related(
+            'images__image_variants',
+            'image_variants',
+        )
+
+    def with_user_flags(self, user):
+        """
+        Annotate 'is_liked', 'is_disliked' and 'is_favorite' for given user.
+        Every flag is EXISTS subquery by index of many-to-many table, so liker lists are not loaded.
+        """
+        if not user or not user.is_authenticated:
+            return self.annotate(is_liked=models.Value(False, output_field=models.BooleanField()),
+                                 is_disliked=models.Value(False, output_field=models.BooleanField()),
+                                 is_favorite=models.Value(False, output_field=models.BooleanField()))
+        flags = {}
+        for flag, field in (('is_liked', 'likers'), ('is_disliked', 'dislikers'), ('is_favorite', 'in_favorites')):
+            through = self.model._meta.get_field(field).remote_field.through
+            flags[flag] = models.Exists(through.objects.filter(post=models.OuterRef('pk'), user=user))
+        return self.annotate(**flags)
+
+    def visible(self):
+        """ Without posts of houses and users which are deleted by background job - see 'main.purge' """
+        return self.filter(house__hidden=False, user__is_active=True)
+
+
+class HouseQuerySet(models.QuerySet):
+    def visible(self):
+        return self.filter(hidden=False)
+
+    def recount(self):
+        """
+        Recompute structure counters of houses with one UPDATE.
+        :return: number of houses
+        """
+        def count(model, house_lookup, **filters):
+            subquery = model.objects.filter(**{house_lookup: models.OuterRef('pk')}, **filters)\
+                .order_by().values(house_lookup).annotate(count=models.Count('pk')).values('count')
+            return Coalesce(models.Subquery(subquery, output_field=models.IntegerField()), 0)
+
+        buildings = self.model._meta.get_field('buildings').related_model
+        sections = buildings._meta.get_field('sections').related_model
+        floors = sections._meta.get_field('floors').related_model
+        flats = floors._meta.get_field('flats').related_model
+        return self.update(building_count=count(buildings, 'house'),
+                           section_count=count(sections, 'building__house'),
+                           floor_count=count(floors, 'section__building__house'),
+                           flat_count=count(flats, 'house'),
+                           booked_flat_count=count(flats, 'house', booked=True))
@@ -0,0 +1,35 @@
+from django.db import models
+
+
+class FileTrackingMixin:
+    """
+    Keeps names of files as they were loaded or saved.
+    '_db.models.receiver' compares them with current values to delete replaced files without query
+    """
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.track_files()
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.track_files(kwargs.get('update_fields'))
+
+    @classmethod
+    def get_file_fields(cls):
+        return [field for field in cls._meta.concrete_fields if isinstance(field, models.FileField)]
+
+    def track_files(self, update_fields=None):
+        """
+        Raw values are used, so deferred fields are not loaded and not tracked.
+        :param update_fields: only these fields are saved - others keep previous names
+        """
+        if update_fields is None or not hasattr(self, '_original_files'):
+            self._original_files = {}
+        for field in self.get_file_fields():
+            if update_fields is not None and field.name not in update_fields:
+                continue
+            if field.attname in self.__dict__:
+                value = self.__dict__[field.attname]
+                self._original_files[field.attname] = getattr(value, 'name', value)
@@ -1,19 +1,29 @@
+from django.apps import apps
+from django.core.exceptions import FieldDoesNotExist
+from django.core.files.storage import default_storage
 from django.db import models
+from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MaxValueValidator, MinValueValidator
+from django.utils.translation import gettext as _
 
 from _db.models.user import User
+from _db.models.manager import PostQuerySet, HouseQuerySet
+from _db.models.mixins import FileTrackingMixin
 
 from _db.models.choices import *
 from _db.models.validators import validate_file_extension
 
 
-class House(models.Model):
+class House(FileTrackingMixin, models.Model):
     name = models.CharField(max_length=100)
     address = models.CharField(max_length=150)
     city = models.CharField(max_length=150)
     long = models.DecimalField(max_digits=9, decimal_places=6, blank=True, null=True)
     lat = models.DecimalField(max_digits=9, decimal_places=6, blank=True, null=True)
     image = models.ImageField(upload_to='media/houses', blank=True, null=True)
+    image_variants = GenericRelation('ImageVariant')
     status = models.CharField(choices=status_choices, default='FLAT', max_length=7)
     type = models.CharField(choices=type_choices, default='MANE', max_length=9)
     house_class = models.CharField(choices=house_class_choices, default='COMMON', max_length=6)
@@ -44,10 +54,27 @@ class House(models.Model):
     sales_department = models.ForeignKey(User, related_name='managed_houses', on_delete=models.CASCADE,
                                          blank=True)
 
+    # Structure counters. Kept by receivers on create/delete of buildings, sections, floors and flats.
+    # Bulk operations skip receivers - 'recount_houses' command fixes counters
+    building_count = models.IntegerField(default=0, editable=False)
+    section_count = models.IntegerField(default=0, editable=False)
+    floor_count = models.IntegerField(default=0, editable=False)
+    flat_count = models.IntegerField(default=0, editable=False)
+    booked_flat_count = models.IntegerField(default=0, editable=False)
+
+    # House is hidden at once and its structure is deleted by background job - see 'main.purge'
+    hidden = models.BooleanField(default=False, editable=False)
+
+    objects = HouseQuerySet.as_manager()
+
     @property
     def user(self):
         return self.sales_department
 
+    @property
+    def free_flat_count(self):
+        return self.flat_count - self.booked_flat_count
+
     def get_files(self):
         return [self.image]
 
@@ -79,11 +106,9 @@ class Building(models.Model):
 
     @classmethod
     def get_next(cls, house: House):
-        objects = cls.objects.filter(house=house)
-        if objects:
-            last = objects.last().number
-            return last + 1
-        return 1
+        """ One aggregate query instead of loading rows """
+        last = cls.objects.filter(house=house).aggregate(last=models.Max('number'))['last']
+        return (last or 0) + 1
 
     @property
     def user(self):
@@ -96,11 +121,9 @@ class Section(models.Model):
 
     @classmethod
     def get_next(cls, building: Building):
-        objects = cls.objects.filter(building=building)
-        if objects:
-            last = objects.last().number
-            return last + 1
-        return 1
+        """ One aggregate query instead of loading rows """
+        last = cls.objects.filter(building=building).aggregate(last=models.Max('number'))['last']
+        return (last or 0) + 1
 
     @property
     def user(self):
@@ -113,11 +136,9 @@ class Floor(models.Model):
 
     @classmethod
     def get_next(cls, section: Section):
-        objects = cls.objects.filter(section=section)
-        if objects:
-            last = objects.last().number
-            return last + 1
-        return 1
+        """ One aggregate query instead of loading rows """
+        last = cls.objects.filter(section=section).aggregate(last=models.Max('number'))['last']
+        return (last or 0) + 1
 
     @property
     def user(self):
@@ -133,7 +154,7 @@ class Standpipe(models.Model):
         return self.section.user
 
 
-class Flat(models.Model):
+class Flat(FileTrackingMixin, models.Model):
     number = models.IntegerField()
     square = models.FloatField()
     kitchen_square = models.FloatField()
@@ -141,6 +162,7 @@ class Flat(models.Model):
     price = models.FloatField()
     schema = models.ImageField(upload_to='media/flats/schema')
     schema_in_house = models.ImageField(upload_to='media/flats/schema_in_house', blank=True, null=True)
+    image_variants = GenericRelation('ImageVariant')
     number_of_rooms = models.IntegerField()
     state = models.CharField(choices=state_choices, max_length=5)
     foundation_doc = models.CharField(choices=foundation_doc_choices, max_length=5)
@@ -154,13 +176,61 @@ class Flat(models.Model):
     booked = models.BooleanField(default=False)  # If client booked flat - no one else can do it. BUT he does`t own it
     owned = models.BooleanField(default=False)  # If owned is True = client is displaying in house list.
 
+    # Denormalized location of flat. Lets house-scoped queries skip floor -> section -> building -> house joins.
+    # Filled on save from floor. Receivers keep it consistent when floor, section or building is changed.
+    house = models.ForeignKey(House, related_name='house_flats', on_delete=models.CASCADE, blank=True, null=True,
+                              db_index=False)  # 'flat_location_idx' starts with house
+    building_number = models.IntegerField(blank=True, null=True)
+    section_number = models.IntegerField(blank=True, null=True)
+    floor_number = models.IntegerField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['house', 'building_number', 'section_number', 'floor_number'],
+                         name='flat_location_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._location_floor_id = instance.__dict__.get('floor_id')
+        # Saved state for house counters - see '_db.models.receiver'
+        instance._counted_house_id = instance.__dict__.get('house_id')
+        instance._counted_booked = instance.__dict__.get('booked')
+        return instance
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        floor_changed = getattr(self, '_location_floor_id', None) != self.floor_id
+        if (floor_changed or self.house_id is None) and (update_fields is None or 'floor' in update_fields):
+            self.set_location()
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'house', 'building_number',
+                                                               'section_number', 'floor_number'}
+        super().save(*args, **kwargs)
+        self._location_floor_id = self.floor_id
+        self._counted_house_id, self._counted_booked = self.house_id, self.booked
+
+    def set_location(self):
+        """ Copy numbers and house from floor -> section -> building -> house chain with one query """
+        self.floor_number, self.section_number, self.building_number, self.house_id = \
+            Floor.objects.filter(pk=self.floor_id).values_list('number', 'section__number',
+                                                               'section__building__number',
+                                                               'section__building__house').get()
+
+    @property
+    def location_display(self):
+        return _('Корпус {building}, Секция {section}, Этаж {floor}').format(building=self.building_number,
+                                                                             section=self.section_number,
+                                                                             floor=self.floor_number)
+
     @property
     def booking_status(self):
         return 'Booked' if self.booked else 'Free'
 
     @property
     def user(self):
-        return self.floor.user
+        return self.house.user
 
     def get_files(self):
         return [self.schema, self.schema_in_house]
@@ -177,7 +247,7 @@ class RequestToChest(models.Model):
         return self.house.user
 
 
-class Post(models.Model):
+class Post(FileTrackingMixin, models.Model):
     LIMIT = 5  # Max posts for unsubscribed users
 
     number = models.IntegerField(unique=True, blank=True)
@@ -197,6 +267,7 @@ class Post(models.Model):
     rejected = models.BooleanField(default=False)
     reject_message = models.CharField(choices=reject_message_choices, max_length=5, blank=True, null=True)
     main_image = models.ImageField(upload_to='media/posts/')
+    image_variants = GenericRelation('ImageVariant')
 
     likers = models.ManyToManyField(User, related_name='liked')
     dislikers = models.ManyToManyField(User, related_name='disliked')
@@ -204,6 +275,18 @@ class Post(models.Model):
 
     weight = models.IntegerField(default=0)  # User for order post
 
+    # House city, address, name and description. Filled by 'main.receivers'.
+    # GIN index is created by migration only for PostgreSQL
+    search_vector = SearchVectorField(blank=True, null=True, editable=False)
+
+    objects = PostQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Feed ordering. Used by keyset pagination - see main.pagination.PostKeysetPagination
+            models.Index(fields=['-weight', '-created', '-id'], name='post_feed_idx'),
+        ]
+
     def get_files(self):
         return [self.main_image]
 
@@ -219,9 +302,10 @@ class Post(models.Model):
         return 1
 
 
-class PostImage(models.Model):
+class PostImage(FileTrackingMixin, models.Model):
     post = models.ForeignKey(Post, related_name='images', on_delete=models.CASCADE)
     image = models.ImageField(upload_to='media/posts')
+    image_variants = GenericRelation('ImageVariant')
 
     @property
     def user(self):
@@ -259,3 +343,77 @@ class Promotion(models.Model):
     type = models.ForeignKey(PromotionType, related_name='promotions', on_delete=models.SET_NULL,
                              blank=True, null=True)
     end_date = models.DateField(blank=True)
+
+
+class BackgroundJob(FileTrackingMixin, models.Model):
+    """ Long operation run by celery. Client polls it to show progress and report """
+    kind = models.CharField(choices=job_kind_choices, max_length=12)
+    status = models.CharField(choices=job_status_choices, default='PENDING', max_length=7)
+    user = models.ForeignKey(User, related_name='jobs', on_delete=models.CASCADE)
+    params = models.JSONField(default=dict, blank=True)
+    file = models.FileField(upload_to='media/jobs', blank=True, null=True)
+    total = models.IntegerField(default=0)
+    processed = models.IntegerField(default=0)
+    report = models.JSONField(default=dict, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(blank=True, null=True)
+
+    def get_files(self):
+        return [self.file]
+
+
+class ImageVariant(FileTrackingMixin, models.Model):
+    """
+    Resized copy of uploaded image, created by 'main.images'.
+    Row 'ORIGINAL' has no file - it keeps size of uploaded image, so it is never opened to get dimensions
+    """
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveBigIntegerField()
+    content_object = GenericForeignKey()
+    field = models.CharField(max_length=30)
+    source = models.CharField(max_length=255)  # Name of uploaded file. Variants of replaced file are ignored
+    variant = models.CharField(choices=image_variant_choices, max_length=8)
+    format = models.CharField(choices=image_format_choices, max_length=4, blank=True, null=True)
+    file = models.FileField(upload_to='media/variants', blank=True, null=True)
+    width = models.IntegerField()
+    height = models.IntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['content_type', 'object_id'], name='image_variant_object_idx'),
+        ]
+
+    def get_files(self):
+        return [self.file]
+
+
+class FileDeletion(models.Model):
+    """
+    Journal of files to remove from storage. Written in transaction of change and drained by 'main.file_deletion'.
+    'field' is a label of file field like '_db.Flat.schema' - file is removed from storage of this field
+    """
+    name = models.CharField(max_length=255)
+    field = models.CharField(max_length=100, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(blank=True, null=True)
+
+    @staticmethod
+    def get_field_label(field):
+        return f'{field.model._meta.label}.{field.name}'
+
+    @property
+    def storage(self):
+        """ Rows without field or with field which doesn`t exist anymore use default storage """
+        model, _, name = self.field.rpartition('.')
+        try:
+            return apps.get_model(model)._meta.get_field(name).storage
+        except (LookupError, ValueError, FieldDoesNotExist, AttributeError):
+            return default_storage
+
+
+class NewPostEvent(models.Model):
+    """ Created posts to match with saved filters. Written after commit and drained by 'main.filter_matching' """
+    post = models.ForeignKey(Post, related_name='+', on_delete=models.CASCADE)
+    host = models.CharField(max_length=255)  # Domain for links in notifications
+    created = models.DateTimeField(auto_now_add=True)
@@ -1,54 +1,143 @@
 from django.db import models
+from django.db.models import F
 from django.dispatch import receiver
 from django.conf import settings
 from rest_framework.authtoken.models import Token
 
-import os
+from _db.models.models import House, Building, Section, Floor, Flat, Post, PostImage, BackgroundJob, ImageVariant, \
+    FileDeletion
+from _db.models.user import User, Attachment
 
 
-def delete_file_path(path):
-    if os.path.isfile(path):
-        os.remove(path)
+def queue_file_deletion(files, using=None):
+    """
+    Files are removed by 'main.tasks.drain_file_deletions'. Journal is written in transaction of change,
+    so rolled back changes keep their files and drain sees names only after commit
+    :param files: pairs (file field, name)
+    """
+    rows = [FileDeletion(name=name, field=FileDeletion.get_field_label(field)) for field, name in files if name]
+    if rows:
+        FileDeletion.objects.using(using).bulk_create(rows)
 
 
-@receiver(models.signals.pre_save)
-def delete_old_file_after_model_update(sender, instance, **kwargs):
-    if not instance.pk:
-        return False
+def delete_old_file_after_model_update(sender, instance, using, update_fields=None, **kwargs):
+    """
+    Old names are tracked since instance was loaded - see 'FileTrackingMixin', so no query is needed.
+    Saves which don`t touch file fields are skipped
+    """
+    original_files = getattr(instance, '_original_files', None)
+    if not instance.pk or not original_files:
+        return
+    files = []
+    for field in sender.get_file_fields():
+        if update_fields is not None and field.name not in update_fields:
+            continue
+        old = original_files.get(field.attname)
+        if old and old != getattr(instance, field.attname).name:
+            files.append((field, old))
+    queue_file_deletion(files, using)
 
-    try:
-        old_files = sender.objects.get(pk=instance.pk).get_files()
-    except (models.ObjectDoesNotExist, AttributeError):
-        return False
 
-    if old_files:
-        new_files = instance.get_files()
-        if new_files:
-            for new, old in zip(new_files, old_files):
-                if old != new:
-                    try:
-                        delete_file_path(old.path)
-                    except ValueError:
-                        """ To fix 'The 'instance' attribute has no file associated with it.' """
-                        continue
-
-
-@receiver(models.signals.pre_delete)
-def delete_diles_with_deleting_instance(sender, instance, **kwargs):
-    try:
-        files = instance.get_files()
-        if files:
-            for file in files:
-                try:
-                    delete_file_path(file.path)
-                except ValueError:
-                    """ To fix 'The 'instance' attribute has no file associated with it.' """
-                    continue
-    except AttributeError:
-        return False
+def delete_files_with_deleting_instance(sender, instance, using, **kwargs):
+    queue_file_deletion([(field, getattr(instance, field.attname).name) for field in sender.get_file_fields()], using)
 
 
 @receiver(models.signals.post_save, sender=settings.AUTH_USER_MODEL)
 def create_auth_token(sender, instance=None, created=False, **kwargs):
     if created:
         Token.objects.create(user=instance)
+
+
+@receiver(models.signals.post_save, sender=Building)
+def update_flats_location_with_building(sender, instance, created, **kwargs):
+    """ Keep denormalized location of flats consistent. New building has no flats yet """
+    if not created:
+        Flat.objects.filter(floor__section__building=instance).update(building_number=instance.number,
+                                                                     house=instance.house_id)
+
+
+@receiver(models.signals.post_save, sender=Section)
+def update_flats_location_with_section(sender, instance, created, **kwargs):
+    if not created:
+        building = instance.building
+        Flat.objects.filter(floor__section=instance).update(section_number=instance.number,
+                                                            building_number=building.number,
+                                                            house=building.house_id)
+
+
+@receiver(models.signals.post_save, sender=Floor)
+def update_flats_location_with_floor(sender, instance, created, **kwargs):
+    if not created:
+        section = instance.section
+        building = section.building
+        Flat.objects.filter(floor=instance).update(floor_number=instance.number,
+                                                   section_number=section.number,
+                                                   building_number=building.number,
+                                                   house=building.house_id)
+
+
+def change_house_counters(houses, **deltas):
+    """ Atomic increment of house counters - concurrent creates don`t lose updates """
+    changes = {field: F(field) + delta for field, delta in deltas.items() if delta}
+    if changes:
+        houses.update(**changes)
+
+
+@receiver(models.signals.post_save, sender=Building)
+def count_created_building(sender, instance, created, **kwargs):
+    if created:
+        change_house_counters(House.objects.filter(pk=instance.house_id), building_count=1)
+
+
+@receiver(models.signals.post_delete, sender=Building)
+def count_deleted_building(sender, instance, **kwargs):
+    change_house_counters(House.objects.filter(pk=instance.house_id), building_count=-1)
+
+
+@receiver(models.signals.post_save, sender=Section)
+def count_created_section(sender, instance, created, **kwargs):
+    if created:
+        change_house_counters(House.objects.filter(buildings=instance.building_id), section_count=1)
+
+
+@receiver(models.signals.post_delete, sender=Section)
+def count_deleted_section(sender, instance, **kwargs):
+    """ Cascade deletes sections before their building, so house is still found by building """
+    change_house_counters(House.objects.filter(buildings=instance.building_id), section_count=-1)
+
+
+@receiver(models.signals.post_save, sender=Floor)
+def count_created_floor(sender, instance, created, **kwargs):
+    if created:
+        change_house_counters(House.objects.filter(buildings__sections=instance.section_id), floor_count=1)
+
+
+@receiver(models.signals.post_delete, sender=Floor)
+def count_deleted_floor(sender, instance, **kwargs):
+    change_house_counters(House.objects.filter(buildings__sections=instance.section_id), floor_count=-1)
+
+
+@receiver(models.signals.post_save, sender=Flat)
+def count_saved_flat(sender, instance, created, **kwargs):
+    """ Flat can be moved to floor of another house and it can be booked or released """
+    old_house, old_booked = getattr(instance, '_counted_house_id', None), getattr(instance, '_counted_booked', None)
+    if created or old_house != instance.house_id:
+        if old_house and not created:
+            change_house_counters(House.objects.filter(pk=old_house), flat_count=-1,
+                                  booked_flat_count=-int(bool(old_booked)))
+        change_house_counters(House.objects.filter(pk=instance.house_id), flat_count=1,
+                              booked_flat_count=int(instance.booked))
+    elif old_booked is not None and old_booked != instance.booked:
+        change_house_counters(House.objects.filter(pk=instance.house_id),
+                              booked_flat_count=1 if instance.booked else -1)
+
+
+@receiver(models.signals.post_delete, sender=Flat)
+def count_deleted_flat(sender, instance, **kwargs):
+    change_house_counters(House.objects.filter(pk=instance.house_id), flat_count=-1,
+                          booked_flat_count=-int(instance.booked))
+
+
+for file_model in (House, Flat, Post, PostImage, BackgroundJob, ImageVariant, User, Attachment):
+    models.signals.pre_save.connect(delete_old_file_after_model_update, sender=file_model)
+    models.signals.pre_delete.connect(delete_files_with_deleting_instance, sender=file_model)
@@ -1,9 +1,11 @@
 from django.db import models
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin
+from django.contrib.contenttypes.fields import GenericRelation
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 from _db.models.manager import UserManager
+from _db.models.mixins import FileTrackingMixin
 from _db.models.validators import validate_file_extension
 
 
@@ -37,7 +39,7 @@ class CustomAbstractUser(AbstractBaseUser, PermissionsMixin):
         return None
 
 
-class User(CustomAbstractUser):
+class User(FileTrackingMixin, CustomAbstractUser):
     notification_choices = (
         ('ME', _('Мне')),
         ('MEANDAGENT', _('Мне и агенту')),
@@ -58,6 +60,7 @@ class User(CustomAbstractUser):
     end_date = models.DateField(blank=True, null=True)
     role = models.CharField(choices=role_choices, max_length=8, default='USER')
     photo = models.ImageField(upload_to='media/users/', blank=True, null=True)
+    image_variants = GenericRelation('ImageVariant')
     ban = models.BooleanField(default=False)
 
     def get_files(self):
@@ -71,15 +74,44 @@ class Contact(models.Model):
 
 
 class Message(models.Model):
+    # Foreign keys are covered by composite indexes below
     sender = models.ForeignKey(User, related_name='sent', on_delete=models.SET_NULL,
-                               blank=True, null=True)
+                               blank=True, null=True, db_index=False)
     receiver = models.ForeignKey(User, related_name='received', on_delete=models.SET_NULL,
-                                 blank=True, null=True)
+                                 blank=True, null=True, db_index=False)
     text = models.TextField()
     created = models.DateTimeField(auto_now_add=True)
 
-
-class Attachment(models.Model):
+    class Meta:
+        indexes = [
+            # History of user - see main.pagination.MessageKeysetPagination
+            models.Index(fields=['sender', '-created', '-id'], name='message_sender_idx'),
+            models.Index(fields=['receiver', '-created', '-id'], name='message_receiver_idx'),
+        ]
+
+
+class Conversation(models.Model):
+    """
+    Chat of owner with counterpart in inbox of owner - every pair of users has two rows.
+    Updated by 'main.conversations' when message is created
+    """
+    owner = models.ForeignKey(User, related_name='conversations', on_delete=models.CASCADE, db_index=False)
+    counterpart = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    last_message = models.ForeignKey(Message, related_name='+', on_delete=models.SET_NULL, blank=True, null=True)
+    last_activity = models.DateTimeField()
+    unread_count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'counterpart'], name='unique_conversation'),
+        ]
+        indexes = [
+            # Inbox - see main.pagination.ConversationKeysetPagination
+            models.Index(fields=['owner', '-last_activity', '-id'], name='conversation_inbox_idx'),
+        ]
+
+
+class Attachment(FileTrackingMixin, models.Model):
     message = models.ForeignKey(Message, related_name='attach', on_delete=models.CASCADE)
     file = models.FileField(upload_to='media/', validators=[validate_file_extension])
 
@@ -134,6 +166,12 @@ class UserFilter(models.Model):
     payment_cond = models.CharField(choices=payment_conditions_choices, max_length=10, blank=True, null=True)
     state = models.CharField(choices=state_choices, max_length=10, blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            # Buckets of filters for new posts - see main.filter_matching
+            models.Index(fields=['city', 'status', 'number_of_rooms', 'min_price'], name='user_filter_bucket_idx'),
+        ]
+
     @classmethod
     def set_limit(cls, value):
         cls.LIMIT = value
@@ -1,5 +1,7 @@
 from django.test import TestCase, override_settings
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.storage import default_storage
+from django.db import transaction
 from django.db.utils import IntegrityError
 
 from django.conf import settings
@@ -11,6 +13,8 @@ import datetime
 from _db.models.models import *
 from _db.models.user import User
 
+from main.tasks import drain_file_deletions
+
 
 class TestHouse(TestCase):
     def setUp(self) -> None:
@@ -73,6 +77,35 @@ class TestHouse(TestCase):
                                    floor=floor)
         self.assertIn(flat, floor.flats.all())
 
+    @override_settings(MEDIA_ROOT=tempfile.gettempdir())
+    def test_flat_denormalized_location(self):
+        """ Ensure flat location is copied from floor chain and follows its changes """
+        building = Building.objects.create(number=1, house=self.inst)
+        section = Section.objects.create(number=2, building=building)
+        floor = Floor.objects.create(number=3, section=section)
+        img = SimpleUploadedFile('image.jpeg', b'file_content', content_type='image/jpeg')
+        flat = Flat.objects.create(number=1, square=1, kitchen_square=1, price_per_metre=1, price=1, schema=img,
+                                   number_of_rooms=1, state='BLANK', foundation_doc='OWNER', plan='FREE',
+                                   balcony='YES', floor=floor)
+        self.assertEqual((flat.house, flat.building_number, flat.section_number, flat.floor_number),
+                         (self.inst, 1, 2, 3))
+
+        building.number = 10
+        building.save()
+        section.number = 20
+        section.save()
+        floor.number = 30
+        floor.save()
+        flat = Flat.objects.get(pk=flat.pk)
+        self.assertEqual((flat.building_number, flat.section_number, flat.floor_number), (10, 20, 30))
+
+        # Moving flat to another floor
+        another_floor = Floor.objects.create(number=5, section=section)
+        flat.floor = another_floor
+        flat.save(update_fields=['floor'])
+        self.assertEqual(Flat.objects.get(pk=flat.pk).floor_number, 5)
+        self.assertEqual(Flat.objects.filter(house=self.inst, floor_number=5).count(), 1)
+
     def test_building_raising_error(self):
         with self.assertRaises(IntegrityError):
             Building.objects.create(number=1)
@@ -159,12 +192,47 @@ class TestPost(TestCase):
         first_image = os.path.split(image.image.path)[-1]
         self.assertIn(first_image, os.listdir(MEDIA_ROOT))
 
+        # Files are removed only after commit, by celery task which drains deletion journal
         image.image = img2
         image.save()
-        
+        self.assertEqual(list(FileDeletion.objects.values_list('field', flat=True)), ['_db.PostImage.image'])
+        self.assertIn(first_image, os.listdir(MEDIA_ROOT))
+        drain_file_deletions.apply()
+
         new_image = os.path.split(image.image.path)[-1]
         self.assertIn(new_image, os.listdir(MEDIA_ROOT))
         self.assertNotIn(first_image, os.listdir(MEDIA_ROOT))
+        self.assertFalse(FileDeletion.objects.exists())
+
+        # Loaded instance knows its file names, so save without file changes is one UPDATE
+        loaded = PostImage.objects.get(pk=image.pk)
+        with self.assertNumQueries(1):
+            loaded.save()
+        loaded.image = SimpleUploadedFile('third.jpeg', b'file_content', content_type='image/jpeg')
+        loaded.save(update_fields=['post'])
+        self.assertFalse(FileDeletion.objects.exists())
+        loaded.save()
+        drain_file_deletions.apply()
+        self.assertNotIn(new_image, os.listdir(MEDIA_ROOT))
+
+        # Rolled back deletion keeps file
+        third_image = os.path.split(loaded.image.path)[-1]
+        with transaction.atomic():
+            loaded.delete()
+            transaction.set_rollback(True)
+        self.assertFalse(FileDeletion.objects.exists())
+
+        # Files of cascade are written to journal with deleted rows
+        PostImage.objects.create(image=img, post=inst)
+        inst.delete()
+        self.assertEqual(FileDeletion.objects.count(), 2)
+        self.assertEqual(drain_file_deletions.apply().get(), (2, 0))
+        self.assertNotIn(third_image, os.listdir(MEDIA_ROOT))
+
+        # File is removed from storage of its field, rows without known field use default storage
+        self.assertIs(FileDeletion(field='_db.PostImage.image').storage, PostImage._meta.get_field('image').storage)
+        self.assertIs(FileDeletion(field='').storage, default_storage)
+        self.assertIs(FileDeletion(field='_db.PostImage.removed').storage, default_storage)
 
     def test_post_migrate_signal(self):
         self.assertEqual(PromotionType.objects.count(), 3)
@@ -0,0 +1,57 @@
+"""
+Chessboard - complete structure of house: buildings -> sections -> floors -> flats.
+It is built from one query over flats, because every flat stores its location (see '_db.models.models.Flat').
+Result is cached per house in shared cache. 'main.receivers' invalidate it after commit when flat, floor, section
+or building is changed.
+"""
+from django.core.cache import cache
+from django.db import transaction
+
+from itertools import groupby
+from operator import itemgetter
+
+from _db.models.models import Flat
+
+# Flat is a row of values in this order, so big houses don`t repeat keys in every flat
+FLAT_FIELDS = ('id', 'number', 'price', 'number_of_rooms', 'booked', 'owned')
+LOCATION_FIELDS = ('building_number', 'section_number', 'floor_number')
+# Limits staleness if invalidation is lost, e.g. when structure is changed by raw SQL
+TIMEOUT = 60 * 60
+
+
+def get_key(house_pk):
+    return f'chessboard:{house_pk}'
+
+
+def build_chessboard(house_pk):
+    rows = Flat.objects.filter(house=house_pk)\
+        .order_by(*LOCATION_FIELDS, 'number', 'id')\
+        .values_list(*LOCATION_FIELDS, *FLAT_FIELDS)
+    buildings = []
+    for building, building_rows in groupby(rows, itemgetter(0)):
+        sections = []
+        for section, section_rows in groupby(building_rows, itemgetter(1)):
+            floors = [{'number': floor, 'flats': [list(row[len(LOCATION_FIELDS):]) for row in floor_rows]}
+                      for floor, floor_rows in groupby(section_rows, itemgetter(2))]
+            sections.append({'number': section, 'floors': floors})
+        buildings.append({'number': building, 'sections': sections})
+    return {'house': house_pk, 'flat_fields': FLAT_FIELDS, 'buildings': buildings}
+
+
+def get_chessboard(house_pk):
+    key = get_key(house_pk)
+    chessboard = cache.get(key)
+    if chessboard is None:
+        chessboard = build_chessboard(house_pk)
+        cache.set(key, chessboard, timeout=TIMEOUT)
+    return chessboard
+
+
+def invalidate(*house_pks):
+    """
+    Cache is cleared after commit. Request which comes before commit would build chessboard from old rows
+    and keep it in cache for TIMEOUT
+    """
+    keys = [get_key(pk) for pk in house_pks if pk]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
@@ -0,0 +1,84 @@
+"""
+Inbox of user - '_db.models.user.Conversation'. Rows are changed by new messages without reading history:
+missing rows of all pairs are created by one INSERT and every pair is changed by one UPDATE with F expressions,
+so concurrent messages don`t lose unread counters.
+"""
+from django.db.models import F, Value, Case, When, DateTimeField, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Greatest
+
+from collections import Counter
+
+from _db.models.user import Conversation, Message
+
+
+def get_changes(messages):
+    """ :return: dict {(owner, counterpart): (last message, number of unread messages)} """
+    changes = {}
+    for message in messages:
+        if not message.sender_id or not message.receiver_id:
+            continue
+        sides = [(message.sender_id, message.receiver_id, 0)]
+        if message.sender_id != message.receiver_id:
+            sides.append((message.receiver_id, message.sender_id, 1))
+        for owner, counterpart, unread in sides:
+            last, count = changes.get((owner, counterpart), (None, 0))
+            if last is None or (message.created, message.pk) > (last.created, last.pk):
+                last = message
+            changes[owner, counterpart] = (last, count + unread)
+    return changes
+
+
+def record_messages(messages):
+    """ Apply created messages to conversations of senders and receivers """
+    changes = get_changes(messages)
+    if not changes:
+        return
+    Conversation.objects.bulk_create([Conversation(owner_id=owner, counterpart_id=counterpart,
+                                                   last_activity=last.created)
+                                      for (owner, counterpart), (last, _) in changes.items()],
+                                     ignore_conflicts=True)
+    for (owner, counterpart), (last, unread) in changes.items():
+        created = Value(last.created, output_field=DateTimeField())
+        # Message committed later than newer one doesn`t become last
+        Conversation.objects.filter(owner=owner, counterpart=counterpart).update(
+            last_message=Case(When(last_activity__lte=created, then=Value(last.pk)), default=F('last_message'),
+                              output_field=IntegerField()),
+            last_activity=Greatest('last_activity', created),
+            unread_count=F('unread_count') + unread,
+        )
+
+
+def record_broadcast(sender, messages):
+    """
+    Apply messages of one sender to many receivers - see 'main.notifications'.
+    Conversations are changed by a few UPDATE statements for all receivers, last message is found
+    by subquery, so pks of created messages aren`t needed (bulk_create doesn`t set them on every database)
+    """
+    counts = Counter(message.receiver_id for message in messages)
+    created = Value(max(message.created for message in messages), output_field=DateTimeField())
+    Conversation.objects.bulk_create([Conversation(owner_id=owner, counterpart_id=counterpart,
+                                                   last_activity=created.value)
+                                      for receiver in counts
+                                      for owner, counterpart in ((receiver, sender), (sender, receiver))],
+                                     ignore_conflicts=True)
+
+    def get_changes(receiver):
+        last = (Message.objects.filter(sender=sender, receiver=OuterRef(receiver))
+                .order_by('-created', '-id').values('pk')[:1])
+        return {
+            'last_message': Case(When(last_activity__lte=created, then=Subquery(last)), default=F('last_message'),
+                                 output_field=IntegerField()),
+            'last_activity': Greatest('last_activity', created),
+        }
+
+    by_count = {}
+    for receiver, count in counts.items():
+        by_count.setdefault(count, []).append(receiver)
+    for count, receivers in by_count.items():
+        Conversation.objects.filter(owner__in=receivers, counterpart=sender).update(
+            unread_count=F('unread_count') + count, **get_changes('owner'))
+    Conversation.objects.filter(owner=sender, counterpart__in=list(counts)).update(**get_changes('counterpart'))
+
+
+def mark_read(owner, counterpart):
+    return Conversation.objects.filter(owner=owner, counterpart=counterpart).update(unread_count=0)
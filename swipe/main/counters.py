@@ -0,0 +1,164 @@
+"""
+Write-behind counters for posts.
+Views, likes and weight deltas are accumulated in cache instead of updating post row on every request.
+'flush' applies them in batches with F() updates. It is called by 'main.tasks.flush_post_counters'.
+'counters' cache has to be shared between web and celery processes, atomic and without eviction - redis.
+It is checked on start by 'check_cache', local memory cache is allowed only in tests.
+"""
+from collections import defaultdict
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models import F
+
+FIELDS = ('views', 'likes', 'weight')
+PREFIX = 'post_counters'
+SHARED_BACKENDS = ('django_redis.cache.RedisCache', )
+# Position which is taken but not written yet is waited for. Writer could die between - then it is skipped
+GAP_TIMEOUT = 300
+# Post whose position was skipped is queued again by next delta after this time
+QUEUED_TIMEOUT = 3600
+# Keys flushed to zero expire, so posts which aren`t viewed anymore don`t stay in cache.
+# Next delta queues post again and makes its keys persistent
+FLUSHED_TIMEOUT = 3600
+
+
+def get_cache():
+    return caches['counters']
+
+
+def check_cache():
+    """ Called on start of app """
+    backend = settings.CACHES['counters']['BACKEND']
+    if backend not in SHARED_BACKENDS and not settings.TESTING:
+        raise ImproperlyConfigured(f'"counters" cache has to be shared between processes - use one of '
+                                   f'{", ".join(SHARED_BACKENDS)}, not {backend}')
+
+
+def get_key(pk, field):
+    return f'{PREFIX}:{pk}:{field}'
+
+
+def incr(cache, key, delta):
+    """ 'incr' and 'add' are atomic, so concurrent requests don`t lose deltas """
+    try:
+        return cache.incr(key, delta)
+    except ValueError:
+        if cache.add(key, delta, timeout=None):
+            return delta
+        return cache.incr(key, delta)
+
+
+def add(pk, **deltas):
+    """
+    Add deltas for post. Post is put to queue once until it is flushed.
+    :param pk: post pk
+    :param deltas: 'views', 'likes', 'weight'
+    """
+    cache = get_cache()
+    keys = []
+    for field, delta in deltas.items():
+        assert field in FIELDS, f'Unknown counter {field}'
+        if delta:
+            keys.append(get_key(pk, field))
+            incr(cache, keys[-1], delta)
+    if cache.add(f'{PREFIX}:{pk}:queued', 1, timeout=QUEUED_TIMEOUT):
+        # Keys could be flushed to zero before and expire with delta
+        for key in keys:
+            cache.touch(key, None)
+        position = incr(cache, f'{PREFIX}:queue', 1)
+        cache.set(f'{PREFIX}:queue:{position}', pk, timeout=None)
+
+
+def get_pending(pks):
+    """ :return: dict {pk: {field: delta}} with not flushed deltas """
+    cache = get_cache()
+    keys = {get_key(pk, field): (pk, field) for pk in pks for field in FIELDS}
+    pending = defaultdict(dict)
+    for key, value in cache.get_many(keys).items():
+        if value:
+            pk, field = keys[key]
+            pending[pk][field] = value
+    return pending
+
+
+def apply_pending(posts):
+    """ Add not flushed deltas to post instances, so user sees actual values """
+    pending = get_pending([post.pk for post in posts])
+    for post in posts:
+        for field, delta in pending.get(post.pk, {}).items():
+            setattr(post, field, getattr(post, field) + delta)
+
+
+def get_position_key(position):
+    return f'{PREFIX}:queue:{position}'
+
+
+def is_lost(cache, position):
+    """ Position is taken by 'add', but pk isn`t written for GAP_TIMEOUT """
+    first_seen = cache.get_or_set(f'{get_position_key(position)}:missing', time.time(), timeout=None)
+    return time.time() - first_seen > GAP_TIMEOUT
+
+
+def flush(batch_size=1000):
+    """
+    Move accumulated deltas to database. Called by celery, outside of transaction.
+    Posts with the same deltas (e.g. one view) are updated by one query.
+    Queue is read up to the first position which isn`t written yet - 'add' takes position before writing pk.
+    Deltas are subtracted from cache after commit, so failed update doesn`t lose them. Keys which become zero
+    expire after FLUSHED_TIMEOUT.
+    :return: number of updated posts
+    """
+    from _db.models.models import Post
+
+    cache = get_cache()
+    # Only one flush at a time. Lock expires if worker dies
+    if not cache.add(f'{PREFIX}:lock', 1, timeout=300):
+        return 0
+    try:
+        position = cache.get(f'{PREFIX}:flushed', 0)
+        end = cache.get(f'{PREFIX}:queue', 0)
+        updated = 0
+        while position < end:
+            keys = [get_position_key(item) for item in range(position + 1, min(position + batch_size, end) + 1)]
+            values = cache.get_many(keys)
+            ready = []
+            for offset, key in enumerate(keys):
+                if key not in values and not is_lost(cache, position + offset + 1):
+                    break
+                ready.append(key)
+            if not ready:
+                break
+            pks = {values[key] for key in ready if key in values}
+            # Remove mark before reading deltas - post which gets new delta will be queued again
+            cache.delete_many([f'{PREFIX}:{pk}:queued' for pk in pks])
+            pending = get_pending(pks)
+            groups = defaultdict(list)
+            for pk, deltas in pending.items():
+                groups[tuple(sorted(deltas.items()))].append(pk)
+            with transaction.atomic():
+                for deltas, group in groups.items():
+                    updated += Post.objects.filter(pk__in=group)\
+                        .update(**{field: F(field) + delta for field, delta in deltas})
+            for pk, deltas in pending.items():
+                for field, delta in deltas.items():
+                    # Subtract only what was written. Deltas added meanwhile stay in cache
+                    key = get_key(pk, field)
+                    if not cache.decr(key, delta):
+                        cache.touch(key, FLUSHED_TIMEOUT)
+            cache.delete_many(ready + [f'{key}:missing' for key in ready])
+            position += len(ready)
+            cache.set(f'{PREFIX}:flushed', position, timeout=None)
+            if len(ready) < len(keys):
+                break
+        return updated
+    finally:
+        cache.delete(f'{PREFIX}:lock')
+
+
+def clear():
+    """ Drop all not flushed deltas """
+    get_cache().clear()
@@ -0,0 +1,41 @@
+"""
+Removal of files from storage. Names are written to '_db.models.models.FileDeletion' in transaction of change
+by '_db.models.receiver' and the journal is drained by celery in batches. File is removed from storage of its field.
+Failed names stay in journal and are retried by next drain until MAX_ATTEMPTS.
+"""
+from django.db import transaction
+from django.db.models import F
+
+from _db.models.models import FileDeletion
+
+BATCH_SIZE = 500
+MAX_ATTEMPTS = 5
+
+
+def drain(batch_size=BATCH_SIZE):
+    """
+    Rows locked by another worker are skipped (PostgreSQL). Every row is tried once per drain.
+    :return: tuple (number of deleted files, number of failures)
+    """
+    deleted, failed, last_pk = 0, 0, 0
+    while True:
+        with transaction.atomic():
+            rows = list(FileDeletion.objects.select_for_update(skip_locked=True)
+                        .filter(pk__gt=last_pk, attempts__lt=MAX_ATTEMPTS).order_by('pk')[:batch_size])
+            if not rows:
+                break
+            done, errors = [], {}
+            for row in rows:
+                try:
+                    row.storage.delete(row.name)
+                    done.append(row.pk)
+                except OSError as e:
+                    errors[row.pk] = str(e)
+            FileDeletion.objects.filter(pk__in=done).delete()
+            # Failures are rare, so they are updated one by one
+            for pk, error in errors.items():
+                FileDeletion.objects.filter(pk=pk).update(attempts=F('attempts') + 1, error=error)
+        deleted, failed, last_pk = deleted + len(done), failed + len(errors), rows[-1].pk
+        if len(rows) < batch_size:
+            break
+    return deleted, failed
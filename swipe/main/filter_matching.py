@@ -0,0 +1,180 @@
+"""
+Matching of new posts with saved filters of users - filters are indexed, posts are queries.
+Filter is a conjunction of predicates, empty field of filter matches any post:
+equality of market, payment, status, city, address, rooms and state, ranges of price and square.
+Filters are grouped in buckets by city, status and rooms. Post looks only in its buckets - with own values
+and with empty ones, these buckets are read by 'user_filter_bucket_idx' together with bounds of price, so only
+filters which price of some post satisfies are loaded. Inside bucket filters are sorted by min price
+and cut by bisect for every post.
+New posts are queued by 'publish' and matched by 'drain' in batches - one index for the whole batch.
+"""
+from django.db import transaction
+from django.db.models import Q
+from django.urls import reverse
+
+from bisect import bisect_right
+from collections import defaultdict
+from itertools import product
+
+from main import notifications
+
+from _db.models.models import NewPostEvent
+from _db.models.user import User, UserFilter
+
+BUCKET_FIELDS = ('city', 'status', 'number_of_rooms')
+EQUALITY_FIELDS = ('market', 'payment_cond', 'address', 'state')
+RANGE_FIELDS = (('price', 'min_price', 'max_price'), ('square', 'min_square', 'max_square'))
+FIELDS = ('pk', 'user') + BUCKET_FIELDS + EQUALITY_FIELDS + tuple(
+    bound for _, *bounds in RANGE_FIELDS for bound in bounds)
+# Filter with the biggest number of rooms means 'this or more'
+MAX_ROOMS = UserFilter.number_of_rooms_choices[-1][0]
+NO_BOUND = float('-inf')
+BATCH_SIZE = 100
+TEMPLATE = 'Новое объявление подходит под один из ваших фильтров - {url}'
+
+
+def get_post_values(post):
+    """
+    Values of post for predicates of filter. Post needs 'house' and 'flat'.
+    Filter keeps choices of post as they are - see 'UserFilterSerializer', so values are compared directly
+    """
+    return {
+        'market': post.living_type,
+        'payment_cond': post.payment_options,
+        'city': post.house.city,
+        'status': post.house.status,
+        'address': post.house.address,
+        'number_of_rooms': min(post.flat.number_of_rooms, MAX_ROOMS),
+        'state': post.flat.state,
+        'price': post.price,
+        'square': post.flat.square,
+    }
+
+
+def get_bucket_keys(values):
+    """ Buckets where post can find filters: every field is value of post or empty """
+    return set(product(*[(values[field], None) for field in BUCKET_FIELDS]))
+
+
+def get_bucket_query(keys):
+    """
+    :param keys: dict {bucket key: (min price, max price) of posts in bucket}
+    Price bounds are in the query, so only filters which can match are read from 'user_filter_bucket_idx'
+    """
+    query = Q()
+    for key, (low, high) in keys.items():
+        lookups = {}
+        for field, value in zip(BUCKET_FIELDS, key):
+            if value is None:
+                lookups[f'{field}__isnull'] = True
+            else:
+                lookups[field] = value
+        query |= (Q(**lookups) & (Q(min_price__lte=high) | Q(min_price__isnull=True))
+                  & (Q(max_price__gte=low) | Q(max_price__isnull=True)))
+    return query
+
+
+def is_any(field, value):
+    return value is None or (field == 'market' and value == 'ALL')
+
+
+def matches(row, values):
+    for field in EQUALITY_FIELDS:
+        if not is_any(field, row[field]) and row[field] != values[field]:
+            return False
+    for field, low, high in RANGE_FIELDS:
+        value = values[field]
+        if row[low] is not None and (value is None or value < row[low]):
+            return False
+        if row[high] is not None and (value is None or value > row[high]):
+            return False
+    return True
+
+
+class FilterIndex:
+    def __init__(self, rows):
+        """ :param rows: dicts with 'FIELDS' of filters """
+        buckets = defaultdict(list)
+        for row in rows:
+            buckets[tuple(row[field] for field in BUCKET_FIELDS)].append(row)
+        self.buckets = {}
+        for key, bucket in buckets.items():
+            bucket.sort(key=self.get_min_price)
+            self.buckets[key] = ([self.get_min_price(row) for row in bucket], bucket)
+
+    @staticmethod
+    def get_min_price(row):
+        return row['min_price'] if row['min_price'] is not None else NO_BOUND
+
+    @classmethod
+    def for_posts(cls, values):
+        """
+        Index of filters from buckets of posts - one query for any number of posts
+        :param values: values of posts, see 'get_post_values'
+        """
+        keys = {}
+        for item in values:
+            price = item['price']
+            for key in get_bucket_keys(item):
+                low, high = keys.get(key, (price, price))
+                keys[key] = (min(low, price), max(high, price))
+        if not keys:
+            return cls([])
+        return cls(UserFilter.objects.filter(get_bucket_query(keys)).values(*FIELDS))
+
+    def match(self, values):
+        """ :return: rows of filters satisfied by post """
+        price = values['price'] if values['price'] is not None else NO_BOUND
+        found = []
+        for key in get_bucket_keys(values):
+            if key not in self.buckets:
+                continue
+            min_prices, bucket = self.buckets[key]
+            found.extend(row for row in bucket[:bisect_right(min_prices, price)] if matches(row, values))
+        return found
+
+
+def publish(post, host):
+    """
+    Queue is written after commit, so request isn`t delayed and rolled back post isn`t matched.
+    Drain is started at once - posts which come together are matched by one run, beat only picks up leftovers
+    """
+    # 'main.tasks' imports this module
+    from main.tasks import drain_new_posts
+
+    def queue():
+        NewPostEvent.objects.create(post_id=post.pk, host=host)
+        drain_new_posts.delay()
+
+    transaction.on_commit(queue)
+
+
+def drain(batch_size=BATCH_SIZE):
+    """
+    Match queued posts and notify owners of matched filters.
+    Events locked by another worker are skipped (PostgreSQL).
+    :return: tuple (number of matched posts, number of created messages)
+    """
+    posts, sent = 0, 0
+    while True:
+        with transaction.atomic():
+            events = list(NewPostEvent.objects.select_for_update(skip_locked=True, of=('self', ))
+                          .select_related('post__house', 'post__flat', 'post__user').order_by('pk')[:batch_size])
+            if not events:
+                break
+            # Post can be hidden with house or user while it waits in queue
+            events_to_match = [event for event in events
+                               if not event.post.house.hidden and event.post.user.is_active]
+            values = [get_post_values(event.post) for event in events_to_match]
+            index = FilterIndex.for_posts(values)
+            for event, post_values in zip(events_to_match, values):
+                users = {row['user'] for row in index.match(post_values)}
+                users.discard(event.post.user_id)
+                if users:
+                    url = f'http://{event.host}{reverse("main:posts-detail", args=[event.post_id])}'
+                    sent += notifications.notify(User.objects.filter(pk__in=users), TEMPLATE, url=url)
+            NewPostEvent.objects.filter(pk__in=[event.pk for event in events]).delete()
+        posts += len(events)
+        if len(events) < batch_size:
+            break
+    return posts, sent
@@ -0,0 +1,172 @@
+"""
+Import of flats from CSV or XLSX file.
+File is read row by row, rows are validated by Flat fields and inserted by chunks with 'bulk_create'.
+Floors are resolved by (building, section, floor) numbers from one query.
+Invalid rows are skipped and listed in report.
+"""
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils.translation import gettext as _
+
+from main import chessboard
+from main.jobs import JobError, set_progress
+
+from _db.models.models import House, Floor, Flat
+
+from contextlib import closing
+from itertools import islice
+import csv
+import io
+import os
+
+LOCATION_COLUMNS = ('building', 'section', 'floor')
+FLAT_COLUMNS = ('number', 'square', 'kitchen_square', 'price_per_metre', 'price', 'number_of_rooms', 'state',
+                'foundation_doc', 'type', 'plan', 'balcony', 'heating')
+OPTIONAL_COLUMNS = ('type', 'heating')
+CHUNK_SIZE = 500
+MAX_ERRORS = 1000
+
+
+def read_csv(file):
+    text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    try:
+        yield from csv.reader(text)
+    finally:
+        # Wrapper closes file when it is collected
+        text.detach()
+
+
+def is_empty(row):
+    return all(value in (None, '') for value in row)
+
+
+def count_csv(file):
+    """ Rows are counted like in 'get_rows' - without header and empty rows """
+    rows = read_csv(file)
+    next(rows, None)
+    return sum(1 for row in rows if not is_empty(row))
+
+
+def read_xlsx(file):
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        yield from workbook.active.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def count_xlsx(file):
+    """ Dimension from file metadata. Rows are not read """
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file, read_only=True)
+    try:
+        return max((workbook.active.max_row or 1) - 1, 0)
+    finally:
+        workbook.close()
+
+
+FORMATS = {
+    '.csv': (read_csv, count_csv),
+    '.xlsx': (read_xlsx, count_xlsx),
+}
+
+
+def get_format(name):
+    extension = os.path.splitext(name)[1].lower()
+    if extension not in FORMATS:
+        raise JobError(_('Unsupported file format. Use: {formats}').format(formats=', '.join(FORMATS)))
+    return FORMATS[extension]
+
+
+def get_rows(rows):
+    """
+    First row is header. Empty rows are skipped.
+    :return: iterator of tuples (line number, dict with row)
+    """
+    header = [str(column).strip().lower() if column is not None else '' for column in next(rows, ())]
+    missing = [column for column in LOCATION_COLUMNS + FLAT_COLUMNS
+               if column not in header and column not in OPTIONAL_COLUMNS]
+    if missing:
+        raise JobError(_('Missing columns: {columns}').format(columns=', '.join(missing)))
+    for line, row in enumerate(rows, start=2):
+        if not is_empty(row):
+            yield line, dict(zip(header, row))
+
+
+def validate_row(row, floors):
+    """ :return: tuple (Flat or None, dict with errors) """
+    errors = {}
+    location = []
+    for column in LOCATION_COLUMNS:
+        try:
+            location.append(int(row.get(column)))
+        except (TypeError, ValueError):
+            errors[column] = [_('Enter a whole number.')]
+    floor = floors.get(tuple(location))
+    if not errors and floor is None:
+        errors['floor'] = [_('Floor doesn`t exist')]
+
+    values = {}
+    for column in FLAT_COLUMNS:
+        field = Flat._meta.get_field(column)
+        value = row.get(column)
+        if value in (None, '') and field.has_default():
+            continue
+        try:
+            values[column] = field.clean(value, None)
+        except ValidationError as e:
+            errors[column] = e.messages
+    if errors:
+        return None, errors
+    building, section, floor_number = location
+    return Flat(floor_id=floor, building_number=building, section_number=section, floor_number=floor_number,
+                **values), errors
+
+
+def import_flats(job):
+    """
+    Handler for 'main.jobs.run'.
+    :param job: BackgroundJob with 'house' in params and file
+    :return: report
+    """
+    house = House.objects.get(pk=job.params['house'])
+    read, count = get_format(job.file.name)
+    floors = dict(((building, section, number), pk) for pk, building, section, number in
+                  Floor.objects.filter(section__building__house=house)
+                  .values_list('pk', 'section__building__number', 'section__number', 'number'))
+
+    created, processed, errors, error_count = 0, 0, [], 0
+    with job.file.open('rb') as file:
+        set_progress(job, 0, count(file))
+        file.seek(0)
+        # Reader is closed while file is still open
+        with closing(read(file)) as reader:
+            rows = get_rows(reader)
+            while True:
+                chunk = list(islice(rows, CHUNK_SIZE))
+                if not chunk:
+                    break
+                flats = []
+                for line, row in chunk:
+                    flat, row_errors = validate_row(row, floors)
+                    if flat:
+                        flat.house = house
+                        flats.append(flat)
+                    else:
+                        error_count += 1
+                        if len(errors) < MAX_ERRORS:
+                            errors.append({'row': line, 'errors': row_errors})
+                with transaction.atomic():
+                    Flat.objects.bulk_create(flats)
+                created += len(flats)
+                processed += len(chunk)
+                set_progress(job, processed)
+    # Counted total is estimate for XLSX - its dimension includes empty rows
+    set_progress(job, processed, processed)
+
+    House.objects.filter(pk=house.pk).recount()
+    chessboard.invalidate(house.pk)
+    return {'created': created, 'error_count': error_count, 'errors': errors}
@@ -1,8 +1,205 @@
-from django.contrib.postgres.search import SearchVector, SearchQuery, SearchRank
+"""
+Full text search for posts.
+Post is searched by city (most important), address and name of the house and by description (least important).
+Implementation depends on database engine - see 'get_backend'. All backends share one API:
+'search' and 'get_queryset' return queryset annotated with 'rank' (bigger is better) and ordered by it.
+"""
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, Q, Value, CharField, FloatField
+from django.utils.module_loading import import_string
+
+import re
+
+# Relative importance of searchable parts. Matches PostgreSQL default weights for A, B, B, C labels
+WEIGHTS = (
+    ('city', 1.0),
+    ('address', 0.4),
+    ('name', 0.4),
+    ('description', 0.2),
+)
+ORDERING = ('-rank', '-weight', '-created', '-id')
+
+
+class BaseSearchBackend:
+    """ Fallback without index for other database engines. Every word has to be found in any part of post """
+
+    def search(self, queryset, query):
+        """ Search in all parts of post """
+        for word in query.split():
+            queryset = queryset.filter(Q(house__city__icontains=word) | Q(house__address__icontains=word) |
+                                       Q(house__name__icontains=word) | Q(description__icontains=word))
+        return queryset.annotate(rank=Value(1.0, output_field=FloatField())).order_by(*ORDERING)
+
+    def get_queryset(self, queryset, city):
+        """ Search only by city of the house """
+        return queryset.filter(house__city__iexact=city)\
+            .annotate(rank=Value(1.0, output_field=FloatField())).order_by(*ORDERING)
+
+    def index_posts(self, queryset, house):
+        """ Refresh index for posts of the house. Called after post or house is saved """
+
+    def install(self, connection):
+        """ Create database objects required by backend. Called after migrations """
+
+    def rebuild(self, connection=connection):
+        """ Reindex all posts """
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """ Uses stored 'Post.search_vector' with GIN index """
+
+    def get_search_vector(self, house):
+        """ House values are passed as parameters, so one UPDATE can refresh all posts of the house """
+        from django.contrib.postgres.search import SearchVector
+
+        return (SearchVector(Value(house.city, output_field=CharField()), weight='A') +
+                SearchVector(Value(house.address, output_field=CharField()), weight='B') +
+                SearchVector(Value(house.name, output_field=CharField()), weight='B') +
+                SearchVector('description', weight='C'))
+
+    def search(self, queryset, query):
+        from django.contrib.postgres.search import SearchQuery, SearchRank
+
+        search_query = SearchQuery(query, search_type='websearch')
+        return queryset.filter(search_vector=search_query)\
+            .annotate(rank=SearchRank(F('search_vector'), search_query))\
+            .order_by(*ORDERING)
+
+    def get_queryset(self, queryset, city):
+        """ Only matches in city part of vector (weight 'A') are ranked above zero """
+        from django.contrib.postgres.search import SearchQuery, SearchRank
+
+        search_query = SearchQuery(city)
+        return queryset.filter(search_vector=search_query)\
+            .annotate(rank=SearchRank(F('search_vector'), search_query, weights=[0.0, 0.0, 0.0, 1.0]))\
+            .filter(rank__gt=0).order_by(*ORDERING)
+
+    def index_posts(self, queryset, house):
+        queryset.update(search_vector=self.get_search_vector(house))
+
+    def rebuild(self, connection=connection):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "UPDATE _db_post SET search_vector = "
+                "setweight(to_tsvector(COALESCE(h.city, '')), 'A') || "
+                "setweight(to_tsvector(COALESCE(h.address, '')), 'B') || "
+                "setweight(to_tsvector(COALESCE(h.name, '')), 'B') || "
+                "setweight(to_tsvector(COALESCE(_db_post.description, '')), 'C') "
+                "FROM _db_house h WHERE h.id = _db_post.house_id"
+            )
+
+
+class SqliteSearchBackend(BaseSearchBackend):
+    """
+    FTS5 virtual table 'post_search' with rowid equal to post id.
+    It is kept in sync by triggers on post and house tables, so bulk operations are indexed too.
+    Triggers are dropped when SQLite migration remakes the table - 'install' restores them after every migrate.
+    """
+    table = 'post_search'
+    triggers = {
+        'post_search_post_insert': '''
+            CREATE TRIGGER IF NOT EXISTS post_search_post_insert AFTER INSERT ON _db_post BEGIN
+                INSERT INTO post_search(rowid, city, address, name, description)
+                SELECT NEW.id, h.city, h.address, h.name, COALESCE(NEW.description, '')
+                FROM _db_house h WHERE h.id = NEW.house_id;
+            END''',
+        'post_search_post_update': '''
+            CREATE TRIGGER IF NOT EXISTS post_search_post_update AFTER UPDATE OF description, house_id ON _db_post
+            BEGIN
+                DELETE FROM post_search WHERE rowid = OLD.id;
+                INSERT INTO post_search(rowid, city, address, name, description)
+                SELECT NEW.id, h.city, h.address, h.name, COALESCE(NEW.description, '')
+                FROM _db_house h WHERE h.id = NEW.house_id;
+            END''',
+        'post_search_post_delete': '''
+            CREATE TRIGGER IF NOT EXISTS post_search_post_delete AFTER DELETE ON _db_post BEGIN
+                DELETE FROM post_search WHERE rowid = OLD.id;
+            END''',
+        'post_search_house_update': '''
+            CREATE TRIGGER IF NOT EXISTS post_search_house_update AFTER UPDATE OF city, address, name ON _db_house
+            BEGIN
+                DELETE FROM post_search WHERE rowid IN (SELECT id FROM _db_post WHERE house_id = NEW.id);
+                INSERT INTO post_search(rowid, city, address, name, description)
+                SELECT p.id, NEW.city, NEW.address, NEW.name, COALESCE(p.description, '')
+                FROM _db_post p WHERE p.house_id = NEW.id;
+            END''',
+    }
+
+    def get_match(self, query, column=None):
+        """
+        User input is not trusted FTS5 syntax. Every word is quoted, so words are joined with AND.
+        :return: string for MATCH or None if there are no words
+        """
+        words = re.findall(r'\w+', query)
+        if not words:
+            return None
+        match = ' '.join(f'"{word}"' for word in words)
+        return f'{column} : ({match})' if column else match
+
+    def filter(self, queryset, match):
+        """
+        Posts are joined with FTS table, so MATCH is evaluated once per query.
+        Correlated subquery for rank would run MATCH for every row.
+        """
+        if match is None:
+            return queryset.none()
+        weights = ', '.join(str(weight) for _, weight in WEIGHTS)
+        table = queryset.model._meta.db_table
+        # bm25 is negative - the better match, the smaller value
+        return queryset.extra(select={'rank': f'-bm25({self.table}, {weights})'},
+                              tables=[self.table],
+                              where=[f'{self.table}.rowid = "{table}"."id"', f'{self.table} MATCH %s'],
+                              params=[match])\
+            .order_by(*ORDERING)
+
+    def search(self, queryset, query):
+        return self.filter(queryset, self.get_match(query))
+
+    def get_queryset(self, queryset, city):
+        return self.filter(queryset, self.get_match(city, column='city'))
+
+    def install(self, connection):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'post_search_%'")
+            existing = {row[0] for row in cursor.fetchall()}
+            cursor.execute(f'CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} '
+                           f'USING fts5(city, address, name, description)')
+            for sql in self.triggers.values():
+                cursor.execute(sql)
+        if existing != set(self.triggers):
+            # Posts could be changed while triggers didn`t exist
+            self.rebuild(connection)
+
+    def rebuild(self, connection=connection):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+            cursor.execute(f"INSERT INTO {self.table}(rowid, city, address, name, description) "
+                           f"SELECT p.id, h.city, h.address, h.name, COALESCE(p.description, '') "
+                           f"FROM _db_post p JOIN _db_house h ON h.id = p.house_id")
+
+
+BACKENDS = {
+    'postgresql': PostgresSearchBackend,
+    'sqlite': SqliteSearchBackend,
+}
+
+
+def get_backend():
+    """ 'SEARCH_BACKEND' setting is a dotted path to backend class. By default it is chosen by database engine """
+    if getattr(settings, 'SEARCH_BACKEND', None):
+        return import_string(settings.SEARCH_BACKEND)()
+    return BACKENDS.get(connection.vendor, BaseSearchBackend)()
+
+
+def search(queryset, query):
+    return get_backend().search(queryset, query)
 
 
 def get_queryset(queryset, query):
-    search_query = SearchQuery(query)
-    search_vector = SearchVector('house__city', weight='A')
-    results = queryset.annotate(rank=SearchRank(search_vector, search_query)).filter(rank__gte=0.3).order_by('-rank')
-    return results
+    """ Filter by city """
+    return get_backend().get_queryset(queryset, query)
+
+
+def index_posts(queryset, house):
+    get_backend().index_posts(queryset, house)
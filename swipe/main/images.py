@@ -0,0 +1,127 @@
+"""
+Resized variants of uploaded images for feeds and mobile clients.
+Variants are generated by celery task after upload ('main.receivers'), so request doesn`t wait for Pillow.
+Size of uploaded image is stored too, so serializers never open files - see 'get_srcset'.
+"""
+from django.contrib.contenttypes.models import ContentType
+from django.core.files.base import ContentFile
+from django.db import transaction
+
+from PIL import Image, ImageOps
+
+from collections import defaultdict
+import io
+import os
+
+from _db.models.models import House, Flat, Post, PostImage, ImageVariant
+from _db.models.user import User
+
+IMAGE_FIELDS = {
+    House: ('image', ),
+    Flat: ('schema', 'schema_in_house'),
+    Post: ('main_image', ),
+    PostImage: ('image', ),
+    User: ('photo', ),
+}
+WIDTHS = (('SMALL', 320), ('MEDIUM', 640), ('LARGE', 1280))
+# Pillow format, extension and save options
+FORMATS = {
+    'WEBP': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    'JPEG': ('JPEG', 'jpg', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+
+
+def get_variants(instance, field):
+    return ImageVariant.objects.filter(content_type=ContentType.objects.get_for_model(instance),
+                                       object_id=instance.pk, field=field)
+
+
+def prepare(image, image_format):
+    """ JPEG has no transparency - image is put on white background """
+    if image_format == 'JPEG':
+        if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            return background
+        return image.convert('RGB') if image.mode != 'RGB' else image
+    if image.mode not in ('RGB', 'RGBA'):
+        return image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+    return image
+
+
+def resize(image, width):
+    if width >= image.width:
+        return image
+    height = max(round(image.height * width / image.width), 1)
+    return image.resize((width, height), Image.LANCZOS)
+
+
+def generate_variants(instance, field):
+    """
+    Replace variants of image field. Images are never upscaled - small image gets one variant of its own size.
+    Nothing is done if variants of current file already exist, so task can be retried.
+    :return: number of created variants
+    """
+    file = getattr(instance, field)
+    variants = get_variants(instance, field)
+    if not file:
+        variants.delete()
+        return 0
+    if variants.filter(source=file.name).exists():
+        return 0
+
+    with file.open('rb'):
+        image = Image.open(file)
+        image = ImageOps.exif_transpose(image)
+        image.load()
+
+    content_type = ContentType.objects.get_for_model(instance)
+    common = {'content_type': content_type, 'object_id': instance.pk, 'field': field, 'source': file.name}
+    rows = [ImageVariant(variant='ORIGINAL', width=image.width, height=image.height, **common)]
+    stem = os.path.splitext(os.path.basename(file.name))[0]
+    done = set()
+    for variant, width in WIDTHS:
+        width = min(width, image.width)
+        if width in done:
+            break
+        done.add(width)
+        resized = resize(image, width)
+        for image_format, (pillow_format, extension, options) in FORMATS.items():
+            buffer = io.BytesIO()
+            prepare(resized, image_format).save(buffer, pillow_format, **options)
+            rows.append(ImageVariant(variant=variant, format=image_format, width=resized.width,
+                                     height=resized.height, **common,
+                                     file=ContentFile(buffer.getvalue(), name=f'{stem}_{width}.{extension}')))
+
+    with transaction.atomic():
+        variants.delete()
+        # Files are saved to storage by 'bulk_create'
+        ImageVariant.objects.bulk_create(rows)
+    return len(rows) - 1
+
+
+def get_srcset(instance, field, request=None):
+    """
+    Variants are taken from 'image_variants' - prefetch it for lists.
+    :return: dict with size of image and srcset for every format, None if image is empty or isn`t processed yet
+    """
+    file = getattr(instance, field)
+    if not file:
+        return None
+    variants = [variant for variant in instance.image_variants.all()
+                if variant.field == field and variant.source == file.name]
+    if not variants:
+        return None
+    data = {}
+    srcset = defaultdict(list)
+    for variant in sorted(variants, key=lambda item: item.width):
+        if variant.variant == 'ORIGINAL':
+            data.update(width=variant.width, height=variant.height)
+            continue
+        url = variant.file.url
+        if request is not None:
+            url = request.build_absolute_uri(url)
+        srcset[variant.format.lower()].append(f'{url} {variant.width}w')
+    data.update((image_format, ', '.join(items)) for image_format, items in srcset.items())
+    return data
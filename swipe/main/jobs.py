@@ -0,0 +1,41 @@
+"""
+Lifecycle of '_db.models.models.BackgroundJob'. Celery task loads job and passes it to 'run' with handler.
+"""
+from django.utils import timezone
+
+from _db.models.models import BackgroundJob
+
+
+class JobError(Exception):
+    """ Expected failure - message is shown to user in report """
+
+
+def set_progress(job, processed, total=None):
+    """ Plain UPDATE, so progress is visible to other connections right after chunk is committed """
+    job.processed = processed
+    fields = {'processed': processed}
+    if total is not None:
+        job.total = fields['total'] = total
+    BackgroundJob.objects.filter(pk=job.pk).update(**fields)
+
+
+def run(job, handler):
+    """
+    :param handler: function(job) which returns report
+    """
+    job.status = 'RUNNING'
+    job.save(update_fields=('status', ))
+    try:
+        job.report = handler(job)
+        job.status = 'DONE'
+    except JobError as e:
+        job.report = {'error': str(e)}
+        job.status = 'FAILED'
+    except Exception:
+        job.status = 'FAILED'
+        raise
+    finally:
+        job.finished = timezone.now()
+        # UPDATE doesn`t fail if job was deleted by handler - e.g. with its user
+        BackgroundJob.objects.filter(pk=job.pk).update(status=job.status, report=job.report, finished=job.finished)
+    return job
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from main import images
+from main.tasks import generate_image_variants
+
+
+class Command(BaseCommand):
+    help = 'Generate resized variants for already uploaded images. Images with variants are skipped'
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='*', help='Names of models, like Post. All models with images by default')
+        parser.add_argument('--delay', action='store_true', help='Send images to celery instead of processing here')
+
+    def handle(self, *args, **options):
+        names = {name.lower() for name in options['models']}
+        for model, fields in images.IMAGE_FIELDS.items():
+            if names and model.__name__.lower() not in names:
+                continue
+            not_empty = Q()
+            for field in fields:
+                not_empty |= Q(**{f'{field}__gt': ''})
+            created, failed, sent = 0, 0, 0
+            for instance in model.objects.filter(not_empty).only('pk', *fields).iterator():
+                if options['delay']:
+                    generate_image_variants.delay(model._meta.label, instance.pk, fields)
+                    sent += 1
+                    continue
+                for field in fields:
+                    try:
+                        created += images.generate_variants(instance, field)
+                    except OSError as e:  # Missing or broken file
+                        failed += 1
+                        self.stderr.write(f'{model.__name__} {instance.pk} {field}: {e}')
+            if options['delay']:
+                self.stdout.write(f'{model.__name__}: sent to celery {sent}')
+            else:
+                self.stdout.write(f'{model.__name__}: created variants {created}, failed images {failed}')
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from _db.models.models import House
+
+
+class Command(BaseCommand):
+    help = 'Recompute building, section, floor, flat and booked flat counters of houses'
+
+    def add_arguments(self, parser):
+        parser.add_argument('houses', nargs='*', type=int, help='Pks of houses. All houses by default')
+
+    def handle(self, *args, **options):
+        houses = House.objects.all()
+        if options['houses']:
+            houses = houses.filter(pk__in=options['houses'])
+        self.stdout.write(f'Recounted houses: {houses.recount()}')
@@ -0,0 +1,73 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from main.full_text_search import get_backend
+
+from _db.models.models import House, Building, Section, Floor, Flat, Post
+from _db.models.user import User
+
+import random
+import time
+
+CITIES = ('Odessa', 'Kiev', 'Lviv', 'Kharkiv', 'Dnipro', 'Zaporizhzhia', 'Mykolaiv', 'Kherson')
+WORDS = ('sea', 'view', 'park', 'school', 'metro', 'quiet', 'center', 'new', 'renovation', 'balcony')
+
+
+class Command(BaseCommand):
+    help = 'Measure post search latency of current search backend. Same benchmark is used for every engine'
+
+    def add_arguments(self, parser):
+        parser.add_argument('queries', nargs='*', default=['Odessa', 'sea view', 'quiet park'])
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Create this number of synthetic posts. They are rolled back after benchmark')
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        self.stdout.write(f'Backend: {backend.__class__.__name__}')
+        with transaction.atomic():
+            if options['seed']:
+                self.seed(options['seed'])
+                backend.rebuild()
+            self.stdout.write(f'Posts: {Post.objects.count()}')
+            for query in options['queries']:
+                self.measure('search', query, lambda: list(backend.search(Post.objects.all(), query)[:8]),
+                             options['repeat'])
+                self.measure('city', query, lambda: list(backend.get_queryset(Post.objects.all(), query)[:8]),
+                             options['repeat'])
+            transaction.set_rollback(True)
+
+    def measure(self, name, query, func, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        self.stdout.write(f'{name:<8}{query!r:<20} median {timings[len(timings) // 2]:.2f} ms, '
+                          f'max {timings[-1]:.2f} ms')
+
+    def seed(self, count):
+        """ Files are only names - nothing is written to storage, so rollback leaves no files """
+        user = User.objects.create(phone_number=f'benchmark-{time.time()}')
+        House.objects.bulk_create([House(name=f'House {i}', address=f'{random.choice(WORDS)} street {i}',
+                                         city=city, tech='MONO1', territory='OPEN',
+                                         payment_options='PAYMENT', role='FLAT', sales_department=user)
+                                   for i, city in enumerate(CITIES)])
+        houses = list(House.objects.filter(sales_department=user))
+        building = Building.objects.create(number=1, house=houses[0])
+        section = Section.objects.create(number=1, building=building)
+        floor = Floor.objects.create(number=1, section=section)
+        flat = Flat.objects.create(number=1, square=1, kitchen_square=1, price_per_metre=1, price=1,
+                                   schema='schema.png', number_of_rooms=1,
+                                   state='BLANK', foundation_doc='OWNER', plan='FREE', balcony='YES', floor=floor)
+        start = Post.objects.count() + 1
+        batch = []
+        for number in range(start, start + count):
+            batch.append(Post(number=number, payment_options='PAYMENT', price=1000, flat=flat,
+                              house=random.choice(houses), user=user, main_image='',
+                              description=' '.join(random.sample(WORDS, 4))))
+            if len(batch) == 1000:
+                Post.objects.bulk_create(batch)
+                batch = []
+        Post.objects.bulk_create(batch)
@@ -0,0 +1,73 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from urllib.parse import urlsplit
+import asyncio
+import base64
+import os
+import resource
+import time
+
+
+class Command(BaseCommand):
+    help = ('Open many idle websockets to running server and hold them. '
+            'Watch memory and CPU of worker meanwhile, e.g. with "ps -o rss,pcpu -p <pid>"')
+
+    def add_arguments(self, parser):
+        parser.add_argument('token', help='Token of user. All connections use it')
+        parser.add_argument('--url', default='ws://localhost:8000/ws/messages/')
+        parser.add_argument('--connections', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=100, help='Handshakes in progress at once')
+        parser.add_argument('--hold', type=float, default=30, help='Seconds to keep connections open')
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        if url.scheme != 'ws':
+            raise CommandError('Only ws:// urls are supported')
+        self.raise_open_files_limit(options['connections'])
+        asyncio.run(self.run(url, options))
+
+    @staticmethod
+    def raise_open_files_limit(connections):
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        needed = connections + 100
+        if soft < needed and (hard == resource.RLIM_INFINITY or soft < hard):
+            resource.setrlimit(resource.RLIMIT_NOFILE, (needed if hard == resource.RLIM_INFINITY
+                                                         else min(needed, hard), hard))
+
+    async def connect(self, url, token, semaphore):
+        """ :return: stream pair of accepted connection """
+        async with semaphore:
+            reader, writer = await asyncio.open_connection(url.hostname, url.port or 80)
+            key = base64.b64encode(os.urandom(16)).decode()
+            writer.write((f'GET {url.path}?token={token} HTTP/1.1\r\nHost: {url.netloc}\r\n'
+                          f'Upgrade: websocket\r\nConnection: Upgrade\r\n'
+                          f'Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n').encode())
+            await writer.drain()
+            response = await reader.readuntil(b'\r\n\r\n')
+            if not response.startswith(b'HTTP/1.1 101'):
+                writer.close()
+                raise ConnectionError(response.split(b'\r\n', 1)[0].decode())
+            return reader, writer
+
+    async def run(self, url, options):
+        semaphore = asyncio.Semaphore(options['concurrency'])
+        start = time.monotonic()
+        results = await asyncio.gather(*[self.connect(url, options['token'], semaphore)
+                                         for _ in range(options['connections'])], return_exceptions=True)
+        elapsed = time.monotonic() - start
+        opened = [result for result in results if not isinstance(result, BaseException)]
+        errors = {}
+        for result in results:
+            if isinstance(result, BaseException):
+                errors[repr(result)] = errors.get(repr(result), 0) + 1
+        self.stdout.write(f'Opened {len(opened)} of {options["connections"]} in {elapsed:.2f}s '
+                          f'({len(opened) / elapsed if elapsed else 0:.0f}/s)')
+        for error, count in errors.items():
+            self.stderr.write(f'{count} x {error}')
+
+        await asyncio.sleep(options['hold'])
+        # Connection closed by server gets eof, data isn`t read by idle client
+        alive = sum(1 for reader, _ in opened if not reader.at_eof())
+        self.stdout.write(f'Alive after {options["hold"]:.0f}s: {alive}')
+        for _, writer in opened:
+            writer.close()
@@ -0,0 +1,97 @@
+"""
+System notifications - messages from SYSTEM user to many users.
+Recipients are read by one query which applies 'User.notifications', messages are written by chunks:
+every chunk is one INSERT of messages and a few set-based updates of conversations - see 'main.conversations'.
+"""
+from django.db import transaction
+
+from string import Formatter
+
+from main import conversations, realtime
+
+from _db.models.user import User, Contact, Message
+
+CHUNK_SIZE = 500
+# User gets notification himself
+TO_USER = ('ME', 'MEANDAGENT')
+# Notification is copied to agents of user - his contacts with role 'AGENT'
+TO_AGENT = ('AGENT', 'MEANDAGENT')
+AGENT_TEMPLATE = '{client}: {text}'
+
+
+def get_system_user():
+    """
+    :return: pk of SYSTEM user. Isn`t cached - process can start before 'migrate' creates user
+    or live while user is recreated. It is one query per notification, not per recipient
+    """
+    return User.objects.filter(role='SYSTEM').values_list('pk', flat=True).first()
+
+
+def get_template_fields(template):
+    """ :return: names used in template, e.g. {'first_name'} for 'Hello, {first_name}' """
+    return {name.split('.')[0].split('[')[0] for _, name, _, _ in Formatter().parse(template) if name}
+
+
+def get_client_name(row):
+    if row['first_name'] and row['last_name']:
+        return f'{row["first_name"]} {row["last_name"]}'
+    return row['phone_number']
+
+
+def notify(recipients, template, **context):
+    """
+    :param recipients: queryset of users. Inactive users and users who switched notifications off are skipped
+    :param template: text of message. Formatted with context and fields of recipient, like '{first_name}'
+    :return: number of created messages
+    """
+    sender = get_system_user()
+    if sender is None:
+        return 0
+    fields = [name for name in get_template_fields(template) if name not in context]
+    rows = (recipients.filter(is_active=True).exclude(notifications='OFF').order_by()
+            .values('pk', 'notifications', 'first_name', 'last_name', 'phone_number', *fields).distinct())
+    created, chunk = 0, []
+    for row in rows.iterator(chunk_size=CHUNK_SIZE):
+        chunk.append(row)
+        if len(chunk) == CHUNK_SIZE:
+            created += send_chunk(sender, chunk, template, context)
+            chunk = []
+    if chunk:
+        created += send_chunk(sender, chunk, template, context)
+    return created
+
+
+def get_agents(users):
+    """ :return: dict {user pk: [agent pks]} """
+    agents = {}
+    contacts = Contact.objects.filter(user__in=users, ban=False, contact__role='AGENT', contact__is_active=True)
+    for user, agent in contacts.values_list('user', 'contact'):
+        agents.setdefault(user, []).append(agent)
+    return agents
+
+
+@transaction.atomic
+def send_chunk(sender, rows, template, context):
+    agents = get_agents([row['pk'] for row in rows if row['notifications'] in TO_AGENT])
+    messages = []
+    for row in rows:
+        text = template.format(**{**row, **context})
+        if row['notifications'] in TO_USER:
+            messages.append(Message(sender_id=sender, receiver_id=row['pk'], text=text))
+        if agents.get(row['pk']):
+            agent_text = AGENT_TEMPLATE.format(client=get_client_name(row), text=text)
+            messages.extend(Message(sender_id=sender, receiver_id=agent, text=agent_text)
+                            for agent in agents[row['pk']])
+    if not messages:
+        return 0
+    # Receivers of Message aren`t called by bulk_create - conversations and websockets are updated here
+    Message.objects.bulk_create(messages)
+    conversations.record_broadcast(sender, messages)
+    events = [(message.receiver_id, realtime.get_message_event('message.created', message)) for message in messages]
+    transaction.on_commit(lambda: publish(sender, events))
+    return len(messages)
+
+
+def publish(sender, events):
+    for receiver, event in events:
+        realtime.publish_to_users((sender, receiver), event)
@@ -0,0 +1,202 @@
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.exceptions import NotFound, ValidationError as DRFValidationError
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+from rest_framework.compat import coreapi, coreschema
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils.translation import gettext_lazy as _
+
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from functools import reduce
+from operator import or_
+import binascii
+import json
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (seek) pagination.
+    Next page is selected with 'WHERE (ordering fields) < (values of the last row)' instead of OFFSET,
+    and there is no COUNT(*), so page N costs the same as the first one.
+    'ordering' must be unique and contain only not null fields - that is why it ends with 'id'.
+    Cursor is an opaque token with ordering values of the boundary row and direction.
+    """
+    ordering = ('-id', )
+    page_size = api_settings.PAGE_SIZE
+    cursor_query_param = 'cursor'
+    cursor_query_description = _('The pagination cursor value.')
+    invalid_cursor_message = _('Invalid cursor')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.model = queryset.model
+
+        position, reverse = self.decode_cursor(request)
+        queryset = queryset.order_by(*self.get_ordering(reverse))
+        if position is not None:
+            queryset = queryset.filter(self.get_seek_filter(position, reverse))
+
+        # Fetch one extra row to know if there is one more page in that direction
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_fields(self):
+        """ :return: list of tuples (field_name, descending) """
+        return [(field.lstrip('-'), field.startswith('-')) for field in self.ordering]
+
+    def get_ordering(self, reverse):
+        if not reverse:
+            return self.ordering
+        return [name if descending else f'-{name}' for name, descending in self.get_fields()]
+
+    def get_seek_filter(self, position, reverse):
+        """
+        Row comparison '(a, b, c) < (1, 2, 3)' expanded to
+        'a < 1 OR (a = 1 AND b < 2) OR (a = 1 AND b = 2 AND c < 3)'.
+        Extra 'a <= 1' keeps the condition sargable for the leading column of index.
+        """
+        equal = {}
+        conditions = []
+        for name, descending in self.get_fields():
+            lookup = 'lt' if descending != reverse else 'gt'
+            conditions.append(Q(**equal, **{f'{name}__{lookup}': position[name]}))
+            equal[name] = position[name]
+        first, descending = self.get_fields()[0]
+        bound = Q(**{f'{first}__{"lte" if descending != reverse else "gte"}': position[first]})
+        return bound & reduce(or_, conditions)
+
+    def encode_cursor(self, instance, reverse):
+        values = [getattr(instance, name) for name, descending in self.get_fields()]
+        data = json.dumps({'p': values, 'r': int(reverse)}, default=str)
+        cursor = urlsafe_b64encode(data.encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        """ :return: tuple (dict with position or None for the first page, reverse) """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            data = json.loads(urlsafe_b64decode(encoded.encode('ascii')).decode('ascii'))
+            fields = self.get_fields()
+            if len(data['p']) != len(fields):
+                raise ValueError
+            position = {name: self.model._meta.get_field(name).to_python(value)
+                        for (name, descending), value in zip(fields, data['p'])}
+            return position, bool(data.get('r'))
+        except (TypeError, ValueError, KeyError, UnicodeError, binascii.Error, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_schema_fields(self, view):
+        assert coreapi is not None, 'coreapi must be installed to use `get_schema_fields()`'
+        assert coreschema is not None, 'coreschema must be installed to use `get_schema_fields()`'
+        return [
+            coreapi.Field(
+                name=self.cursor_query_param,
+                required=False,
+                location='query',
+                schema=coreschema.String(
+                    title='Cursor',
+                    description=str(self.cursor_query_description)
+                )
+            )
+        ]
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': str(self.cursor_query_description),
+                'schema': {
+                    'type': 'string',
+                },
+            }
+        ]
+
+
+class PostKeysetPagination(KeysetPagination):
+    ordering = ('-weight', '-created', '-id')
+
+
+class MessageKeysetPagination(KeysetPagination):
+    ordering = ('-created', '-id')
+    page_size = 30
+
+
+class ConversationKeysetPagination(KeysetPagination):
+    ordering = ('-last_activity', '-id')
+    page_size = 30
+
+
+class PostPagination(PageNumberPagination):
+    """
+    Page number pagination by default.
+    If request has 'cursor' query param (may be empty for the first page) - keyset pagination is used.
+    Mobile feed should use this mode, because it doesn`t slow down with scrolling depth.
+    Search results are ordered by rank first (see 'main.full_text_search'), which cursor doesn`t contain,
+    so cursor is rejected for any ordering other than the keyset one.
+    """
+    keyset_pagination_class = PostKeysetPagination
+    invalid_ordering_message = _('Search results can`t be paginated by cursor. Use page instead')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if self.keyset_pagination_class.cursor_query_param in request.query_params:
+            if tuple(queryset.query.order_by) != tuple(self.keyset_pagination_class.ordering):
+                raise DRFValidationError({'Error': self.invalid_ordering_message})
+            self.keyset = self.keyset_pagination_class()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def get_schema_fields(self, view):
+        return super().get_schema_fields(view) + self.keyset_pagination_class().get_schema_fields(view)
+
+    def get_schema_operation_parameters(self, view):
+        return super().get_schema_operation_parameters(view) + \
+               self.keyset_pagination_class().get_schema_operation_parameters(view)
@@ -37,4 +37,4 @@ class IsFavoritesOwner(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         if request.user.is_superuser or request.user.is_staff:
             return True
-        return request.user in obj.in_favorites.all()
+        return obj.in_favorites.through.objects.filter(post=obj, user=request.user).exists()
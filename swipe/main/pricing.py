@@ -0,0 +1,46 @@
+"""
+Bulk repricing of flats. Prices are changed by one UPDATE, rows are not loaded.
+"""
+from django.db import transaction
+from django.db.models import F, Value, Case, When, FloatField, IntegerField
+from django.db.models.functions import Cast, Greatest, Round
+
+from main import chessboard
+
+from _db.models.models import Flat, Post
+
+
+def get_price_expression(field, percent=None, amount=None):
+    """ New price from current value of field. Price can`t become negative """
+    if percent is not None:
+        price = F(field) * Value(1 + percent / 100, output_field=FloatField())
+    else:
+        price = F(field) + Value(amount, output_field=FloatField())
+    return Greatest(price, Value(0.0, output_field=FloatField()), output_field=FloatField())
+
+
+@transaction.atomic
+def reprice_flats(house, building=None, section=None, floor=None, percent=None, amount=None, update_posts=False):
+    """
+    Flats are selected by location numbers - 'flat_location_idx' is used.
+    :param percent: change in percents, e.g. 10 or -5
+    :param amount: absolute change. Used if percent is None
+    :param update_posts: change price of posts of selected flats in the same way
+    :return: dict with number of updated flats and posts
+    """
+    flats = Flat.objects.filter(house=house)
+    for field, value in (('building_number', building), ('section_number', section), ('floor_number', floor)):
+        if value is not None:
+            flats = flats.filter(**{field: value})
+
+    price = get_price_expression('price', percent, amount)
+    # SET expressions see old values, so price per metre is computed from new price expression
+    updated = {'flats': flats.update(price=price,
+                                     price_per_metre=Case(When(square__gt=0, then=price / F('square')),
+                                                          default=F('price_per_metre'),
+                                                          output_field=FloatField()))}
+    if update_posts:
+        post_price = Cast(Round(get_price_expression('price', percent, amount)), output_field=IntegerField())
+        updated['posts'] = Post.objects.filter(flat__in=flats.values('pk')).update(price=post_price)
+    chessboard.invalidate(house.pk)
+    return updated
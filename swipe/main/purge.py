@@ -0,0 +1,122 @@
+"""
+Deletion of houses and users by celery job. API hides object at once ('House.hidden', 'User.is_active')
+and job deletes its subtree level by level from the bottom, so every batch cascades only to a few rows.
+Every batch is own transaction: progress is visible to client and files are queued by batch - see 'main.file_deletion'.
+Rows which only reference deleted user (messages, flats of client) are kept - reference is cleared by batches too.
+"""
+from django.db import transaction
+from django.db.models import F
+
+from main import chessboard
+from main.jobs import set_progress
+
+from _db.models.models import House, Building, Section, Floor, Flat, Post, PostImage, NewsItem, Document, Complaint
+from _db.models.user import User, Message, Conversation, Contact, UserFilter
+
+BATCH_SIZE = 200
+
+
+def get_house_levels(houses):
+    """ :return: querysets from the bottom of structure to houses """
+    return [
+        PostImage.objects.filter(post__house__in=houses),
+        Post.objects.filter(house__in=houses),
+        Flat.objects.filter(house__in=houses),
+        Floor.objects.filter(section__building__house__in=houses),
+        Section.objects.filter(building__house__in=houses),
+        Building.objects.filter(house__in=houses),
+        NewsItem.objects.filter(house__in=houses),
+        Document.objects.filter(house__in=houses),
+        House.objects.filter(pk__in=houses),
+    ]
+
+
+def delete(queryset):
+    _, by_model = queryset.delete()
+    return by_model
+
+
+def set_null(*fields):
+    """ Action of level - the same as 'SET_NULL', without loading rows """
+    def action(queryset):
+        queryset.update(**{field: None for field in fields})
+        return {}
+    return action
+
+
+def delete_reactions(sign):
+    """ Action of level - likes of posts follow likers and dislikers tables, see 'main.reactions' """
+    def action(queryset):
+        Post.objects.filter(pk__in=queryset.values('post')).update(likes=F('likes') - sign, weight=F('weight') - sign)
+        return delete(queryset)
+    return action
+
+
+def delete_in_batches(job, levels, batch_size=None):
+    """
+    :param levels: querysets in order of deleting. Pair (queryset, action) applies action to every batch instead,
+        action takes queryset of batch and returns number of deleted objects by model
+    :return: report with number of deleted objects by model
+    """
+    batch_size = batch_size or BATCH_SIZE
+    levels = [level if isinstance(level, tuple) else (level, delete) for level in levels]
+    set_progress(job, 0, sum(queryset.count() for queryset, _ in levels))
+    processed, deleted = 0, {}
+    for queryset, action in levels:
+        while True:
+            pks = list(queryset.order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                break
+            with transaction.atomic():
+                by_model = action(queryset.model.objects.filter(pk__in=pks))
+            for label, count in by_model.items():
+                deleted[label] = deleted.get(label, 0) + count
+            processed += len(pks)
+            set_progress(job, processed)
+    return {'deleted': deleted}
+
+
+def purge_house(job):
+    """ Handler for 'main.jobs.run' """
+    return delete_in_batches(job, get_house_levels([job.params['house']]))
+
+
+def get_user_levels(user):
+    """ Rows which reference user, except houses and posts """
+    return [
+        (Message.objects.filter(sender=user), set_null('sender')),
+        (Message.objects.filter(receiver=user), set_null('receiver')),
+        (Flat.objects.filter(client=user), set_null('client')),
+        Conversation.objects.filter(owner=user),
+        Conversation.objects.filter(counterpart=user),
+        Contact.objects.filter(user=user),
+        Contact.objects.filter(contact=user),
+        UserFilter.objects.filter(user=user),
+        Complaint.objects.filter(user=user),
+        (Post.likers.through.objects.filter(user=user), delete_reactions(1)),
+        (Post.dislikers.through.objects.filter(user=user), delete_reactions(-1)),
+        Post.in_favorites.through.objects.filter(user=user),
+    ]
+
+
+def purge_user(job):
+    """ Houses, posts and rows which reference user are deleted by batches, then user row with a few rows left """
+    user = job.params['user']
+    houses = list(House.objects.filter(sales_department=user).values_list('pk', flat=True))
+    # Chessboards show flats owned by client
+    client_houses = set(Flat.objects.filter(client=user).values_list('house', flat=True))
+    levels = get_house_levels(houses) + [
+        PostImage.objects.filter(post__user=user),
+        Post.objects.filter(user=user),
+        *get_user_levels(user),
+        User.objects.filter(pk=user),
+    ]
+    report = delete_in_batches(job, levels)
+    chessboard.invalidate(*client_houses)
+    return report
+
+
+HANDLERS = {
+    'PURGE_HOUSE': purge_house,
+    'PURGE_USER': purge_user,
+}
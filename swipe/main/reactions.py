@@ -0,0 +1,55 @@
+"""
+Like/dislike toggle.
+Membership is changed by DELETE and INSERT on many-to-many tables - each relation is checked once by unique index,
+liker lists are not loaded. Likes and weight are changed by F() update in the same transaction, so they always
+follow the tables.
+"""
+from django.db import transaction, IntegrityError
+from django.db.models import F
+
+from _db.models.models import Post
+
+ACTIONS = ('like', 'dislike')
+
+
+def remove(relation, post_pk, user):
+    """ :return: True if user was in relation """
+    # Through model has no delete signals and relations, so Django runs one DELETE without selecting rows
+    deleted, _ = relation.through.objects.filter(post_id=post_pk, user=user).delete()
+    return bool(deleted)
+
+
+def add(relation, post_pk, user):
+    """ :return: True if row was created. Concurrent request of the same user could create it first """
+    try:
+        with transaction.atomic():
+            relation.through.objects.create(post_id=post_pk, user=user)
+        return True
+    except IntegrityError:
+        return False
+
+
+def toggle_reaction(post_pk, user, action):
+    """
+    'like' removes dislike and toggles like. 'dislike' removes like and toggles dislike.
+    :param post_pk: pk of existing post
+    :param action: 'like' or 'dislike'
+    :return: likes delta
+    """
+    assert action in ACTIONS, f'Unknown action {action}'
+    if action == 'like':
+        relation, opposite, sign = Post.likers, Post.dislikers, 1
+    else:
+        relation, opposite, sign = Post.dislikers, Post.likers, -1
+
+    with transaction.atomic():
+        delta = 0
+        if remove(opposite, post_pk, user):
+            delta += sign
+        if remove(relation, post_pk, user):
+            delta -= sign
+        elif add(relation, post_pk, user):
+            delta += sign
+        if delta:
+            Post.objects.filter(pk=post_pk).update(likes=F('likes') + delta, weight=F('weight') + delta)
+    return delta
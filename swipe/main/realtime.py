@@ -0,0 +1,139 @@
+"""
+Channel layer for websocket pushes - see 'main.websocket'.
+Every connection subscribes to group of its user, so message is published once to group of sender and of receiver.
+'CHANNEL_LAYER' setting is a dotted path to layer class. Default 'InMemoryChannelLayer' delivers events only
+inside one process - use it with single worker (messages created by separate celery workers aren`t pushed).
+'RedisChannelLayer' delivers events of all processes - web workers and celery, it is used by docker-compose.
+"""
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from collections import defaultdict
+import asyncio
+import functools
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+from main.serializers.user_serializers import WritableMessageSerializer
+
+# Put to queue of connection instead of event when client doesn`t read. Connection is closed and client
+# has to reload history by api
+OVERFLOW = object()
+
+
+class BaseChannelLayer:
+    async def subscribe(self, group):
+        """ :return: asyncio.Queue with events of group. Called in event loop of connection """
+        raise NotImplementedError
+
+    async def unsubscribe(self, group, queue):
+        raise NotImplementedError
+
+    def publish(self, group, event):
+        """ Called from sync code - views, receivers and tasks. Mustn`t block """
+        raise NotImplementedError
+
+
+class InMemoryChannelLayer(BaseChannelLayer):
+    def __init__(self, capacity=100):
+        self.capacity = capacity
+        self._groups = defaultdict(set)
+        self._lock = threading.Lock()
+
+    async def subscribe(self, group):
+        queue = asyncio.Queue(self.capacity)
+        with self._lock:
+            self._groups[group].add((asyncio.get_running_loop(), queue))
+        return queue
+
+    async def unsubscribe(self, group, queue):
+        with self._lock:
+            subscribers = self._groups[group]
+            subscribers.discard((asyncio.get_running_loop(), queue))
+            if not subscribers:
+                del self._groups[group]
+
+    def publish(self, group, event):
+        with self._lock:
+            subscribers = list(self._groups.get(group, ()))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(self.put, queue, event)
+            except RuntimeError:  # Loop is closed - connection is gone
+                pass
+
+    @staticmethod
+    def put(queue, event):
+        if queue.full():
+            while not queue.empty():
+                queue.get_nowait()
+            event = OVERFLOW
+        queue.put_nowait(event)
+
+
+class RedisChannelLayer(InMemoryChannelLayer):
+    """
+    Events go through redis pub/sub ('CHANNEL_LAYER_LOCATION' setting). Process with websockets listens to all groups
+    by one thread and one connection and puts events to queues of its connections
+    """
+    prefix = 'realtime:'
+    reconnect_delay = 1
+
+    def __init__(self, capacity=100):
+        # Required only by this layer
+        import redis
+
+        super().__init__(capacity)
+        self.client = redis.Redis.from_url(settings.CHANNEL_LAYER_LOCATION)
+        self._listener = None
+
+    async def subscribe(self, group):
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self.listen, daemon=True)
+                self._listener.start()
+        return await super().subscribe(group)
+
+    def listen(self):
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(f'{self.prefix}*')
+                for message in pubsub.listen():
+                    group = message['channel'].decode()[len(self.prefix):]
+                    super().publish(group, json.loads(message['data']))
+            except Exception:  # Events published while connection is lost aren`t delivered
+                logger.exception('Channel layer lost connection to redis')
+                time.sleep(self.reconnect_delay)
+
+    def publish(self, group, event):
+        self.client.publish(f'{self.prefix}{group}', json.dumps(event))
+
+
+@functools.lru_cache(maxsize=None)
+def get_channel_layer():
+    """ One layer per process - connections and publishers have to share it """
+    return import_string(getattr(settings, 'CHANNEL_LAYER', 'main.realtime.InMemoryChannelLayer'))()
+
+
+def get_user_group(pk):
+    return f'user.{pk}'
+
+
+def get_message_event(event_type, message):
+    """
+    Built at once, so deleted message still has pk
+    :param event_type: 'message.created', 'message.updated' or 'message.deleted'
+    """
+    return {'type': event_type, 'message': dict(WritableMessageSerializer(message).data)}
+
+
+def publish_to_users(users, event):
+    layer = get_channel_layer()
+    for pk in users:
+        if pk is not None:
+            layer.publish(get_user_group(pk), event)
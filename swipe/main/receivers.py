@@ -0,0 +1,98 @@
+from django.db import models, connections, transaction
+from django.dispatch import receiver
+
+from main.full_text_search import get_backend, index_posts
+from main.tasks import generate_image_variants
+from main import chessboard, images, conversations, realtime
+
+from _db.models.models import House, Building, Section, Floor, Flat, Post
+from _db.models.user import Message
+
+SEARCH_HOUSE_FIELDS = {'city', 'address', 'name'}
+SEARCH_POST_FIELDS = {'description', 'house'}
+
+
+@receiver(models.signals.post_migrate)
+def install_search_backend(sender, using, **kwargs):
+    """ Search objects depend on '_db' tables """
+    if sender.name == '_db':
+        get_backend().install(connections[using])
+
+
+@receiver(models.signals.post_save, sender=Post)
+def update_post_search_index(sender, instance, update_fields=None, **kwargs):
+    """ Skip saves which don`t touch searchable fields - like views counter """
+    if update_fields is not None and not SEARCH_POST_FIELDS.intersection(update_fields):
+        return
+    index_posts(Post.objects.filter(pk=instance.pk), instance.house)
+
+
+@receiver(models.signals.post_save, sender=House)
+def update_house_posts_search_index(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        return
+    if update_fields is not None and not SEARCH_HOUSE_FIELDS.intersection(update_fields):
+        return
+    index_posts(Post.objects.filter(house=instance), instance)
+
+
+@receiver(models.signals.post_save, sender=Message)
+def update_conversations(sender, instance, created, **kwargs):
+    if created:
+        conversations.record_messages([instance])
+
+
+@receiver(models.signals.post_save, sender=Message)
+@receiver(models.signals.post_delete, sender=Message)
+def push_message(sender, instance, created=False, **kwargs):
+    """ Pushed to websockets of participants - see 'main.websocket' """
+    if kwargs['signal'] is models.signals.post_delete:
+        event_type = 'message.deleted'
+    else:
+        event_type = 'message.created' if created else 'message.updated'
+    event = realtime.get_message_event(event_type, instance)
+    users = {instance.sender_id, instance.receiver_id}
+    transaction.on_commit(lambda: realtime.publish_to_users(users, event))
+
+
+@receiver(models.signals.post_save, sender=Flat)
+@receiver(models.signals.post_delete, sender=Flat)
+def invalidate_flat_chessboard(sender, instance, **kwargs):
+    """ Flat could be moved from another house """
+    chessboard.invalidate(instance.house_id, getattr(instance, '_counted_house_id', None))
+
+
+@receiver(models.signals.post_save, sender=Building)
+@receiver(models.signals.post_delete, sender=Building)
+def invalidate_building_chessboard(sender, instance, **kwargs):
+    chessboard.invalidate(instance.house_id)
+
+
+@receiver(models.signals.post_save, sender=Section)
+@receiver(models.signals.post_delete, sender=Section)
+def invalidate_section_chessboard(sender, instance, **kwargs):
+    chessboard.invalidate(*Building.objects.filter(pk=instance.building_id).values_list('house', flat=True))
+
+
+@receiver(models.signals.post_save, sender=Floor)
+@receiver(models.signals.post_delete, sender=Floor)
+def invalidate_floor_chessboard(sender, instance, **kwargs):
+    chessboard.invalidate(*Building.objects.filter(sections=instance.section_id).values_list('house', flat=True))
+
+
+def mark_uploaded_images(sender, instance, update_fields=None, **kwargs):
+    """ Uploaded file isn`t committed until field 'pre_save', so new uploads are found without query """
+    instance._uploaded_images = [field for field in images.IMAGE_FIELDS[sender]
+                                 if (update_fields is None or field in update_fields)
+                                 and getattr(instance, field) and not getattr(instance, field)._committed]
+
+
+def schedule_image_variants(sender, instance, **kwargs):
+    fields = getattr(instance, '_uploaded_images', None)
+    if fields:
+        transaction.on_commit(lambda: generate_image_variants.delay(sender._meta.label, instance.pk, fields))
+
+
+for image_model in images.IMAGE_FIELDS:
+    models.signals.pre_save.connect(mark_uploaded_images, sender=image_model)
+    models.signals.post_save.connect(schedule_image_variants, sender=image_model)
@@ -0,0 +1,14 @@
+from rest_framework import serializers
+
+from main import images
+
+
+class SrcsetField(serializers.Field):
+    """ Size and resized variants of image field - see 'main.images.get_srcset' """
+    def __init__(self, image_field, **kwargs):
+        self.image_field = image_field
+        kwargs.update(source='*', read_only=True)
+        super().__init__(**kwargs)
+
+    def to_representation(self, instance):
+        return images.get_srcset(instance, self.image_field, self.context.get('request'))
@@ -6,6 +6,8 @@ from django.utils.translation import gettext as _
 
 from django.shortcuts import get_object_or_404
 
+from main.serializers.fields import SrcsetField
+
 from _db.models.models import House, Building, Section, Floor, NewsItem, Standpipe, Document, Flat, RequestToChest
 
 
@@ -38,27 +40,13 @@ class HouseSerializer(serializers.ModelSerializer):
     sum_in_contract_display = serializers.CharField(source='get_sum_in_contract_display', read_only=True)
 
     flats = HouseDetailFlatSerializer(read_only=True, many=True)
-    building_count = serializers.SerializerMethodField()
-    section_count = serializers.SerializerMethodField()
-    floor_count = serializers.SerializerMethodField()
-    flat_count = serializers.SerializerMethodField()
+    free_flat_count = serializers.IntegerField(read_only=True)
+    image_srcset = SrcsetField('image')
 
     class Meta:
         model = House
         fields = '__all__'
 
-    def get_building_count(self, obj):
-        return obj.buildings.count()
-
-    def get_section_count(self, obj):
-        return Section.objects.filter(building__house=obj).count()
-
-    def get_floor_count(self, obj):
-        return Floor.objects.filter(section__building__house=obj).count()
-
-    def get_flat_count(self, obj):
-        return Flat.objects.filter(floor__section__building__house=obj).count()
-
 
 class BuildingSerializer(serializers.ModelSerializer):
     full_name = serializers.SerializerMethodField()
@@ -145,14 +133,14 @@ class FloorSerializer(serializers.ModelSerializer):
         return obj.flats.exists()
 
     def get_house(self, obj):
-        return obj.section.building.house.pk
+        return obj.section.building.house_id
 
     def get_full_name(self, obj):
         building = obj.section.building
         return f'Этаж №{obj.number}. Секция №{obj.section.number}. Корпус №{building.number}'
 
     def create(self, validated_data):
-        next_number = Floor.get_next(validated_data.get('building'))
+        next_number = Floor.get_next(validated_data.get('section'))
         inst = Floor.objects.create(number=next_number, section=validated_data.get('section'))
         return inst
 
@@ -184,22 +172,61 @@ class FlatSerializer(serializers.ModelSerializer):
     floor_display = serializers.SerializerMethodField()
     house_pk = serializers.SerializerMethodField()
     sales_department_pk = serializers.SerializerMethodField()
+    schema_srcset = SrcsetField('schema')
+    schema_in_house_srcset = SrcsetField('schema_in_house')
 
     class Meta:
         model = Flat
         fields = '__all__'
+        read_only_fields = ('house', 'building_number', 'section_number', 'floor_number')
 
     def get_sales_department_pk(self, obj):
-        return obj.user.pk
+        return obj.house.sales_department_id
 
     def get_floor_display(self, obj):
-        floor = obj.floor
-        section = floor.section
-        building = section.building
-        return f'Корпус {building.number}, Секция {section.number}, Этаж {floor.number}'
+        return f'Корпус {obj.building_number}, Секция {obj.section_number}, Этаж {obj.floor_number}'
 
     def get_house_pk(self, obj):
-        return obj.floor.section.building.house.pk
+        return obj.house_id
+
+
+class FlatTemplateSerializer(serializers.ModelSerializer):
+    """ Fields which are the same for every generated flat. Schema can be uploaded later for each flat """
+    class Meta:
+        model = Flat
+        fields = ('square', 'kitchen_square', 'price_per_metre', 'price', 'number_of_rooms', 'state',
+                  'foundation_doc', 'type', 'plan', 'balcony', 'heating')
+
+
+class StructureGeneratorSerializer(serializers.Serializer):
+    """ Spec of generated structure: buildings x sections x floors x flats per floor """
+    MAX_FLATS = 20000
+
+    buildings = serializers.IntegerField(min_value=1, max_value=20, default=1)
+    sections = serializers.IntegerField(min_value=1, max_value=50)
+    floors = serializers.IntegerField(min_value=1, max_value=200)
+    flats_per_floor = serializers.IntegerField(min_value=1, max_value=50)
+    flat = FlatTemplateSerializer()
+
+    def validate(self, attrs):
+        if attrs['buildings'] * attrs['sections'] * attrs['floors'] * attrs['flats_per_floor'] > self.MAX_FLATS:
+            raise serializers.ValidationError(_('Too many flats. Maximum is {max}').format(max=self.MAX_FLATS))
+        return attrs
+
+
+class RepriceSerializer(serializers.Serializer):
+    """ Flats are selected by location numbers. Either percent or amount is required """
+    building = serializers.IntegerField(required=False)
+    section = serializers.IntegerField(required=False)
+    floor = serializers.IntegerField(required=False)
+    percent = serializers.FloatField(required=False, min_value=-100)
+    amount = serializers.FloatField(required=False)
+    update_posts = serializers.BooleanField(default=False)
+
+    def validate(self, attrs):
+        if ('percent' in attrs) == ('amount' in attrs):
+            raise serializers.ValidationError(_('Set either percent or amount'))
+        return attrs
 
 
 class HouseInRequestSerializer(serializers.ModelSerializer):
@@ -234,11 +261,9 @@ class RequestToChestSerializer(serializers.ModelSerializer):
             return {
                 'id': flat.pk,
                 'number': flat.number,
-                'floor': _('Корпус {building}, Секция {section}, Этаж {floor}').format(building=flat.floor.section.building.number,
-                                                                                       section=flat.floor.section.number,
-                                                                                       floor=flat.floor.number),
-                'house': flat.floor.section.building.house.name,
-                'house_pk': flat.floor.section.building.house.pk,
+                'floor': flat.location_display,
+                'house': flat.house.name,
+                'house_pk': flat.house_id,
                 'client_pk': client.pk,
                 'client_full_name': client.full_name(),
                 'client_phone_number': client.phone_number,
@@ -1,6 +1,9 @@
 from rest_framework import serializers
+from django.db.models import F
 from django.utils.translation import gettext as _
 
+from main.serializers.fields import SrcsetField
+
 from _db.models.models import Post, PostImage, Complaint, Promotion, PromotionType
 
 import datetime
@@ -9,9 +12,11 @@ from dateutil.relativedelta import relativedelta
 
 
 class PostImageSerializer(serializers.ModelSerializer):
+    image_srcset = SrcsetField('image')
+
     class Meta:
         model = PostImage
-        fields = ('image', 'post')
+        fields = ('image', 'post', 'image_srcset')
 
 
 class PromotionReadableSerializer(serializers.ModelSerializer):
@@ -26,6 +31,7 @@ class PostSerializer(serializers.ModelSerializer):
     images = PostImageSerializer(many=True, read_only=True)
     flat_info = serializers.SerializerMethodField()
     promotion = PromotionReadableSerializer(read_only=True)
+    main_image_srcset = SrcsetField('main_image')
 
     created_display = serializers.DateTimeField(source='created', read_only=True)
     created = serializers.BooleanField(write_only=True, required=False)
@@ -36,26 +42,24 @@ class PostSerializer(serializers.ModelSerializer):
     communications_display = serializers.CharField(source='get_communications_display', read_only=True)
     reject_message_display = serializers.CharField(source='get_reject_message_display', read_only=True)
 
+    # Reactions of current user. Annotated by 'PostQuerySet.with_user_flags'
+    is_liked = serializers.BooleanField(read_only=True, default=False)
+    is_disliked = serializers.BooleanField(read_only=True, default=False)
+    is_favorite = serializers.BooleanField(read_only=True, default=False)
+
     class Meta:
         model = Post
-        fields = '__all__'
+        # Reactions of other users aren`t displayed - see 'is_liked', 'is_disliked' and 'is_favorite'
+        exclude = ('search_vector', 'likers', 'dislikers', 'in_favorites')
         extra_kwargs = {
             'user': {'read_only': True},
-            'likers': {'read_only': True},
-            'dislikers': {'read_only': True},
             'number': {'read_only': True},
-            'in_favorites': {'read_only': True}
         }
 
     def get_flat_info(self, obj):
         flat = obj.flat
-        floor = flat.floor
-        section = floor.section
-        building = section.building
-        house = building.house
-        floor = _('Корпус {building}, Секция {section}, Этаж {floor}').format(building=building.number,
-                                                                              section=section.number,
-                                                                              floor=floor.number)
+        house = flat.house
+        floor = flat.location_display
         data = {'square': flat.square, 'kitchen_square': flat.kitchen_square, 'state': flat.get_state_display(),
                 'foundation_doc': flat.get_foundation_doc_display(), 'type': flat.get_type_display(),
                 'balcony': flat.get_balcony_display(), 'heating': flat.get_heating_display(),
@@ -67,7 +71,7 @@ class PostSerializer(serializers.ModelSerializer):
                 'house_class': house.get_house_class_display(),
                 'number': flat.number,
                 'id': flat.pk,
-                'house': flat.floor.section.building.house.name}
+                'house': house.name}
         return data
 
     def validate_created(self, value):
@@ -110,16 +114,14 @@ class ComplaintSerializer(serializers.ModelSerializer):
         }
 
     def get_post_author(self, obj):
-        return obj.post.user.pk
+        return obj.post.user_id
 
     def get_post_display(self, obj):
         post = obj.post
         flat = post.flat
         return {
-            'house': flat.floor.section.building.house.name,
-            'flat_floor': _('Корпус {building}, Секция {section}, Этаж {floor}').format(building=flat.floor.section.building.number,
-                                                                                        section=flat.floor.section.number,
-                                                                                        floor=flat.floor.number),
+            'house': flat.house.name,
+            'flat_floor': flat.location_display,
             'flat': flat.number,
             'price': post.price,
             'views': post.views,
@@ -140,6 +142,11 @@ class PromotionTypeSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+def change_weight(post_pk, delta):
+    """ F() update - counters flushed meanwhile and other columns of post aren`t overwritten """
+    Post.objects.filter(pk=post_pk).update(weight=F('weight') + delta)
+
+
 class PromotionSerializer(serializers.ModelSerializer):
     type_display = PromotionTypeSerializer(read_only=True)
     phrase_display = serializers.CharField(source='get_phrase_display', read_only=True)
@@ -160,9 +167,7 @@ class PromotionSerializer(serializers.ModelSerializer):
         validated_data['end_date'] = current_date + relativedelta(month=current_date.month + 1)
         instance = Promotion.objects.create(**validated_data)
         if validated_data.get('paid'):  # if promotion is not paid - it has no effect on post
-            post = instance.post
-            post.weight += instance.type.efficiency
-            post.save()
+            change_weight(instance.post_id, instance.type.efficiency)
         return instance
 
     def calculate_price(self, validated_data) -> int:
@@ -192,7 +197,5 @@ class PromotionUpdateSerializer(serializers.ModelSerializer):
         instance.end_date = current_date + relativedelta(month=current_date.month + 1)
         instance.save()
         if not current_paid_status and instance.paid:
-            post = instance.post
-            post.weight += instance.type.efficiency
-            post.save()
+            change_weight(instance.post_id, instance.type.efficiency)
         return instance
@@ -1,7 +1,10 @@
 from rest_framework import serializers
 from django.utils.translation import gettext as _
 
-from _db.models.user import User, Contact, Message, Attachment, UserFilter
+from main.serializers.fields import SrcsetField
+
+from _db.models.user import User, Contact, Message, Attachment, UserFilter, Conversation
+from _db.models.models import BackgroundJob
 from _db.models import choices
 
 import datetime
@@ -10,12 +13,13 @@ import datetime
 class UserSerializer(serializers.ModelSerializer):
     notifications_display = serializers.CharField(source='get_notifications_display', read_only=True)  # to display beauty name instead of const
     role_display = serializers.CharField(source='get_role_display', read_only=True)  # to display beauty name instead of const
+    photo_srcset = SrcsetField('photo')
 
     class Meta:
         model = User
         fields = ['pk', 'first_name', 'last_name', 'email',
                   'phone_number', 'notifications', 'subscribed', 'end_date', 'role', 'photo', 'is_staff',
-                  'is_superuser', 'notifications_display', 'role_display']
+                  'is_superuser', 'notifications_display', 'role_display', 'photo_srcset']
         read_only = ('email', )
         write_only = ('notifications', 'role')
 
@@ -79,6 +83,15 @@ class ReadableMessageSerializer(serializers.ModelSerializer):
         fields = ('pk', 'sender', 'receiver', 'text', 'created', 'attach')
 
 
+class ConversationSerializer(serializers.ModelSerializer):
+    counterpart = UserContactSerializer(read_only=True)
+    last_message = WritableMessageSerializer(read_only=True)
+
+    class Meta:
+        model = Conversation
+        fields = ('counterpart', 'last_message', 'last_activity', 'unread_count')
+
+
 class UserFilterSerializer(serializers.Serializer):
     living_type = serializers.ChoiceField(choices=choices.type_choices, required=False)
     payment_options = serializers.ChoiceField(choices=choices.payment_options_choices, required=False)
@@ -159,3 +172,12 @@ class UserFilterSerializer(serializers.Serializer):
             data['name'] = instance.name
 
         return data
+
+
+class BackgroundJobSerializer(serializers.ModelSerializer):
+    kind_display = serializers.CharField(source='get_kind_display', read_only=True)
+    status_display = serializers.CharField(source='get_status_display', read_only=True)
+
+    class Meta:
+        model = BackgroundJob
+        exclude = ('file', )
@@ -1,21 +1,115 @@
-from django.http import HttpResponse
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse, FileResponse, HttpResponseNotModified
 from django.utils.encoding import escape_uri_path
+from django.utils.http import http_date
+from django.views.static import was_modified_since
 
+from itertools import chain
+import csv
 import mimetypes
+import os
+import re
 
 mimetypes.types_map['.docx'] = 'application/msword'  # mimetypes library doesnt contain '.docx' extension
 
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
 
-def generate_http_response_to_download(instance):
+
+def generate_http_response_to_download(instance, request=None):
     """
-    Get instance of available models and generate HttpResponse with file - to download
+    Get instance of available models and generate response with file - to download.
+    If nginx is in front of app ('SENDFILE_X_ACCEL') - response is empty and nginx sends file from internal location,
+    so worker is free right after permission check. Otherwise file is streamed by FileResponse.
     :param instance: Document, Attachment
+    :param request: used for 'Range' and 'If-Modified-Since' headers
     :return: HttpResponse
     """
+    content_type = mimetypes.guess_type(instance.file.name)[0] or 'application/octet-stream'
+    if settings.SENDFILE_X_ACCEL:
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = escape_uri_path(settings.SENDFILE_X_ACCEL_PREFIX + instance.file.name)
+    else:
+        response = generate_file_response(instance.file.path, content_type, request)
+    response['Content-Disposition'] = f'attachment; filename={escape_uri_path(os.path.basename(instance.file.name))}'
+    return response
+
+
+def parse_range(header, size):
+    """
+    Only single range is supported - e.g. 'bytes=0-499', 'bytes=500-', 'bytes=-500'.
+    :return: tuple (start, end) with inclusive end, None if header is not supported or False if range is unsatisfiable
+    """
+    match = RANGE_RE.match(header or '')
+    if not match:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        if not int(end):
+            return False
+        return max(size - int(end), 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def read_range(file, start, length, block_size=FileResponse.block_size):
+    with file:
+        file.seek(start)
+        while length > 0:
+            block = file.read(min(block_size, length))
+            if not block:
+                break
+            length -= len(block)
+            yield block
+
+
+def generate_file_response(path, content_type, request=None):
+    """
+    FileResponse for deployments without nginx.
+    :return: 304 if file isn`t modified since, 206 with requested range or 200 with whole file
+    """
+    stat = os.stat(path)
+    meta = request.META if request is not None else {}
+    if not was_modified_since(meta.get('HTTP_IF_MODIFIED_SINCE'), stat.st_mtime, stat.st_size):
+        return HttpResponseNotModified()
+
+    file_range = parse_range(meta.get('HTTP_RANGE'), stat.st_size)
+    if file_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{stat.st_size}'
+    elif file_range:
+        start, end = file_range
+        response = StreamingHttpResponse(read_range(open(path, 'rb'), start, end - start + 1),
+                                         status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+        response['Content-Length'] = end - start + 1
+    else:
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+    response['Accept-Ranges'] = 'bytes'
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    return response
 
-    with open(instance.file.path, 'rb') as file:
-        file_name = instance.file.name.split('/')[-1].encode('utf-8')
 
-        response = HttpResponse(file, content_type=mimetypes.guess_type(instance.file.name)[0])
-        response['Content-Disposition'] = f'attachment; filename={escape_uri_path(file_name)}'
-        return response
+class Echo:
+    """ Pseudo buffer for csv writer - written row is returned instead of storing it """
+    def write(self, value):
+        return value
+
+
+def generate_csv_streaming_response(queryset, fields, file_name, chunk_size=2000):
+    """
+    Stream queryset as CSV file. Rows are fetched by chunks (server side cursor on PostgreSQL)
+    and only selected fields are loaded, so memory doesn`t depend on number of rows.
+    :param fields: names for 'values_list'. They are used as header
+    :return: StreamingHttpResponse
+    """
+    writer = csv.writer(Echo())
+    rows = queryset.values_list(*fields).iterator(chunk_size=chunk_size)
+    content = chain([writer.writerow(fields)], (writer.writerow(row) for row in rows))
+    response = StreamingHttpResponse(content, content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename={escape_uri_path(file_name)}'
+    return response
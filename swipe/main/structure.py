@@ -0,0 +1,61 @@
+"""
+Bulk generation of house structure: buildings -> sections -> floors -> flats.
+Every level is inserted with one 'bulk_create' and ids are selected back by numbers,
+because not every database returns ids from bulk insert. House row is locked first, so concurrent generation
+for the same house waits and numbers of new rows aren`t taken by another transaction.
+Receivers are skipped, so house counters and chessboard are refreshed at the end.
+"""
+from django.db import transaction
+from django.db.models import Max
+
+from main import chessboard
+
+from _db.models.models import House, Building, Section, Floor, Flat
+
+BATCH_SIZE = 1000
+
+
+@transaction.atomic
+def generate_structure(house, buildings, sections, floors, flats_per_floor, flat_template):
+    """
+    New buildings are numbered after existing ones. Flats are numbered through the house.
+    :param flat_template: dict with Flat fields, the same for every flat
+    :return: dict with lists of created ids for every level
+    """
+    House.objects.select_for_update().values_list('pk', flat=True).get(pk=house.pk)
+    first_building = Building.get_next(house)
+    building_numbers = range(first_building, first_building + buildings)
+    Building.objects.bulk_create([Building(house=house, number=number) for number in building_numbers])
+    building_pks = dict(Building.objects.filter(house=house, number__in=building_numbers)
+                        .values_list('pk', 'number'))
+
+    Section.objects.bulk_create([Section(building_id=building, number=number)
+                                 for building in building_pks for number in range(1, sections + 1)])
+    section_rows = Section.objects.filter(building__in=building_pks).values_list('pk', 'building', 'number')
+    section_pks = {pk: (building_pks[building], number) for pk, building, number in section_rows}
+
+    Floor.objects.bulk_create([Floor(section_id=section, number=number)
+                               for section in section_pks for number in range(1, floors + 1)])
+    floor_rows = Floor.objects.filter(section__in=section_pks).values_list('pk', 'section', 'number')
+    # Flats are numbered building by building, section by section, floor by floor
+    floor_rows = sorted(floor_rows, key=lambda row: (*section_pks[row[1]], row[2]))
+
+    first_flat = last_flat = Flat.objects.filter(house=house).aggregate(last=Max('number'))['last'] or 0
+    flats = []
+    for floor, section, floor_number in floor_rows:
+        building_number, section_number = section_pks[section]
+        for _ in range(flats_per_floor):
+            last_flat += 1
+            flats.append(Flat(floor_id=floor, number=last_flat, house=house, building_number=building_number,
+                              section_number=section_number, floor_number=floor_number, **flat_template))
+    Flat.objects.bulk_create(flats, batch_size=BATCH_SIZE)
+
+    House.objects.filter(pk=house.pk).recount()
+    chessboard.invalidate(house.pk)
+    return {
+        'buildings': sorted(building_pks),
+        'sections': sorted(section_pks),
+        'floors': [row[0] for row in floor_rows],
+        'flats': list(Flat.objects.filter(house=house, number__gt=first_flat, number__lte=last_flat)
+                      .order_by('number').values_list('pk', flat=True)),
+    }
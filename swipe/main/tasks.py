@@ -2,14 +2,19 @@ from celery.schedules import crontab
 
 from swipe.celery import app
 
+from django.apps import apps
 from django.contrib.auth import get_user_model
-from django.db.models import Q
-from django.urls import reverse
+from django.db import transaction
+from django.db.models import F, Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 
 import datetime
 
-from _db.models.models import Promotion, Post
-from _db.models.user import UserFilter, Message
+from main import counters, jobs, images, file_deletion, notifications, filter_matching
+from main.flat_import import import_flats
+from main.purge import HANDLERS as PURGE_HANDLERS
+
+from _db.models.models import Promotion, Post, BackgroundJob
 
 
 User = get_user_model()
@@ -41,64 +46,56 @@ def setup_periodic_tasks(sender, **kwargs):
         check_and_send_notification_about_promotion_time_almost_ending
     )
 
+    # Init task to save buffered views of posts
+    sender.add_periodic_task(
+        60.0,
+        flush_post_counters
+    )
+
+    # Init task to fix likes counters, if they went out of step with likers tables
+    sender.add_periodic_task(
+        crontab(hour='3', minute=0),
+        reconcile_post_likes
+    )
+
+    # Init task to notify users about new posts matching their filters
+    sender.add_periodic_task(
+        10.0,
+        drain_new_posts
+    )
+
+    # Init task to remove files of deleted and replaced instances
+    sender.add_periodic_task(
+        60.0,
+        drain_file_deletions
+    )
+
 
 @app.task
+@transaction.atomic
 def check_subscription():
     users_with_subscription = User.objects.filter(subscribed=True,
                                                   end_date=datetime.date.today())
-    system_user = User.objects.filter(role='SYSTEM').first()
-    for user in users_with_subscription:
-        user.subscribed = False
-        Message.objects.create(sender=system_user, receiver=user,
-                               text='Your subscription has been expired')
-        user.save()
+    notifications.notify(users_with_subscription, 'Your subscription has been expired')
+    users_with_subscription.update(subscribed=False)
 
 
 @app.task
+@transaction.atomic
 def check_promotion():
     promotions = Promotion.objects.filter(end_date=datetime.date.today())
-    system_user = User.objects.filter(role='SYSTEM').first()
-    for promo in promotions:
-        post = promo.post
-        user = post.user
-        weight = promo.type.efficiency
-        promo.delete()
-        post.weight -= weight
-        post.save()
-        Message.objects.create(sender=system_user, receiver=user,
-                               text='Your promotion plan has been expired')
+    notifications.notify(User.objects.filter(posts__promotion__in=promotions),
+                         'Your promotion plan has been expired')
+    # Type could be deleted - then weight of promotion is unknown
+    efficiency = Coalesce(Subquery(promotions.filter(post=OuterRef('pk')).values('type__efficiency')[:1]), 0)
+    Post.objects.filter(promotion__in=promotions).update(weight=F('weight') - efficiency)
+    promotions.delete()
 
 
 @app.task
-def check_filter_matching(post_pk, host):
-    """
-    If new post matches any user`s filter - this users will get notification about new post
-    :param post_pk:
-    :param host: site domains, like '127.0.0.1'
-    """
-    post = Post.objects.get(pk=post_pk)
-    filters = UserFilter.objects.filter(
-        (Q(market=post.living_type) |
-         Q(payment_cond=post.payment_options) |
-         Q(status=post.house.status) |
-         Q(city=post.house.city) |
-         Q(address=post.house.address) |
-         Q(number_of_rooms=post.flat.number_of_rooms) |
-         Q(state=post.flat.state) |
-         Q(max_price=post.price) |
-         Q(min_price=post.price) |
-         Q(max_square=post.flat.square) |
-         Q(min_square=post.flat.square)
-         )
-    )
-    if filters.exists():
-        system_user = User.objects.filter(role='SYSTEM').first()
-        for filterr in filters:
-            user = filterr.user
-            url = f'http://{host}{reverse("main:posts-detail", args=[post.pk])}'
-            text = f'Новое объявление подходит под один из ваших фильтров - {url}'
-            Message.objects.create(sender=system_user, receiver=user,
-                                   text=text)
+def drain_new_posts():
+    """ Notify users whose saved filters match new posts - see 'main.filter_matching' """
+    return filter_matching.drain()
 
 
 @app.task
@@ -107,10 +104,7 @@ def check_and_send_notification_about_subscription_almost_ending():
     next_date = datetime.date.today() + datetime.timedelta(days=10)
     users_with_subscription = User.objects.filter(subscribed=True,
                                                   end_date=next_date)
-    system_user = User.objects.filter(role='SYSTEM').first()
-    for user in users_with_subscription:
-        Message.objects.create(sender=system_user, receiver=user,
-                               text='Your subscription is almost expired')
+    notifications.notify(users_with_subscription, 'Your subscription is almost expired')
 
 
 @app.task
@@ -118,8 +112,73 @@ def check_and_send_notification_about_promotion_time_almost_ending():
     """ Checks if any promotion plans will end in next 10 days. If so - send notification """
     next_date = datetime.date.today() + datetime.timedelta(days=10)
     promotions = Promotion.objects.filter(end_date=next_date)
-    system_user = User.objects.filter(role='SYSTEM').first()
-    for promo in promotions:
-        user = promo.post.user
-        Message.objects.create(sender=system_user, receiver=user,
-                               text='Your promotion plan is almost expired')
+    notifications.notify(User.objects.filter(posts__promotion__in=promotions),
+                         'Your promotion plan is almost expired')
+
+
+@app.task
+def flush_post_counters():
+    """ Save buffered deltas of post counters - see main.counters """
+    return counters.flush()
+
+
+@app.task
+def reconcile_post_likes(batch_size=1000):
+    """
+    Recount likes from likers and dislikers tables.
+    Weight is changed by the same difference, so promotion weight is kept.
+    Not flushed deltas are taken into account.
+    :return: number of fixed posts
+    """
+    counters.flush()
+    fixed = 0
+    posts = Post.objects.order_by('pk').values_list('pk', 'likes')
+    last_pk = 0
+    while True:
+        batch = list(posts.filter(pk__gt=last_pk)[:batch_size])
+        if not batch:
+            return fixed
+        last_pk = batch[-1][0]
+        pks = [pk for pk, likes in batch]
+        likers = dict(Post.likers.through.objects.filter(post__in=pks).values('post')
+                      .annotate(count=Count('pk')).values_list('post', 'count'))
+        dislikers = dict(Post.dislikers.through.objects.filter(post__in=pks).values('post')
+                         .annotate(count=Count('pk')).values_list('post', 'count'))
+        pending = counters.get_pending(pks)
+        for pk, likes in batch:
+            difference = likers.get(pk, 0) - dislikers.get(pk, 0) - likes - pending.get(pk, {}).get('likes', 0)
+            if difference:
+                Post.objects.filter(pk=pk).update(likes=F('likes') + difference, weight=F('weight') + difference)
+                fixed += 1
+
+
+@app.task
+def run_flats_import(job_pk):
+    """ Import flats from file of job. Progress and report are saved to job """
+    jobs.run(BackgroundJob.objects.get(pk=job_pk), import_flats)
+
+
+@app.task
+def run_purge(job_pk):
+    """ Delete house or user of job by batches - see 'main.purge' """
+    job = BackgroundJob.objects.get(pk=job_pk)
+    jobs.run(job, PURGE_HANDLERS[job.kind])
+
+
+@app.task
+def generate_image_variants(model, pk, fields):
+    """
+    Resized copies of uploaded images - see 'main.images'
+    :param model: label of model, like '_db.Post'
+    """
+    instance = apps.get_model(model).objects.filter(pk=pk).first()
+    if instance is None:
+        return
+    for field in fields:
+        images.generate_variants(instance, field)
+
+
+@app.task
+def drain_file_deletions():
+    """ Remove files queued in journal - see 'main.file_deletion' """
+    return file_deletion.drain()
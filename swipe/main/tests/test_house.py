@@ -3,14 +3,21 @@ from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import override_settings
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.cache import cache
 
 from rest_framework.test import APITestCase
 from rest_framework.authtoken.models import Token
 
-from _db.models.models import House, NewsItem, Flat, Building, Section, Floor, RequestToChest, Standpipe
+from _db.models.models import (House, NewsItem, Flat, Building, Section, Floor, RequestToChest, Standpipe,
+                               BackgroundJob, Post, PostImage, FileDeletion)
 
+from unittest.mock import patch
 import tempfile
 import os
+from io import StringIO, BytesIO
+import csv
+import openpyxl
 
 
 User = get_user_model()
@@ -71,8 +78,10 @@ class TestHouse(APITestCase):
         self.assertEqual(response_edit.data['name'], 'Edited Name')
 
         url_delete = reverse('main:houses-detail', args=[response.data['id']])
-        response_delete = self.client.delete(url_delete)
-        self.assertEqual(response_delete.status_code, 204)
+        with self.captureOnCommitCallbacks(execute=True):
+            response_delete = self.client.delete(url_delete)
+        self.assertEqual(response_delete.status_code, 202)
+        self.assertFalse(House.objects.exists())
 
     def test_house_get_list(self):
         """Ensure we can get list of houses non-creator"""
@@ -278,6 +287,256 @@ class TestHouse(APITestCase):
         updated_flat = Flat.objects.get(pk=flat.pk)
         self.assertEqual(updated_flat.client, None)
 
+    def test_house_structure_counters(self):
+        """ Ensure house counters follow structure changes and list of houses doesn`t count rows """
+        house, building, section, floor, flat1, flat2 = self.init_house_structure()
+        url = reverse('main:houses-detail', args=[house.pk])
+        response = self.client.get(url)
+        self.assertEqual([response.data[field] for field in ('building_count', 'section_count', 'floor_count',
+                                                             'flat_count', 'free_flat_count')], [1, 1, 1, 2, 2])
+
+        self.client.patch(reverse('main:booking_flat', args=[flat1.pk]), data={'booking': '1'})
+        house.refresh_from_db()
+        self.assertEqual((house.booked_flat_count, house.free_flat_count), (1, 1))
+
+        building2 = Building.objects.create(number=2, house=house)
+        Floor.objects.create(number=1, section=Section.objects.create(number=1, building=building2))
+        house.refresh_from_db()
+        self.assertEqual((house.building_count, house.section_count, house.floor_count), (2, 2, 2))
+
+        # Cascade delete
+        building.delete()
+        house.refresh_from_db()
+        self.assertEqual([house.building_count, house.section_count, house.floor_count,
+                          house.flat_count, house.booked_flat_count], [1, 1, 1, 0, 0])
+
+        # Bulk operations skip receivers - counters are fixed by command
+        House.objects.filter(pk=house.pk).update(building_count=10, flat_count=10)
+        call_command('recount_houses', stdout=StringIO())
+        house.refresh_from_db()
+        self.assertEqual((house.building_count, house.flat_count), (1, 0))
+
+        # count, houses, image variants
+        self.client.credentials()
+        with self.assertNumQueries(3):
+            self.client.get(reverse('main:houses_public-list'))
+
+    def test_house_chessboard(self):
+        """ Ensure chessboard contains all flats of house, it is cached and follows flat changes """
+        cache.clear()
+        house, building, section, floor, flat1, flat2 = self.init_house_structure()
+        floor2 = Floor.objects.create(number=2, section=section)
+        flat3 = Flat.objects.create(number=3, square=1, kitchen_square=1, price_per_metre=1, price=300,
+                                    number_of_rooms=1, state='BLANK', foundation_doc='OWNER', plan='FREE',
+                                    balcony='YES', floor=floor2, schema=SimpleUploadedFile('image.jpeg', b''))
+
+        url = reverse('main:house_chessboard', args=[house.pk])
+        # token, house, flats
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['flat_fields'], ('id', 'number', 'price', 'number_of_rooms',
+                                                        'booked', 'owned'))
+        floors = response.data['buildings'][0]['sections'][0]['floors']
+        self.assertEqual([floor['number'] for floor in floors], [1, 2])
+        self.assertEqual(floors[0]['flats'], [[flat1.pk, 1, 100, 2, False, False],
+                                              [flat2.pk, 1, 200, 2, False, False]])
+        self.assertEqual(floors[1]['flats'], [[flat3.pk, 3, 300, 1, False, False]])
+
+        with self.assertNumQueries(2):
+            self.client.get(url)
+
+        # Cache is cleared after commit, so request before commit doesn`t cache old rows
+        with self.captureOnCommitCallbacks(execute=True):
+            flat3.floor = floor
+            flat3.save()
+            floors = self.client.get(url).data['buildings'][0]['sections'][0]['floors']
+            self.assertEqual(len(floors), 2)
+        floors = self.client.get(url).data['buildings'][0]['sections'][0]['floors']
+        self.assertEqual(len(floors), 1)
+        self.assertEqual(len(floors[0]['flats']), 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            floor.delete()
+        self.assertEqual(self.client.get(url).data['buildings'], [])
+
+        response_404 = self.client.get(reverse('main:house_chessboard', args=[house.pk + 1]))
+        self.assertEqual(response_404.status_code, 404)
+
+        # Cached chessboard of hidden house isn`t served
+        House.objects.filter(pk=house.pk).update(hidden=True)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    @override_settings(MEDIA_ROOT=tempfile.gettempdir())
+    def test_house_background_deletion(self):
+        """ Ensure house is hidden at once and job deletes its structure by batches with progress """
+        house, building, section, floor, flat1, flat2 = self.init_house_structure()
+        post = Post.objects.create(flat=flat1, house=house, price=1, payment_options='PAYMENT', user=self._user1,
+                                   number=1, main_image=SimpleUploadedFile('image.jpeg', b'file_content'))
+        PostImage.objects.create(post=post, image=SimpleUploadedFile('image.jpeg', b'file_content'))
+
+        url = reverse('main:houses-detail', args=[house.pk])
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.delete(url)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.get(reverse('main:posts_public-list')).data['results'], [])
+        self.assertEqual(self.client.get(reverse('main:flats_public-list')).data['results'], [])
+        self.assertEqual(self.client.get(reverse('main:buildings-detail', args=[building.pk])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('main:sections-detail', args=[section.pk])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('main:floors-detail', args=[floor.pk])).status_code, 404)
+
+        with patch('main.purge.BATCH_SIZE', 1), self.captureOnCommitCallbacks(execute=True):
+            for callback in callbacks:
+                callback()
+        response = self.client.get(reverse('main:jobs-detail', args=[response.data['id']]))
+        # post image, post, 2 flats, floor, section, building, house
+        self.assertEqual((response.data['status'], response.data['total'], response.data['processed']),
+                         ('DONE', 8, 8))
+        self.assertEqual(response.data['report']['deleted']['_db.House'], 1)
+        self.assertFalse(Flat.objects.exists())
+        # Schemas of flats and images of post are queued for deletion
+        self.assertEqual(FileDeletion.objects.count(), 4)
+
+    def test_house_structure_generator(self):
+        """ Ensure whole structure is created by one request with constant number of queries """
+        house, building, *_ = self.init_house_structure()
+        url = reverse('main:house_structure', args=[house.pk])
+        data = {'buildings': 2, 'sections': 3, 'floors': 4, 'flats_per_floor': 1,
+                'flat': {'square': 50, 'kitchen_square': 10, 'price_per_metre': 1000, 'price': 50000,
+                         'number_of_rooms': 2, 'state': 'BLANK', 'foundation_doc': 'OWNER', 'plan': 'FREE',
+                         'balcony': 'YES'}}
+        # token, house, savepoint, house lock, max building, insert and select for every level, max flat, recount,
+        # flat ids, release savepoint
+        with self.assertNumQueries(16):
+            response = self.client.post(url, data=data, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([len(response.data[level]) for level in ('buildings', 'sections', 'floors', 'flats')],
+                         [2, 6, 24, 24])
+
+        new_building = Building.objects.get(pk=response.data['buildings'][0])
+        self.assertEqual(new_building.number, building.number + 1)
+        last_flat = Flat.objects.get(pk=response.data['flats'][-1])
+        self.assertEqual((last_flat.number, last_flat.building_number, last_flat.section_number,
+                          last_flat.floor_number), (25, 3, 3, 4))
+        house.refresh_from_db()
+        self.assertEqual((house.building_count, house.section_count, house.floor_count, house.flat_count),
+                         (3, 7, 25, 26))
+
+        # Next floor of section is numbered after existing ones
+        url_floor = reverse('main:floors-list')
+        response_floor = self.client.post(url_floor, data={'section': Section.objects.last().pk})
+        self.assertEqual(response_floor.status_code, 201)
+        self.assertEqual(response_floor.data['number'], 5)
+
+        response_limit = self.client.post(url, data={**data, 'floors': 200, 'flats_per_floor': 50}, format='json')
+        self.assertEqual(response_limit.status_code, 400)
+
+        # Only house owner can generate structure
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Bearer {Token.objects.get(user__email=self._test_user_email_two)}'
+        )
+        self.assertEqual(self.client.post(url, data=data, format='json').status_code, 403)
+
+    def test_flat_export(self):
+        """ Ensure flats of house are streamed as CSV """
+        house, building, section, floor, flat1, flat2 = self.init_house_structure()
+        response = self.client.get(reverse('main:export_flats', args=[house.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        rows = list(csv.reader(b''.join(response.streaming_content).decode('utf-8').splitlines()))
+        self.assertEqual(rows[0][:5], ['id', 'number', 'building_number', 'section_number', 'floor_number'])
+        self.assertEqual([row[0] for row in rows[1:]], [str(flat1.pk), str(flat2.pk)])
+
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Bearer {Token.objects.get(user__email=self._test_user_email_two)}'
+        )
+        self.assertEqual(self.client.get(reverse('main:export_flats', args=[house.pk])).status_code, 403)
+
+    def test_flat_reprice(self):
+        """ Ensure prices of flats and their posts are changed by one query per table """
+        house, building, section, floor, flat1, flat2 = self.init_house_structure()
+        floor2 = Floor.objects.create(number=2, section=section)
+        flat3 = Flat.objects.create(number=3, square=50, kitchen_square=1, price_per_metre=20, price=1000,
+                                    number_of_rooms=1, state='BLANK', foundation_doc='OWNER', plan='FREE',
+                                    balcony='YES', floor=floor2, schema=SimpleUploadedFile('image.jpeg', b''))
+        post = Post.objects.create(flat=flat1, house=house, price=101, payment_options='PAYMENT', user=self._user1,
+                                   number=1, main_image=SimpleUploadedFile('image.jpeg', b''))
+
+        url = reverse('main:reprice_flats', args=[house.pk])
+        # token, house, savepoint, flats, posts, release savepoint
+        with self.assertNumQueries(6):
+            response = self.client.post(url, data={'floor': 1, 'percent': 10, 'update_posts': True})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'flats': 2, 'posts': 1})
+        flat1.refresh_from_db()
+        self.assertEqual((round(flat1.price, 2), round(flat1.price_per_metre, 2)), (110, 1.1))
+        self.assertEqual(Post.objects.get(pk=post.pk).price, 111)
+        flat3.refresh_from_db()
+        self.assertEqual(flat3.price, 1000)
+
+        response_amount = self.client.post(url, data={'floor': 2, 'amount': -2000})
+        self.assertEqual(response_amount.data, {'flats': 1})
+        flat3.refresh_from_db()
+        self.assertEqual((flat3.price, flat3.price_per_metre), (0, 0))
+
+        response_error = self.client.post(url, data={'percent': 10, 'amount': 100})
+        self.assertEqual(response_error.status_code, 400)
+
+    @override_settings(MEDIA_ROOT=tempfile.gettempdir())
+    def test_flat_import(self):
+        """ Ensure flats are imported from CSV and XLSX files and invalid rows are reported """
+        house, building, section, floor, *_ = self.init_house_structure()
+        url = reverse('main:import_flats', args=[house.pk])
+        header = ['Building', 'Section', 'Floor', 'Number', 'Square', 'Kitchen_square', 'Price_per_metre', 'Price',
+                  'Number_of_rooms', 'State', 'Foundation_doc', 'Plan', 'Balcony']
+        rows = [
+            [1, 1, 1, 10, 50.5, 10, 1000, 50500, 2, 'BLANK', 'OWNER', 'FREE', 'YES'],
+            [1, 1, 2, 11, 50, 10, 1000, 50000, 2, 'BLANK', 'OWNER', 'FREE', 'YES'],  # floor doesn`t exist
+            [1, 1, 1, 12, 'big', 10, 1000, 50000, 2, 'WRONG', 'OWNER', 'FREE', 'YES'],
+            [],
+            [1, 1, 1, 13, 70, 12, 1000, 70000, 3, 'EURO', 'OWNER', 'FREE', 'NO'],
+        ]
+        content = StringIO()
+        csv.writer(content).writerows([header] + rows)
+        file = SimpleUploadedFile('flats.csv', content.getvalue().encode('utf-8'), content_type='text/csv')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, data={'file': file})
+        self.assertEqual(response.status_code, 202)
+        response_job = self.client.get(reverse('main:jobs-detail', args=[response.data['id']]))
+        self.assertEqual(response_job.data['status'], 'DONE')
+        self.assertEqual((response_job.data['total'], response_job.data['processed']), (4, 4))
+        report = response_job.data['report']
+        self.assertEqual((report['created'], report['error_count']), (2, 2))
+        self.assertEqual(report['errors'][0], {'row': 3, 'errors': {'floor': ['Floor doesn`t exist']}})
+        self.assertEqual(report['errors'][1]['row'], 4)
+        self.assertEqual(set(report['errors'][1]['errors']), {'square', 'state'})
+
+        flat = Flat.objects.get(house=house, number=13)
+        self.assertEqual((flat.floor, flat.state, flat.type, flat.floor_number), (floor, 'EURO', 'FLAT', 1))
+        house.refresh_from_db()
+        self.assertEqual(house.flat_count, 4)
+
+        workbook = openpyxl.Workbook()
+        workbook.active.append(header)
+        workbook.active.append(rows[0])
+        content = BytesIO()
+        workbook.save(content)
+        file = SimpleUploadedFile('flats.xlsx', content.getvalue())
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, data={'file': file})
+        job = BackgroundJob.objects.get(pk=response.data['id'])
+        self.assertEqual((job.status, job.total, job.report['created']), ('DONE', 1, 1))
+
+        # Wrong file is reported by job
+        file = SimpleUploadedFile('flats.csv', b'number,price\n1,100')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, data={'file': file})
+        job = BackgroundJob.objects.get(pk=response.data['id'])
+        self.assertEqual(job.status, 'FAILED')
+        self.assertIn('building', job.report['error'])
+
     def test_all_houses_public(self):
         """Ensure we can get all house even if we are not authenticated"""
         self.init_house_structure()
@@ -3,19 +3,36 @@ from rest_framework.authtoken.models import Token
 
 from django.urls import reverse
 from django.conf import settings
-from django.test import override_settings
+from django.test import override_settings, TransactionTestCase
+from django.db import connection, close_old_connections
+from django.db.models import Q
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.signals import request_started, request_finished
 
-from main.tasks import check_promotion, check_and_send_notification_about_promotion_time_almost_ending
+from main.tasks import (check_promotion, check_and_send_notification_about_promotion_time_almost_ending,
+                        flush_post_counters, reconcile_post_likes, drain_new_posts)
+from main import counters, filter_matching
+from main.reactions import toggle_reaction
+
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
+
+from swipe.asgi import application
 
 from _db.models.models import *
 from _db.models.user import UserFilter, Message
 
+import io
 import os
+import csv
 import tempfile
+import threading
+import time
 import datetime
 import pytz
 from dateutil.relativedelta import relativedelta
+from unittest.mock import patch
 
 
 class TestPost(APITestCase):
@@ -30,6 +47,7 @@ class TestPost(APITestCase):
         )
         self.temp_media_image_path = os.path.join(settings.BASE_DIR, 'main/tests/test_media/test_image.png')
         self._url = reverse('main:users-detail', args=[self._user1.pk])
+        counters.clear()
 
     def init_house_structure(self):
         url = reverse('main:houses-list')
@@ -130,6 +148,34 @@ class TestPost(APITestCase):
         self.assertEqual(response_delete.status_code, 204)
         self.assertEqual(PostImage.objects.count(), 0)
 
+    @override_settings(MEDIA_ROOT=tempfile.gettempdir())
+    def test_post_image_variants(self):
+        """ Ensure resized variants are generated after upload, listed in srcset and can be backfilled """
+        house, *_, flat = self.init_house_structure()
+        with open(self.temp_media_image_path, 'rb') as file, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('main:posts-list'), data={'flat': flat.pk, 'house': house.pk,
+                                                                          'price': 100000,
+                                                                          'payment_options': 'PAYMENT',
+                                                                          'main_image': file})
+        self.assertEqual(response.status_code, 201)
+        post = Post.objects.get(pk=response.data['id'])
+        variants = post.image_variants.exclude(variant='ORIGINAL')
+        # Image is 1143px wide, so it isn`t upscaled to 1280px
+        self.assertEqual(set(variants.values_list('width', flat=True)), {320, 640, 1143})
+        self.assertEqual(variants.count(), 6)
+
+        response = self.client.get(reverse('main:posts-detail', args=[post.pk]))
+        srcset = response.data['main_image_srcset']
+        self.assertEqual((srcset['width'], srcset['height']), (1143, 580))
+        self.assertEqual(srcset['webp'].count('w, ') + 1, 3)
+        self.assertIn(' 320w', srcset['jpeg'])
+
+        ImageVariant.objects.all().delete()
+        call_command('generate_image_variants', 'post', stdout=io.StringIO())
+        self.assertEqual(post.image_variants.count(), 7)
+        response = self.client.get(reverse('main:posts-detail', args=[post.pk]))
+        self.assertIsNotNone(response.data['main_image_srcset'])
+
     @override_settings(MEDIA_ROOT=tempfile.gettempdir())
     def test_post_filters(self):
         house, house2, *_, flat1, flat2 = self.init_house_structure()
@@ -167,6 +213,22 @@ class TestPost(APITestCase):
         self.assertEqual(response3.status_code, 200)
         self.assertEqual(response3.data.get('results')[0]['flat_info']['city'], 'Kiev')
 
+    @override_settings(MEDIA_ROOT=tempfile.gettempdir())
+    def test_public_posts_with_wrong_token(self):
+        """ Ensure public posts are shown to anonymous user when token is invalid or stale """
+        house, *_, flat = self.init_house_structure()
+        post, *_ = self.init_post(house, flat)
+
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer wrong')
+        response = self.client.get(reverse('main:posts_public-list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 3)
+        response = self.client.get(reverse('main:posts_public-detail', args=[post.pk]))
+        self.assertEqual(response.status_code, 200)
+        # Private views still reject it
+        response = self.client.get(reverse('main:posts-list'))
+        self.assertEqual(response.status_code, 401)
+
     @override_settings(MEDIA_ROOT=tempfile.gettempdir())
     def test_post_favorites(self):
         """Ensure we can make CRUD operations with user`s favorites list"""
@@ -203,18 +265,24 @@ class TestPost(APITestCase):
         url_get = reverse('main:posts_public-detail', args=[post.pk])
         self.client.get(url_get)
         self.client.get(url_get)
-        self.client.get(url_get)
+        response_get = self.client.get(url_get)
+        # Views are buffered, but response already contains them
+        self.assertEqual(response_get.data['views'], 3)
+        self.assertEqual(Post.objects.first().views, 0)
+        self.assertEqual(flush_post_counters(), 1)
         self.assertEqual(Post.objects.first().views, 3)
 
         # Ensure we can like and dislike post
         url_like = reverse('main:like_dislike', args=[post.pk])
         response_increment_like = self.client.patch(url_like, data={'action': 'like'})
         self.assertEqual(response_increment_like.status_code, 200)
+        flush_post_counters()
         self.assertEqual(Post.objects.first().likes, 1)
         self.assertIn(user, Post.objects.first().likers.all())
 
         response_decrement_like = self.client.patch(url_like, data={'action': 'dislike'})
         self.assertEqual(response_decrement_like.status_code, 200)
+        flush_post_counters()
         self.assertEqual(Post.objects.first().likes, -1)
         self.assertIn(user, Post.objects.first().dislikers.all())
         self.assertNotIn(user, Post.objects.first().likers.all())
@@ -222,9 +290,58 @@ class TestPost(APITestCase):
         # Remove dislike if user 'tap' buttons twice
         response_remove_dislike = self.client.patch(url_like, data={'action': 'dislike'})
         self.assertEqual(response_remove_dislike.status_code, 200)
+        flush_post_counters()
         self.assertEqual(Post.objects.first().likes, 0)
         self.assertNotIn(user, Post.objects.first().dislikers.all())
 
+    @override_settings(MEDIA_ROOT=tempfile.gettempdir())
+    def test_counters_queue_gap(self):
+        """ Ensure flush waits for position which is taken but not written yet and skips it if writer died """
+        house, *_, flat = self.init_house_structure()
+        post, post2, _ = self.init_post(house, flat)
+        cache = counters.get_cache()
+        # 'add' of post took position 1 and didn`t write pk yet
+        cache.add(f'{counters.PREFIX}:{post.pk}:queued', 1)
+        counters.incr(cache, f'{counters.PREFIX}:queue', 1)
+        counters.incr(cache, counters.get_key(post.pk, 'views'), 2)
+        counters.add(post2.pk, views=1)
+
+        self.assertEqual(flush_post_counters(), 0)
+        cache.set(counters.get_position_key(1), post.pk)
+        self.assertEqual(flush_post_counters(), 2)
+        self.assertEqual(list(Post.objects.filter(pk__in=[post.pk, post2.pk]).order_by('pk')
+                              .values_list('views', flat=True)), [2, 1])
+        self.assertEqual(counters.get_pending([post.pk, post2.pk]), {})
+
+        # Writer died - position is skipped after timeout, post is queued again by next delta
+        counters.incr(cache, f'{counters.PREFIX}:queue', 1)
+        counters.add(post2.pk, views=1)
+        self.assertEqual(flush_post_counters(), 0)
+        with patch.object(counters, 'GAP_TIMEOUT', -1):
+            self.assertEqual(flush_post_counters(), 1)
+        self.assertEqual(Post.objects.get(pk=post2.pk).views, 2)
+
+    def test_counters_flushed_keys_expire(self):
+        """ Ensure keys flushed to zero expire and next delta of post is kept """
+        house, *_, flat = self.init_house_structure()
+        post, *_ = self.init_post(house, flat)
+        cache = counters.get_cache()
+        key = counters.get_key(post.pk, 'views')
+        counters.add(post.pk, views=2)
+        with patch.object(counters, 'FLUSHED_TIMEOUT', 0):
+            self.assertEqual(flush_post_counters(), 1)
+        self.assertNotIn(key, cache)
+
+        # Key which waits for expiration becomes persistent with new delta
+        counters.add(post.pk, views=1)
+        with patch.object(counters, 'FLUSHED_TIMEOUT', 0.05):
+            counters.flush()
+        counters.add(post.pk, views=1)
+        time.sleep(0.1)
+        self.assertEqual(cache.get(key), 1)
+        self.assertEqual(flush_post_counters(), 1)
+        self.assertEqual(Post.objects.get(pk=post.pk).views, 4)
+
     @override_settings(MEDIA_ROOT=tempfile.gettempdir())
     def test_post_confirm_relevance_with_old_date(self):
         """Ensure we can update post 'created' field if old 'created' date is more than 31 days old"""
@@ -641,6 +758,7 @@ class TestPost(APITestCase):
         url_like = reverse('main:like_dislike', args=[post2.pk])
         response_increment_like = self.client.patch(url_like, data={'action': 'like'})
         self.assertEqual(response_increment_like.status_code, 200)
+        flush_post_counters()
         self.assertEqual(Post.objects.get(pk=post2.pk).likes, 1)
 
         response_post_after_like = self.client.get(url_post_list)
@@ -650,6 +768,7 @@ class TestPost(APITestCase):
 
         response_decrement_like = self.client.patch(url_like, data={'action': 'dislike'})
         self.assertEqual(response_decrement_like.status_code, 200)
+        flush_post_counters()
         self.assertEqual(Post.objects.get(pk=post2.pk).likes, -1)
 
         response_post_after_dislike = self.client.get(url_post_list)
@@ -658,11 +777,117 @@ class TestPost(APITestCase):
         # Remove dislike if user 'tap' buttons twice
         response_remove_dislike = self.client.patch(url_like, data={'action': 'dislike'})
         self.assertEqual(response_remove_dislike.status_code, 200)
+        flush_post_counters()
         self.assertEqual(Post.objects.first().likes, 0)
 
         response_post_after_remove_dislike = self.client.get(url_post_list)
         self.assertEqual(response_post_after_remove_dislike.data.get('results')[1]['weight'], 0)
 
+    def test_post_reaction_flags(self):
+        """ Ensure feed contains reactions of current user and they can be requested for list of posts """
+        house, *_, flat = self.init_house_structure()
+        post, post2, post3 = self.init_post(house, flat)
+        post.likers.add(self._user1)
+        post2.dislikers.add(self._user1)
+        post2.in_favorites.add(self._user1)
+        post3.likers.add(self._user2)
+
+        response = self.client.get(reverse('main:posts_public-list'))
+        self.assertEqual(response.status_code, 200)
+        flags = {item['id']: (item['is_liked'], item['is_disliked'], item['is_favorite'])
+                 for item in response.data['results']}
+        self.assertEqual(flags, {post.pk: (True, False, False), post2.pk: (False, True, True),
+                                 post3.pk: (False, False, False)})
+
+        url_reactions = reverse('main:reactions')
+        with self.assertNumQueries(2):
+            response_reactions = self.client.get(url_reactions, data={'ids': f'{post2.pk},{post.pk},0'})
+        self.assertEqual(response_reactions.status_code, 200)
+        self.assertEqual(response_reactions.data, [
+            {'post': post.pk, 'is_liked': True, 'is_disliked': False, 'is_favorite': False},
+            {'post': post2.pk, 'is_liked': False, 'is_disliked': True, 'is_favorite': True},
+        ])
+        response_wrong = self.client.get(url_reactions, data={'ids': 'one'})
+        self.assertEqual(response_wrong.status_code, 400)
+
+        response_action = self.client.get(reverse('main:like_dislike', args=[post2.pk]))
+        self.assertEqual(response_action.data['action'], 'dislike')
+
+        # Anonymous user gets no reactions
+        self.client.credentials()
+        response_anonymous = self.client.get(reverse('main:posts_public-detail', args=[post.pk]))
+        self.assertFalse(response_anonymous.data['is_liked'])
+
+    def test_posts_and_complaints_export(self):
+        """ Ensure user can export his posts and admin can export complaints as CSV """
+        house, *_, flat = self.init_house_structure()
+        post, post2, post3 = self.init_post(house, flat)
+        Complaint.objects.create(post=post, user=self._user2, type='PRICE', description='Тест')
+
+        response = self.client.get(reverse('main:export_posts'))
+        self.assertEqual(response.status_code, 200)
+        rows = list(csv.reader(b''.join(response.streaming_content).decode('utf-8').splitlines()))
+        self.assertEqual(rows[0][:2], ['id', 'number'])
+        self.assertEqual(sorted(int(row[0]) for row in rows[1:]), [post.pk, post2.pk, post3.pk])
+
+        url_complaints = reverse('main:export_complaints')
+        self.assertEqual(self.client.get(url_complaints).status_code, 403)
+        self._user1.is_staff = True
+        self._user1.save()
+        response_complaints = self.client.get(url_complaints)
+        rows = list(csv.reader(b''.join(response_complaints.streaming_content).decode('utf-8').splitlines()))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[1][2:5], ['PRICE', 'False', 'Тест'])
+
+    async def test_export_over_asgi(self):
+        """ Ensure streaming export reads database outside of event loop when it is served by ASGI """
+        house, *_, flat = await sync_to_async(self.init_house_structure)()
+        post, *_ = await sync_to_async(self.init_post)(house, flat)
+        token = await sync_to_async(Token.objects.get)(user__email=self._test_user_email)
+        communicator = ApplicationCommunicator(application, {
+            'type': 'http', 'method': 'GET', 'path': reverse('main:export_posts'), 'query_string': b'',
+            'headers': [(b'authorization', f'Bearer {token.key}'.encode()), (b'host', b'testserver')],
+        })
+        # As in test client - connection of test transaction mustn`t be closed by request
+        request_started.disconnect(close_old_connections)
+        request_finished.disconnect(close_old_connections)
+        try:
+            await communicator.send_input({'type': 'http.request'})
+            start = await communicator.receive_output(1)
+            self.assertEqual(start['status'], 200)
+            body = b''
+            while True:
+                message = await communicator.receive_output(1)
+                body += message.get('body', b'')
+                if not message.get('more_body'):
+                    break
+        finally:
+            request_started.connect(close_old_connections)
+            request_finished.connect(close_old_connections)
+        rows = list(csv.reader(body.decode('utf-8').splitlines()))
+        self.assertEqual(len(rows), 4)
+        self.assertIn(str(post.pk), [row[0] for row in rows])
+
+    def test_reconcile_post_likes(self):
+        """ Ensure likes counter is recounted from likers and dislikers and weight is changed by the same value """
+        house, *_, flat = self.init_house_structure()
+        post, post2, post3 = self.init_post(house, flat)
+        post.likers.add(self._user1, self._user2)
+        post2.dislikers.add(self._user1)
+        Post.objects.filter(pk=post3.pk).update(likes=5, weight=105)
+
+        # Buffered like of user2 is not lost
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {Token.objects.get(user=self._user2)}')
+        self.client.patch(reverse('main:like_dislike', args=[post3.pk]), data={'action': 'like'})
+
+        self.assertEqual(reconcile_post_likes(batch_size=2), 3)
+        self.assertEqual(reconcile_post_likes(), 0)
+        self.assertEqual(Post.objects.get(pk=post.pk).likes, 2)
+        self.assertEqual(Post.objects.get(pk=post2.pk).likes, -1)
+        self.assertEqual(Post.objects.get(pk=post2.pk).weight, -1)
+        self.assertEqual(Post.objects.get(pk=post3.pk).likes, 1)
+        self.assertEqual(Post.objects.get(pk=post3.pk).weight, 101)
+
     def test_add_promotion_without_pay(self):
         """ Ensure unpaid promotion will have no effect on post
             Also, test that change status from 'unpaid' to 'paid' will have effect on post
@@ -782,19 +1007,63 @@ class TestPost(APITestCase):
         )
         house, *_, flat = self.init_house_structure()
         url_create = reverse('main:posts-list')
-        with open(self.temp_media_image_path, 'rb') as file:
-            response_create = self.client.post(url_create, data={'flat': flat.pk,
-                                                                 'house': house.pk,
-                                                                 'price': 100000,
-                                                                 'payment_options': 'PAYMENT',
-                                                                 'main_image': file})
+        with self.captureOnCommitCallbacks(execute=True):
+            with open(self.temp_media_image_path, 'rb') as file:
+                response_create = self.client.post(url_create, data={'flat': flat.pk,
+                                                                     'house': house.pk,
+                                                                     'price': 100000,
+                                                                     'payment_options': 'PAYMENT',
+                                                                     'main_image': file})
         self.assertEqual(response_create.status_code, 201)
 
-        # Ensure we get notification from system
+        # Post is queued after commit and drained by celery task started then
         messages = Message.objects.filter(receiver__email=self._test_user_email)
+        self.assertFalse(NewPostEvent.objects.exists())
+        self.assertEqual(drain_new_posts.apply().get(), (0, 0))
+
+        # Ensure we get notification from system
         self.assertGreater(messages.count(), 0)
         self.assertEqual(messages.first().sender.role, 'SYSTEM')
 
+    def test_filter_index_matching(self):
+        """ Ensure post matches only filters whose every predicate it satisfies. Filters are saved by api """
+        house, *_, flat = self.init_house_structure()
+        post, *_ = self.init_post(house, flat)
+        House.objects.filter(pk=house.pk).update(status='FLATS')
+        User.objects.filter(pk=self._user1.pk).update(subscribed=True)
+
+        def save_filter(**data):
+            response = self.client.post(reverse('main:user_filters-list'), data=data)
+            self.assertEqual(response.status_code, 201)
+            return response.data['saved_filter_pk']
+
+        matching = [
+            save_filter(),
+            save_filter(house__city='Odessa', payment_options='PAYMENT', price__gte=5000, price__lte=20000),
+            save_filter(flat__square__gte=150),
+            # Choices of post are stored as they are
+            save_filter(flat__state='EURO', living_type='MANY', house__status='FLATS'),
+        ]
+        # Wrong state, market, status, city, price below and above range
+        save_filter(flat__state='BLANK')
+        save_filter(living_type='ONE')
+        save_filter(house__status='OFFICES')
+        save_filter(house__city='Kiev')
+        save_filter(price__lte=1000, payment_options='PAYMENT')
+        save_filter(price__gte=20000)
+
+        post = Post.objects.select_related('house', 'flat').get(pk=post.pk)
+        self.assertEqual((post.living_type, post.flat.state, post.house.status), ('MANY', 'EURO', 'FLATS'))
+        values = filter_matching.get_post_values(post)
+        with self.assertNumQueries(1):
+            index = filter_matching.FilterIndex.for_posts([values])
+        found = index.match(values)
+        self.assertEqual(sorted(row['pk'] for row in found), matching)
+        # Filters with price bounds out of post price aren`t loaded
+        loaded = {row['pk'] for _, bucket in index.buckets.values() for row in bucket}
+        self.assertFalse(loaded & set(UserFilter.objects.filter(Q(max_price=1000) | Q(min_price=20000))
+                                      .values_list('pk', flat=True)))
+
     def test_celery_check_notification_about_promotion_almost_ending(self):
         """ Ensure we get notification if out promotion plan will end in next 10 days """
         house, *_, flat = self.init_house_structure()
@@ -820,3 +1089,184 @@ class TestPost(APITestCase):
         self.assertTrue(message.exists())
         self.assertEqual(message.first().text, 'Your promotion plan is almost expired')
 
+
+    @override_settings(MEDIA_ROOT=tempfile.gettempdir())
+    def test_post_keyset_pagination(self):
+        """ Ensure cursor mode walks the whole feed without duplicates and can go back """
+        house, *_, flat = self.init_house_structure()
+        file = SimpleUploadedFile('image.jpeg', b'file_content', content_type='image/jpeg')
+        for number in range(1, 20):
+            Post.objects.create(flat=flat, house=house, price=1000, payment_options='PAYMENT',
+                                main_image=file, user=self._user1, number=number, weight=number % 3)
+        expected = list(Post.objects.order_by('-weight', '-created', '-id').values_list('pk', flat=True))
+
+        url = reverse('main:posts_public-list')
+        response = self.client.get(url, data={'cursor': ''})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('count', response.data)
+        self.assertIsNone(response.data['previous'])
+
+        pages = [response.data]
+        while pages[-1]['next']:
+            pages.append(self.client.get(pages[-1]['next']).data)
+        walked = [post['id'] for page in pages for post in page['results']]
+        self.assertEqual(walked, expected)
+        self.assertEqual(len(pages), 3)
+
+        # Go back from the last page
+        response_previous = self.client.get(pages[-1]['previous'])
+        self.assertEqual([post['id'] for post in response_previous.data['results']],
+                         [post['id'] for post in pages[1]['results']])
+
+        response_invalid = self.client.get(url, data={'cursor': 'invalid'})
+        self.assertEqual(response_invalid.status_code, 404)
+
+        # Search is ordered by rank, which cursor doesn`t keep
+        response_search = self.client.get(url, data={'cursor': '', 'q': house.city})
+        self.assertEqual(response_search.status_code, 400)
+        response_search = self.client.get(url, data={'page': 2, 'q': house.city})
+        self.assertEqual(response_search.status_code, 200)
+
+    @override_settings(MEDIA_ROOT=tempfile.gettempdir())
+    def test_post_list_query_plan(self):
+        """ Ensure any page of posts costs the same number of queries """
+        house, *_, flat = self.init_house_structure()
+        promotion_type = PromotionType.objects.first()
+        file = SimpleUploadedFile('image.jpeg', b'file_content', content_type='image/jpeg')
+
+        def create_posts(start, count):
+            for number in range(start, start + count):
+                post = Post.objects.create(flat=flat, house=house, price=1000, payment_options='PAYMENT',
+                                           main_image=file, user=self._user1, number=number)
+                PostImage.objects.create(post=post, image=file)
+                Promotion.objects.create(post=post, type=promotion_type, price=1, end_date=datetime.date.today())
+                post.likers.add(self._user2)
+                post.in_favorites.add(self._user1)
+
+        # count, posts, images, variants of images, variants of posts. Likers aren`t loaded
+        create_posts(1, 1)
+        self.client.credentials()
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('main:posts_public-list'))
+        self.assertEqual(len(response.data['results']), 1)
+
+        create_posts(2, 7)
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('main:posts_public-list'))
+        self.assertEqual(len(response.data['results']), 8)
+        # Token authentication is one more query. Reaction flags are subqueries of posts query
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self._token}')
+        with self.assertNumQueries(6):
+            self.client.get(reverse('main:posts_public-list'))
+        with self.assertNumQueries(6):
+            self.client.get(reverse('main:posts-list'))
+        with self.assertNumQueries(6):
+            self.client.get(reverse('main:favorites_posts-list'))
+
+        Complaint.objects.bulk_create([Complaint(post=post, user=self._user2, type='PRICE')
+                                       for post in Post.objects.all()])
+        self._user1.is_staff = True
+        self._user1.save()
+        with self.assertNumQueries(6):
+            response = self.client.get(reverse('main:posts_moderation-list'))
+        self.assertEqual(len(response.data['results']), 8)
+
+    @override_settings(MEDIA_ROOT=tempfile.gettempdir())
+    def test_post_search(self):
+        """ Ensure 'q' param searches by index of current database backend and it follows house changes """
+        house, house2, *_, flat1, flat2 = self.init_house_structure()
+        file = SimpleUploadedFile('image.jpeg', b'file_content', content_type='image/jpeg')
+        post = Post.objects.create(flat=flat1, house=house, price=1000, payment_options='PAYMENT', main_image=file,
+                                   user=self._user1, number=1, description='Sea view')
+        Post.objects.create(flat=flat2, house=house2, price=1000, payment_options='PAYMENT', main_image=file,
+                            user=self._user1, number=2)
+
+        url = reverse('main:posts_public-list')
+        response = self.client.get(url, data={'q': 'sea'})
+        self.assertEqual([item['id'] for item in response.data['results']], [post.pk])
+
+        house.city = 'Lviv'
+        house.save()
+        response = self.client.get(url, data={'q': 'Lviv'})
+        self.assertEqual([item['id'] for item in response.data['results']], [post.pk])
+        response = self.client.get(url, data={'q': 'Odessa'})
+        self.assertEqual(response.data['results'], [])
+
+        # Search by city only
+        response = self.client.get(url, data={'house__city': 'sea'})
+        self.assertEqual(response.data['results'], [])
+        response = self.client.get(url, data={'house__city': 'lviv'})
+        self.assertEqual([item['id'] for item in response.data['results']], [post.pk])
+
+
+class TestReactionConcurrency(TransactionTestCase):
+    """ Many users like one post at the same time """
+    threads = 8
+    reactions = 5
+
+    def setUp(self):
+        counters.clear()
+        self.users = [User.objects.create(phone_number=f'+38063000000{number}') for number in range(self.threads)]
+        house = House.objects.create(name='House', address='Street', city='Odessa', tech='MONO1',
+                                     territory='OPEN', payment_options='MORTGAGE', role='FLAT',
+                                     sales_department=self.users[0])
+        building = Building.objects.create(number=1, house=house)
+        section = Section.objects.create(number=1, building=building)
+        floor = Floor.objects.create(number=1, section=section)
+        flat = Flat.objects.create(number=1, square=1, kitchen_square=1, price_per_metre=1, price=1,
+                                   schema='schema.png', number_of_rooms=1, state='BLANK', foundation_doc='OWNER',
+                                   plan='FREE', balcony='YES', floor=floor)
+        self.post = Post.objects.create(number=1, payment_options='PAYMENT', price=1000, flat=flat, house=house,
+                                        user=self.users[0], main_image='image.png')
+
+    def hammer(self, user, errors):
+        try:
+            # Odd number of taps - every user ends with like
+            for number in range(self.reactions):
+                toggle_reaction(self.post.pk, user, 'like' if number % 2 == 0 else 'dislike')
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connection.close()
+
+    def run_threads(self, target, args):
+        errors = []
+        threads = [threading.Thread(target=target, args=(*item, errors)) for item in args]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def tap(self, user, errors):
+        try:
+            toggle_reaction(self.post.pk, user, 'like')
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connection.close()
+
+    def test_concurrent_reactions(self):
+        """ Ensure counters match likers table when reactions of one post arrive concurrently """
+        self.run_threads(self.hammer, [(user, ) for user in self.users])
+
+        flush_post_counters()
+        post = Post.objects.get(pk=self.post.pk)
+        self.assertEqual(post.likers.count(), self.threads)
+        self.assertEqual(post.dislikers.count(), 0)
+        self.assertEqual(post.likes, self.threads)
+        self.assertEqual(post.weight, self.threads)
+        self.assertEqual(reconcile_post_likes(), 0)
+
+    def test_double_tap(self):
+        """ Ensure counters match likers table when one user sends the same reaction twice at once """
+        user = self.users[1]
+        self.run_threads(self.tap, [(user, ), (user, )])
+
+        flush_post_counters()
+        post = Post.objects.get(pk=self.post.pk)
+        self.assertEqual(post.dislikers.count(), 0)
+        self.assertIn(post.likers.count(), (0, 1))
+        self.assertEqual(post.likes, post.likers.count())
+        self.assertEqual(post.weight, post.likers.count())
+        self.assertEqual(reconcile_post_likes(), 0)
@@ -5,13 +5,24 @@ from django.test import override_settings
 from rest_framework.test import APITestCase
 from rest_framework.authtoken.models import Token
 
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
+
 from main.tests.utils import get_temporary_image
+from main import notifications
+from main.websocket import CLOSE_UNAUTHORIZED
+from main.reactions import toggle_reaction
 from main.tasks import check_subscription, check_and_send_notification_about_subscription_almost_ending
 
-from _db.models.user import Contact, User, Message
+from _db.models.user import Contact, User, Message, Attachment, Conversation, UserFilter
+from _db.models.models import House, Building, Section, Floor, Flat, Post
+
+from swipe.asgi import application
 
 import tempfile
 import datetime
+import json
+from unittest.mock import patch
 
 
 class TestUser(APITestCase):
@@ -140,7 +151,7 @@ class TestUser(APITestCase):
         response = self.client.get(url)
         self.assertEqual(response.status_code, 200)
 
-        url_edit = reverse('main:edit_message', args=[response.data[0]['pk']])
+        url_edit = reverse('main:edit_message', args=[response.data['results'][0]['pk']])
         response = self.client.patch(url_edit, data={'text': 'Edited text'})
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.data['text'], 'Edited text')
@@ -151,6 +162,99 @@ class TestUser(APITestCase):
         messages = Message.objects.all()
         self.assertEqual(messages.count(), 0)
 
+    @override_settings(MEDIA_ROOT=tempfile.gettempdir())
+    def test_message_history_pagination(self):
+        """ Ensure history is paginated by cursor, filtered by counterpart and every page costs the same """
+        user3 = User.objects.create(email='third@mail.com', phone_number='+380638271141')
+        for number in range(35):
+            message = Message.objects.create(sender=self._user1, receiver=self._user2, text=f'Message {number}')
+            Attachment.objects.create(message=message, file=SimpleUploadedFile('doc.pdf', b'file_content'))
+        for number in range(3):
+            Message.objects.create(sender=user3, receiver=self._user1, text=f'Thread {number}')
+
+        url = reverse('main:user_messages', args=[self._user1.pk])
+        # token, messages with users, attachments
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertEqual(len(response.data['results']), 30)
+        self.assertEqual(response.data['results'][0]['text'], 'Thread 2')
+        self.assertEqual(response.data['results'][3]['sender']['pk'], self._user1.pk)
+        self.assertEqual(len(response.data['results'][3]['attach']), 1)
+
+        with self.assertNumQueries(3):
+            response = self.client.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 8)
+        self.assertEqual(response.data['results'][-1]['text'], 'Message 0')
+        self.assertIsNone(response.data['next'])
+
+        response = self.client.get(url, data={'with': user3.pk})
+        self.assertEqual([message['text'] for message in response.data['results']],
+                         ['Thread 2', 'Thread 1', 'Thread 0'])
+
+        response = self.client.get(url, data={'with': 'user'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_conversations_inbox(self):
+        """ Ensure new messages update conversations of both users and inbox is sorted by last activity """
+        user3 = User.objects.create(email='third@mail.com', phone_number='+380638271141')
+        Message.objects.create(sender=self._user1, receiver=self._user2, text='First')
+        Message.objects.create(sender=self._user1, receiver=self._user2, text='Second')
+        last = Message.objects.create(sender=self._user2, receiver=self._user1, text='Answer')
+        Message.objects.create(sender=user3, receiver=self._user1, text='Hello')
+
+        url = reverse('main:conversations')
+        # token, conversations with counterparts and last messages
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertEqual([(item['counterpart']['pk'], item['unread_count']) for item in response.data['results']],
+                         [(user3.pk, 1), (self._user2.pk, 1)])
+        self.assertEqual(response.data['results'][1]['last_message']['pk'], last.pk)
+        conversation = Conversation.objects.get(owner=self._user2, counterpart=self._user1)
+        self.assertEqual((conversation.unread_count, conversation.last_message_id), (2, last.pk))
+
+        response = self.client.post(reverse('main:read_conversation', args=[self._user2.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Conversation.objects.get(owner=self._user1, counterpart=self._user2).unread_count, 0)
+        response = self.client.post(reverse('main:read_conversation', args=[self._user2.pk + 100]))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_messages_websocket(self):
+        """ Ensure participants get pushes about new, edited and deleted messages and wrong token is rejected """
+        def connect(token):
+            return ApplicationCommunicator(application, {'type': 'websocket', 'path': '/ws/messages/',
+                                                         'query_string': f'token={token}'.encode(), 'headers': []})
+
+        # Connection of test transaction mustn`t be closed by check of token
+        with patch('main.websocket.close_old_connections'):
+            rejected = connect('wrong')
+            await rejected.send_input({'type': 'websocket.connect'})
+            self.assertEqual((await rejected.receive_output(1))['code'], CLOSE_UNAUTHORIZED)
+
+            communicator = connect(self._token.key)
+            await communicator.send_input({'type': 'websocket.connect'})
+            self.assertEqual((await communicator.receive_output(1))['type'], 'websocket.accept')
+
+            def change_messages():
+                with self.captureOnCommitCallbacks(execute=True):
+                    message = Message.objects.create(sender=self._user2, receiver=self._user1, text='Hello')
+                with self.captureOnCommitCallbacks(execute=True):
+                    message.text = 'Edited'
+                    message.save()
+                with self.captureOnCommitCallbacks(execute=True):
+                    message.delete()
+                # Not participant
+                with self.captureOnCommitCallbacks(execute=True):
+                    Message.objects.create(sender=self._user2, receiver=self._user2, text='Note')
+
+            await sync_to_async(change_messages)()
+            events = [json.loads((await communicator.receive_output(1))['text']) for _ in range(3)]
+            self.assertEqual([event['type'] for event in events], ['message.created', 'message.updated', 'message.deleted'])
+            self.assertEqual(events[1]['message']['text'], 'Edited')
+            self.assertTrue(await communicator.receive_nothing())
+
+            await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await communicator.wait(1)
+
     @override_settings(MEDIA_ROOT=tempfile.gettempdir())
     def test_add_message_with_attachment(self):
         """Ensure we can create message with media file"""
@@ -181,6 +285,79 @@ class TestUser(APITestCase):
         self.assertEqual(response_attach_detail.status_code, 200)
         self.assertIn('attachment; filename=', response_attach_detail.get('Content-Disposition'))
 
+    @override_settings(MEDIA_ROOT=tempfile.gettempdir())
+    def test_download_attachment_partially(self):
+        """ Ensure attachment supports Range and If-Modified-Since and is available only for participants """
+        message = Message.objects.create(sender=self._user1, receiver=self._user2, text='Message with file')
+        attach = Attachment.objects.create(message=message, file=SimpleUploadedFile('doc.pdf', b'0123456789'))
+        url = reverse('main:download_attachment', args=[attach.pk])
+
+        response = self.client.get(url, HTTP_RANGE='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), b'2345')
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+
+        response = self.client.get(url, HTTP_RANGE='bytes=-3')
+        self.assertEqual(b''.join(response.streaming_content), b'789')
+
+        response = self.client.get(url, HTTP_RANGE='bytes=20-')
+        self.assertEqual(response.status_code, 416)
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+        with override_settings(SENDFILE_X_ACCEL=True):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected/{attach.file.name}')
+        self.assertEqual(response.content, b'')
+
+        message.sender = message.receiver = None
+        message.save()
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 403)
+
+    def test_user_background_deletion(self):
+        """ Ensure deleted user is deactivated at once and removed by job, rows of other users are kept """
+        house = House.objects.create(name='House', address='Street', city='Odessa', tech='MONO1', territory='OPEN',
+                                     payment_options='MORTGAGE', role='FLAT', sales_department=self._user2)
+        floor = Floor.objects.create(number=1, section=Section.objects.create(
+            number=1, building=Building.objects.create(number=1, house=house)))
+        flat = Flat.objects.create(number=1, square=1, kitchen_square=1, price_per_metre=1, price=1,
+                                   schema='schema.png', number_of_rooms=1, state='BLANK', foundation_doc='OWNER',
+                                   plan='FREE', balcony='YES', floor=floor, client=self._user1)
+        post = Post.objects.create(number=1, payment_options='PAYMENT', price=1000, flat=flat, house=house,
+                                   user=self._user2, main_image='image.png')
+        toggle_reaction(post.pk, self._user1, 'like')
+        post.in_favorites.add(self._user1)
+        Contact.objects.create(user=self._user2, contact=self._user1)
+        UserFilter.objects.create(user=self._user1)
+        message = Message.objects.create(sender=self._user1, receiver=self._user2, text='Hello')
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.delete(self._url)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self.client.get(self._url).status_code, 401)
+        self.assertTrue(User.objects.filter(pk=self._user1.pk).exists())
+
+        with patch('main.purge.BATCH_SIZE', 1), self.captureOnCommitCallbacks(execute=True):
+            for callback in callbacks:
+                callback()
+        self.assertFalse(User.objects.filter(pk=self._user1.pk).exists())
+        message.refresh_from_db()
+        self.assertEqual((message.sender, message.receiver), (None, self._user2))
+        self.assertFalse(Conversation.objects.exists())
+        self.assertFalse(Contact.objects.exists())
+        self.assertFalse(UserFilter.objects.exists())
+        post.refresh_from_db()
+        self.assertEqual((post.likes, post.weight, post.in_favorites.count()), (0, 0, 0))
+        self.assertIsNone(Flat.objects.get(pk=flat.pk).client)
+
     def test_changing_ban_status(self):
         """Ensure we can change user ban status"""
         admin_user = User.objects.get(email=self._test_user_email)
@@ -240,6 +417,39 @@ class TestUser(APITestCase):
         self.assertTrue(message.exists())
         self.assertEqual(message.first().text, 'Your subscription has been expired')
 
+    def test_notifications_without_system_user(self):
+        """ Ensure missing SYSTEM user isn`t remembered - notifications are sent once it is created """
+        system = notifications.get_system_user()
+        User.objects.filter(pk=system).update(role='USER')
+        self.assertEqual(notifications.notify(User.objects.filter(pk=self._user1.pk), 'Hello'), 0)
+        User.objects.filter(pk=system).update(role='SYSTEM')
+        self.assertEqual(notifications.notify(User.objects.filter(pk=self._user1.pk), 'Hello'), 1)
+
+    def test_notifications_fan_out(self):
+        """ Ensure notifications respect settings of users, are copied to agents and update conversations """
+        agent = User.objects.create(email='agent@mail.com', phone_number='+380638271141', role='AGENT')
+        off = User.objects.create(email='off@mail.com', phone_number='+380638271142', notifications='OFF')
+        User.objects.filter(pk=self._user1.pk).update(first_name='Ivan', last_name='Petrov',
+                                                      notifications='MEANDAGENT')
+        User.objects.filter(pk=self._user2.pk).update(first_name='Anna', notifications='AGENT')
+        Contact.objects.create(user=self._user1, contact=agent)
+        Contact.objects.create(user=self._user2, contact=agent)
+        system = notifications.get_system_user()
+
+        # system user, recipients, agents, savepoint, messages, conversations, 2 updates of receivers - by unread
+        # count, update of system user, release savepoint
+        with self.assertNumQueries(10):
+            created = notifications.notify(User.objects.exclude(pk=agent.pk), 'Hello, {first_name}')
+        self.assertEqual(created, 3)
+        self.assertFalse(Message.objects.filter(receiver__in=[self._user2, off]).exists())
+        self.assertEqual(Message.objects.get(receiver=self._user1).text, 'Hello, Ivan')
+        self.assertEqual(sorted(Message.objects.filter(receiver=agent).values_list('text', flat=True)),
+                         ['+380638271140: Hello, Anna', 'Ivan Petrov: Hello, Ivan'])
+        conversation = Conversation.objects.get(owner=agent, counterpart=system)
+        self.assertEqual(conversation.unread_count, 2)
+        self.assertEqual(conversation.last_message.receiver, agent)
+        self.assertEqual(Conversation.objects.filter(owner=system).count(), 2)
+
     def test_create_user_with_role_system(self):
         """ User with role 'SYSTEM' is a account for sending notifications.
          Ensure we can create only one system account """
@@ -10,6 +10,7 @@ router = SimpleRouter()
 router.register('users', user_views.UserViewSet, basename='users')
 router.register('users/notary/admin-access', user_views.NotaryUsersApi, basename='users_notary_admin')
 router.register('user_filters', user_views.UserFilterViewSet, basename='user_filters')
+router.register('jobs', user_views.BackgroundJobViewSet, basename='jobs')
 
 # HOUSE
 router.register('houses', house_views.HouseViewSet, basename='houses')
@@ -45,7 +46,10 @@ app_name = 'main'
 
 
 urlpatterns = [
+    # Before router - otherwise 'users/<pk>/' catches it
+    path('users/conversations/', user_views.ConversationApi.as_view(), name='conversations'),
     path('', include(router.urls)),
+    path('users/conversations/<int:pk>/read/', user_views.ConversationApi.as_view(), name='read_conversation'),
     path('users/<int:pk>/subscription/', user_views.UpdateSubscription.as_view(), name='update_subscription'),
     path('users/<int:pk>/change_ban_status/', user_views.ChangeBanStatus.as_view(), name='change_ban_status'),
 
@@ -62,8 +66,16 @@ urlpatterns = [
     path('users/message/attachment/<int:pk>/', user_views.AttachmentApi.as_view(), name='download_attachment'),
 
     # HOUSE
+    path('houses/<int:pk>/chessboard/', house_views.HouseChessboard.as_view(), name='house_chessboard'),
+    path('houses/<int:pk>/structure/', house_views.HouseStructureGenerator.as_view(), name='house_structure'),
+    path('houses/<int:pk>/reprice/', house_views.FlatReprice.as_view(), name='reprice_flats'),
+    path('houses/<int:pk>/export_flats/', house_views.FlatExport.as_view(), name='export_flats'),
+    path('houses/<int:pk>/import_flats/', house_views.FlatImport.as_view(), name='import_flats'),
     path('flats/<int:pk>/booking/', house_views.BookingFlat.as_view(), name='booking_flat'),
 
     # POST
     path('like_dislike/<int:pk>/', post_views.LikeAndDislikePost.as_view(), name='like_dislike'),
+    path('reactions/', post_views.PostReactions.as_view(), name='reactions'),
+    path('export/posts/', post_views.PostExport.as_view(), name='export_posts'),
+    path('export/complaints/', post_views.ComplaintExport.as_view(), name='export_complaints'),
 ]
@@ -6,6 +6,7 @@ from rest_framework.response import Response
 from rest_framework import status
 
 from django.shortcuts import get_object_or_404
+from django.db import transaction
 from django.utils.translation import gettext as _
 
 from django_filters import rest_framework as filters
@@ -13,25 +14,43 @@ from django_filters import rest_framework as filters
 from main.permissions import IsOwnerOrReadOnly, IsOwner
 from main.serializers import house_serializers
 from main.filters import FlatFilter, HouseFilter
-from main.services import generate_http_response_to_download
+from main.services import generate_http_response_to_download, generate_csv_streaming_response
+from main.chessboard import get_chessboard
+from main.structure import generate_structure
+from main.pricing import reprice_flats
+from main.tasks import run_flats_import, run_purge
+from main.serializers.user_serializers import BackgroundJobSerializer
 
-from _db.models.models import House, Building, Section, Floor, NewsItem, Document, Flat, RequestToChest, Standpipe
+from _db.models.models import (House, Building, Section, Floor, NewsItem, Document, Flat, RequestToChest, Standpipe,
+                               BackgroundJob)
 
 
 class HouseViewSet(ModelViewSet):
     permission_classes = (IsAuthenticated, IsOwnerOrReadOnly)
-    queryset = House.objects.all().order_by('-id')
+    queryset = House.objects.prefetch_related('image_variants').order_by('-id')
     serializer_class = house_serializers.HouseSerializer
     filter_backends = (filters.DjangoFilterBackend,)
     filterset_class = HouseFilter
     view_tags = ['Houses']
 
     def get_queryset(self):
-        return House.objects.filter(sales_department=self.request.user).order_by('-id')
+        return self.queryset.visible().filter(sales_department=self.request.user)
 
     def perform_create(self, serializer):
         serializer.save(sales_department=self.request.user)
 
+    def destroy(self, request, *args, **kwargs):
+        """
+        House is hidden at once and its structure is deleted by celery job - see 'main.purge'.
+        Response is job - its progress can be got from 'jobs/<pk>/'
+        """
+        house = self.get_object()
+        with transaction.atomic():
+            House.objects.filter(pk=house.pk).update(hidden=True)
+            job = BackgroundJob.objects.create(kind='PURGE_HOUSE', user=request.user, params={'house': house.pk})
+            transaction.on_commit(lambda: run_purge.delay(job.pk))
+        return Response(BackgroundJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
 
 class HousePublic(ListModelMixin,
                   RetrieveModelMixin,
@@ -41,14 +60,14 @@ class HousePublic(ListModelMixin,
     """
     permission_classes = (AllowAny, )
     authentication_classes = []
-    queryset = House.objects.all().order_by('-id')
+    queryset = House.objects.visible().prefetch_related('image_variants').order_by('-id')
     serializer_class = house_serializers.HouseSerializer
     view_tags = ['Public-Houses']
 
 
 class BuildingViewSet(ModelViewSet):
     permission_classes = (IsAuthenticated, IsOwnerOrReadOnly)
-    queryset = Building.objects.all().order_by('-id')
+    queryset = Building.objects.filter(house__hidden=False).order_by('-id')
     serializer_class = house_serializers.BuildingSerializer
     view_tags = ['Buildings']
 
@@ -60,7 +79,7 @@ class BuildingViewSet(ModelViewSet):
 
 class SectionViewSet(ModelViewSet):
     permission_classes = (IsAuthenticated, IsOwnerOrReadOnly)
-    queryset = Section.objects.all().order_by('-id')
+    queryset = Section.objects.filter(building__house__hidden=False).order_by('-id')
     serializer_class = house_serializers.SectionSerializer
     view_tags = ['Sections']
 
@@ -74,7 +93,8 @@ class SectionViewSet(ModelViewSet):
 
 class FloorViewSet(ModelViewSet):
     permission_classes = (IsAuthenticated, IsOwnerOrReadOnly)
-    queryset = Floor.objects.all().order_by('-id')
+    queryset = Floor.objects.filter(section__building__house__hidden=False).select_related('section__building')\
+        .order_by('-id')
     serializer_class = house_serializers.FloorSerializer
     view_tags = ['Floors']
 
@@ -88,7 +108,7 @@ class FloorViewSet(ModelViewSet):
 
 class NewsItemViewSet(ModelViewSet):
     permission_classes = (IsAuthenticated, IsOwnerOrReadOnly)
-    queryset = NewsItem.objects.all().order_by('-id')
+    queryset = NewsItem.objects.filter(house__hidden=False).order_by('-id')
     serializer_class = house_serializers.NewsItemSerializer
     view_tags = ['NewsItems']
 
@@ -106,7 +126,7 @@ class NewsItemViewSet(ModelViewSet):
 
 class DocumentViewSet(ModelViewSet):
     permission_classes = (IsAuthenticated, IsOwnerOrReadOnly)
-    queryset = Document.objects.all().order_by('-id')
+    queryset = Document.objects.filter(house__hidden=False).order_by('-id')
     serializer_class = house_serializers.DocumentSerializer
     view_tags = ['Documents']
 
@@ -123,12 +143,13 @@ class DocumentViewSet(ModelViewSet):
 
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
-        return generate_http_response_to_download(instance)
+        return generate_http_response_to_download(instance, request)
 
 
 class FlatViewSet(ModelViewSet):
     permission_classes = (IsAuthenticated, IsOwnerOrReadOnly)
-    queryset = Flat.objects.all().order_by('-id')
+    queryset = Flat.objects.filter(house__hidden=False).select_related('house').prefetch_related('image_variants')\
+        .order_by('-id')
     serializer_class = house_serializers.FlatSerializer
     filter_backends = (filters.DjangoFilterBackend, )
     filterset_class = FlatFilter
@@ -143,7 +164,8 @@ class FlatPublic(ListModelMixin,
     """
     permission_classes = (AllowAny, )
     authentication_classes = []
-    queryset = Flat.objects.all().order_by('-id')
+    queryset = Flat.objects.filter(house__hidden=False).select_related('house').prefetch_related('image_variants')\
+        .order_by('-id')
     serializer_class = house_serializers.FlatSerializer
     filter_backends = (filters.DjangoFilterBackend, )
     filterset_class = FlatFilter
@@ -151,13 +173,101 @@ class FlatPublic(ListModelMixin,
 
     def get_queryset(self):
         if self.request.query_params.get('house__pk'):
-            return self.queryset.filter(floor__section__building__house__pk=self.request.query_params.get('house__pk'))
+            return self.queryset.filter(house__pk=self.request.query_params.get('house__pk'))
         elif self.request.query_params.get('client_pk'):
             return self.queryset.filter(client__pk=self.request.query_params.get('client_pk'))
         else:
             return self.queryset
 
 
+class HouseChessboard(APIView):
+    """
+    Complete structure of house for sales department grid. Flat is a list of values - see 'flat_fields'.
+    Floors without flats are not included. Hidden house is not found, though its chessboard may be cached
+    """
+    permission_classes = (IsAuthenticated, )
+    view_tags = ['Houses']
+
+    def get(self, request, pk, format=None):
+        get_object_or_404(House.objects.visible().values_list('pk', flat=True), pk=pk)
+        return Response(get_chessboard(pk))
+
+
+class HouseStructureGenerator(APIView):
+    """
+    Create buildings, sections, floors and flats of house by one request.
+    Request: {'buildings': 1, 'sections': 4, 'floors': 20, 'flats_per_floor': 4, 'flat': {<flat fields>}}
+    Response contains ids of created objects for every level
+    """
+    permission_classes = (IsAuthenticated, IsOwner)
+    view_tags = ['Houses']
+
+    def post(self, request, pk, format=None):
+        house = get_object_or_404(House.objects.visible().select_related('sales_department'), pk=pk)
+        self.check_object_permissions(request, house)
+        serializer = house_serializers.StructureGeneratorSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        created = generate_structure(house, data['buildings'], data['sections'], data['floors'],
+                                     data['flats_per_floor'], data['flat'])
+        return Response(created, status=status.HTTP_201_CREATED)
+
+
+class FlatReprice(APIView):
+    """
+    Change price of flats of house by percent or amount.
+    Request: {'section': 1, 'percent': 10, 'update_posts': true}. Without location all flats of house are changed.
+    Price per metre is recomputed, posts of flats are changed in the same way if 'update_posts' is set
+    """
+    permission_classes = (IsAuthenticated, IsOwner)
+    view_tags = ['Flats']
+
+    def post(self, request, pk, format=None):
+        house = get_object_or_404(House.objects.visible().select_related('sales_department'), pk=pk)
+        self.check_object_permissions(request, house)
+        serializer = house_serializers.RepriceSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response(reprice_flats(house, **serializer.validated_data))
+
+
+class FlatExport(APIView):
+    """ All flats of house as CSV file. Values of choice fields are codes """
+    permission_classes = (IsAuthenticated, IsOwner)
+    view_tags = ['Flats']
+    fields = ('id', 'number', 'building_number', 'section_number', 'floor_number', 'square', 'kitchen_square',
+              'price', 'price_per_metre', 'number_of_rooms', 'state', 'foundation_doc', 'type', 'plan', 'balcony',
+              'heating', 'booked', 'owned', 'client')
+
+    def get(self, request, pk, format=None):
+        house = get_object_or_404(House.objects.visible().select_related('sales_department'), pk=pk)
+        self.check_object_permissions(request, house)
+        flats = Flat.objects.filter(house=house).order_by('building_number', 'section_number', 'floor_number',
+                                                          'number', 'id')
+        return generate_csv_streaming_response(flats, self.fields, f'flats_{house.pk}.csv')
+
+
+class FlatImport(APIView):
+    """
+    Upload CSV or XLSX file with flats of house. File is imported by celery job - see 'main.flat_import'.
+    Columns: building, section, floor, number, square, kitchen_square, price_per_metre, price, number_of_rooms,
+    state, foundation_doc, type, plan, balcony, heating. Values of choice fields are codes, like 'BLANK'.
+    Response is job - its progress and report can be got from 'jobs/<pk>/'
+    """
+    permission_classes = (IsAuthenticated, IsOwner)
+    view_tags = ['Flats']
+
+    def post(self, request, pk, format=None):
+        house = get_object_or_404(House.objects.visible().select_related('sales_department'), pk=pk)
+        self.check_object_permissions(request, house)
+        file = request.data.get('file')
+        if not file:
+            return Response({'Error': _('File is required')}, status=status.HTTP_400_BAD_REQUEST)
+        job = BackgroundJob.objects.create(kind='IMPORT_FLATS', user=request.user, params={'house': house.pk},
+                                           file=file)
+        transaction.on_commit(lambda: run_flats_import.delay(job.pk))
+        return Response(BackgroundJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+
 class BookingFlat(APIView):
     permission_classes = (IsAuthenticated, )
     view_tags = ['Flats']
@@ -172,15 +282,15 @@ class BookingFlat(APIView):
         :param format:
         :return: Response
         """
-        flat = get_object_or_404(Flat, pk=pk)
-        is_house_owner = (flat.floor.section.building.house.sales_department == request.user)
+        flat = get_object_or_404(Flat.objects.select_related('house'), pk=pk)
+        is_house_owner = (flat.house.sales_department_id == request.user.pk)
         if request.data.get('booking') == '1' and not flat.client:
             flat.client = request.user
             flat.booked = True
 
             # After we booked flat - we have to send request to the house owner fro adding new info to house chest
             data_for_request = {
-                'house': flat.floor.section.building.house.pk,
+                'house': flat.house_id,
                 'flat': flat.pk
             }
             serializer = house_serializers.RequestToChestSerializer(data=data_for_request)
@@ -213,7 +323,7 @@ class RequestToChestApi(ListModelMixin,
                         GenericViewSet):
     """ Manage requests to chest. Only house`s sales department can get its requests """
     permission_classes = (IsAuthenticated, IsOwner)
-    queryset = RequestToChest.objects.all().order_by('-id')
+    queryset = RequestToChest.objects.select_related('flat__house', 'flat__client').order_by('-id')
     serializer_class = house_serializers.RequestToChestSerializer
     view_tags = ['Flats']
 
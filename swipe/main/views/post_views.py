@@ -5,41 +5,52 @@ from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.views import APIView
 
-from django.db.models import Count
+from django.db.models import Count, F
 from django_filters import rest_framework as filters
 from django.shortcuts import get_object_or_404
+from django.http import Http404
 from django.utils.translation import gettext as _
 
+from user_auth.authentication import OptionalBearerTokenAuthentication
 from main.permissions import IsOwner, IsOwnerOrReadOnly, IsFavoritesOwner
 from main.serializers import post_serializers
 from main.filters import PostFilter
-from main.tasks import check_filter_matching
+from main.pagination import PostPagination
+from main.services import generate_csv_streaming_response
+from main import counters, filter_matching
+from main.reactions import toggle_reaction
 
 from _db.models.models import Post, PostImage, Complaint, Promotion, PromotionType
 
-from main.full_text_search import get_queryset
+from main.full_text_search import get_queryset, search
 
 
 class PostViewSet(ModelViewSet):
     """ CRUD operation for user`s posts """
     permission_classes = (IsAuthenticated, IsOwner)
-    queryset = Post.objects.all().order_by('-weight', '-created')
+    queryset = Post.objects.with_related().visible().order_by('-weight', '-created', '-id')
     serializer_class = post_serializers.PostSerializer
     filter_backends = (filters.DjangoFilterBackend,)
     filterset_class = PostFilter
+    pagination_class = PostPagination
     view_tags = ['Post']
 
     def get_queryset(self):
         """ Admin can filter by specific user """
+        queryset = self.queryset.with_user_flags(self.request.user)
         if self.request.query_params.get('for_user') and (self.request.user.is_staff or self.request.user.is_superuser):
-            return self.queryset.filter(user__pk=self.request.query_params.get('for_user'))
+            return queryset.filter(user__pk=self.request.query_params.get('for_user'))
+        elif self.request.query_params.get('q'):
+            return search(queryset, self.request.query_params.get('q'))
         elif self.request.query_params.get('house__city'):
-            return get_queryset(self.queryset, self.request.query_params.get('house__city'))
+            return get_queryset(queryset, self.request.query_params.get('house__city'))
         else:
-            return self.queryset.filter(user=self.request.user)
+            return queryset.filter(user=self.request.user)
 
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        post = serializer.save(user=self.request.user)
+        # Matched with saved filters of users by celery - see 'main.filter_matching'
+        filter_matching.publish(post, self.request.get_host())
 
     def create(self, request, *args, **kwargs):
         """
@@ -51,11 +62,7 @@ class PostViewSet(ModelViewSet):
         :return: Response
         """
         if request.user.subscribed or request.user.posts.count() < Post.LIMIT:
-            response = super().create(request, *args, **kwargs)
-
-            # Run celery task to find if any user`s filter matches new post
-            check_filter_matching(response.data['id'], request.stream.get_host())
-            return response
+            return super().create(request, *args, **kwargs)
         return Response({'Error': _('You have reached limit. Please, delete another post or subscribe')},
                         status=status.HTTP_400_BAD_REQUEST)
 
@@ -65,46 +72,53 @@ class PostViewSetPublic(mixins.ListModelMixin,
                         GenericViewSet):
     """ Allow all users to see publications"""
     permission_classes = (AllowAny, )
-    authentication_classes = []
-    queryset = Post.objects.filter(rejected=False).order_by('-weight', '-created')
+    authentication_classes = (OptionalBearerTokenAuthentication, )
+    queryset = Post.objects.with_related().visible().filter(rejected=False).order_by('-weight', '-created', '-id')
     serializer_class = post_serializers.PostSerializer
     filter_backends = (filters.DjangoFilterBackend,)
     filterset_class = PostFilter
+    pagination_class = PostPagination
     view_tags = ['Public-Posts']
 
     def retrieve(self, request, *args, **kwargs):
-        """ Increment view counter """
+        """ Increment view counter. It is saved to database later - see main.counters """
         obj = self.get_object()
-        obj.views += 1
-        obj.save(update_fields=('views', ))
-        return super().retrieve(request, *args, **kwargs)
+        counters.add(obj.pk, views=1)
+        counters.apply_pending([obj])
+        serializer = self.get_serializer(obj)
+        return Response(serializer.data)
 
     def get_queryset(self):
+        """ Authentication is optional. Reaction flags are annotated for authenticated user """
+        queryset = self.queryset.with_user_flags(self.request.user)
+        if self.request.query_params.get('q'):
+            return search(queryset, self.request.query_params.get('q'))
         if self.request.query_params.get('house__city'):
-            return get_queryset(self.queryset, self.request.query_params.get('house__city'))
-        return self.queryset
+            return get_queryset(queryset, self.request.query_params.get('house__city'))
+        return queryset
 
 
 class PostImageViewSet(ModelViewSet):
     permission_classes = (IsAuthenticated, IsOwnerOrReadOnly)
-    queryset = PostImage.objects.all().order_by('-id')
+    queryset = PostImage.objects.prefetch_related('image_variants').order_by('-id')
     serializer_class = post_serializers.PostImageSerializer
     view_tags = ['Post']
 
 
 class UserFavoritesViewSet(ModelViewSet):
     permission_classes = (IsAuthenticated, IsFavoritesOwner)
-    queryset = Post.objects.all().order_by('-id')
+    queryset = Post.objects.with_related().visible().order_by('-weight', '-created', '-id')
     serializer_class = post_serializers.PostSerializer
+    pagination_class = PostPagination
     view_tags = ['Post']
 
     def get_queryset(self):
-        return self.queryset.filter(in_favorites=self.request.user, rejected=False)
+        return self.queryset.with_user_flags(self.request.user).filter(in_favorites=self.request.user, rejected=False)
 
     def create(self, request, *args, **kwargs):
         post = get_object_or_404(Post, pk=request.data.get('post'))
         serializer = self.serializer_class(post)
-        if request.user in post.in_favorites.all():
+        if Post.in_favorites.through.objects.filter(post=post, user=request.user).exists():
             return Response(serializer.data, status=status.HTTP_409_CONFLICT)
         post.in_favorites.add(request.user)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -112,7 +126,7 @@ class UserFavoritesViewSet(ModelViewSet):
     def destroy(self, request, *args, **kwargs):
         post = get_object_or_404(Post, pk=kwargs.get('pk'))
         serializer = self.serializer_class(post)
-        if request.user in post.in_favorites.all():
+        if Post.in_favorites.through.objects.filter(post=post, user=request.user).exists():
             post.in_favorites.remove(request.user)
             return Response(serializer.data, status=status.HTTP_204_NO_CONTENT)
         return Response(serializer.data, status=status.HTTP_409_CONFLICT)
@@ -121,7 +135,7 @@ class UserFavoritesViewSet(ModelViewSet):
 class ComplaintViewSet(ModelViewSet):
     """ CRUD operations for user`s complaints """
     permission_classes = (IsAuthenticated, IsOwner)
-    queryset = Complaint.objects.all().order_by('-id')
+    queryset = Complaint.objects.select_related('post__flat__house').order_by('-id')
     serializer_class = post_serializers.ComplaintSerializer
     view_tags = ['Post']
 
@@ -147,7 +161,7 @@ class ComplaintsAdmin(mixins.ListModelMixin,
     Admin can only perform this actions: 'list', 'retrieve', 'destroy'
     """
     permission_classes = (IsAuthenticated, IsAdminUser)
-    queryset = Complaint.objects.all().order_by('-id')
+    queryset = Complaint.objects.select_related('post__flat__house').order_by('-id')
     serializer_class = post_serializers.ComplaintSerializer
     view_tags = ['Admin']
 
@@ -167,11 +181,16 @@ class PostModerationAdmin(mixins.RetrieveModelMixin,
     Admin can get list of posts with complains
     """
     permission_classes = (IsAuthenticated, IsAdminUser)
-    queryset = Post.objects.annotate(comp_count=Count('complaints')).filter(comp_count__gt=0).order_by('-id')
+    queryset = Post.objects.with_related().visible().annotate(comp_count=Count('complaints')).filter(comp_count__gt=0)\
+        .order_by('-weight', '-created', '-id')
     # Filter only posts with complaints
     serializer_class = post_serializers.PostSerializer
+    pagination_class = PostPagination
     view_tags = ['Admin']
 
+    def get_queryset(self):
+        return self.queryset.with_user_flags(self.request.user)
+
     def get_serializer_class(self):
         if self.action in ('list', 'retrieve'):
             return self.serializer_class
@@ -185,57 +204,74 @@ class LikeAndDislikePost(APIView):
     view_tags = ['Post']
 
     def get(self, request, pk, format=None):
-        post = get_object_or_404(Post, pk=pk)
+        post = get_object_or_404(Post.objects.with_user_flags(request.user).only('pk'), pk=pk)
         action = None
-        if request.user in post.likers.all():
+        if post.is_liked:
             action = 'like'
-        if request.user in post.dislikers.all():
+        if post.is_disliked:
             action = 'dislike'
         return Response({'post': post.pk,
                          'user': request.user.pk,
                          'action': action if action else ''})
 
     def patch(self, request, pk, format=None):
-        post = get_object_or_404(Post, pk=pk)
+        """ Any action except 'like' is dislike. See main.reactions """
+        if not Post.objects.filter(pk=pk).exists():
+            raise Http404
         action = request.data.get('action')
-        if action == 'like':
-            # If user disliked post before, but now he liked it - we have to remove him from dislikers list
-            if request.user in post.dislikers.all():
-                post.dislikers.remove(request.user)
-                post.likes += 1
-                post.weight += 1
-            # If user liked post before, but now he wants to remove like - we have to remove him from likers list
-            if request.user in post.likers.all():
-                post.likers.remove(request.user)
-                post.likes -= 1
-                post.weight -= 1
-            else:
-                # Add user to likers list and increment post likes counter
-                post.likers.add(request.user)
-                post.likes += 1
-                post.weight += 1
-        else:
-            # If user liked post before, but now he disliked it - we have to remove him from likers list
-            if request.user in post.likers.all():
-                post.likers.remove(request.user)
-                post.likes -= 1
-                post.weight -= 1
-            # If user disliked post before, but now he wants to remove dislike - we have to remove from dislikers list
-            if request.user in post.dislikers.all():
-                post.dislikers.remove(request.user)
-                post.likes += 1
-                post.weight += 1
-            else:
-                # if user dislike post - add him to dislikers list and decrement likes counter
-                post.dislikers.add(request.user)
-                post.likes -= 1
-                post.weight -= 1
-        post.save()
-        return Response({'post': post.pk,
+        toggle_reaction(pk, request.user, 'like' if action == 'like' else 'dislike')
+        return Response({'post': pk,
                          'user': request.user.pk,
                          'action': action}, status=status.HTTP_200_OK)
 
 
+class PostReactions(APIView):
+    """
+    Reactions of current user for list of posts - 'reactions/?ids=1,2,3'.
+    Page of feed needs one request instead of request per post
+    """
+    permission_classes = (IsAuthenticated, )
+    view_tags = ['Post']
+    max_ids = 100
+
+    def get(self, request, format=None):
+        try:
+            ids = [int(pk) for pk in request.query_params.get('ids', '').split(',') if pk]
+        except ValueError:
+            return Response({'Error': _('Ids must be comma separated integers')}, status=status.HTTP_400_BAD_REQUEST)
+        if len(ids) > self.max_ids:
+            return Response({'Error': _('Too many ids')}, status=status.HTTP_400_BAD_REQUEST)
+        reactions = Post.objects.with_user_flags(request.user).filter(pk__in=ids).order_by('pk')\
+            .values('is_liked', 'is_disliked', 'is_favorite', post=F('pk'))
+        return Response(list(reactions))
+
+
+class PostExport(APIView):
+    """ Posts of user as CSV file. Admin can export posts of any user with 'for_user' param """
+    permission_classes = (IsAuthenticated, )
+    view_tags = ['Post']
+    fields = ('id', 'number', 'created', 'price', 'payment_options', 'living_type', 'likes', 'views', 'weight',
+              'rejected', 'reject_message', 'house', 'house__name', 'house__city', 'flat', 'description')
+
+    def get(self, request, format=None):
+        user = request.user.pk
+        if request.query_params.get('for_user') and (request.user.is_staff or request.user.is_superuser):
+            user = request.query_params.get('for_user')
+        posts = Post.objects.filter(user=user).order_by('-created', '-id')
+        return generate_csv_streaming_response(posts, self.fields, f'posts_{user}.csv')
+
+
+class ComplaintExport(APIView):
+    """ All complaints as CSV file """
+    permission_classes = (IsAuthenticated, IsAdminUser)
+    view_tags = ['Admin']
+    fields = ('id', 'created', 'type', 'rejected', 'description', 'user', 'post', 'post__user')
+
+    def get(self, request, format=None):
+        complaints = Complaint.objects.order_by('-id')
+        return generate_csv_streaming_response(complaints, self.fields, 'complaints.csv')
+
+
 class PromotionViewSet(mixins.ListModelMixin,
                        mixins.CreateModelMixin,
                        mixins.UpdateModelMixin,
@@ -248,11 +284,9 @@ class PromotionViewSet(mixins.ListModelMixin,
     view_tags = ['Post']
 
     def perform_destroy(self, instance):
-        post = instance.post
         weight = instance.type.efficiency
         super().perform_destroy(instance)
-        post.weight -= weight
-        post.save()
+        post_serializers.change_weight(instance.post_id, -weight)
 
     def get_serializer_class(self):
         if self.action in ('update', 'partial_update'):
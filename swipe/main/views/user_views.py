@@ -1,9 +1,11 @@
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Q
 from django.shortcuts import get_object_or_404
 from django.utils.translation import gettext as _
 
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
-from rest_framework.viewsets import ModelViewSet
+from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
@@ -11,8 +13,12 @@ from rest_framework import status
 from main.serializers import user_serializers
 from main.permissions import IsProfileOwner, IsMessageSenderOrReceiver, IsOwnerOrReadOnly, IsOwner
 from main.services import generate_http_response_to_download
+from main.pagination import MessageKeysetPagination, ConversationKeysetPagination
+from main.conversations import mark_read
+from main.tasks import run_purge
 
-from _db.models.user import Contact, Message, UserFilter, Attachment, AdminToken
+from _db.models.user import Contact, Message, UserFilter, Attachment, AdminToken, Conversation
+from _db.models.models import BackgroundJob, House
 
 import datetime
 from dateutil.relativedelta import relativedelta
@@ -22,17 +28,17 @@ User = get_user_model()
 
 class UserViewSet(ModelViewSet):
     permission_classes = (IsAuthenticated, IsProfileOwner)
-    queryset = User.objects.all().order_by('-id')
+    queryset = User.objects.prefetch_related('image_variants').order_by('-id')
     serializer_class = user_serializers.UserSerializer
     view_tags = ['User']
 
     def get_object(self):
-        obj = get_object_or_404(User, pk=self.kwargs.get('pk'))
+        obj = get_object_or_404(User.objects.filter(is_active=True), pk=self.kwargs.get('pk'))
         self.check_object_permissions(self.request, obj)
         return obj
 
     def get_queryset(self):
-        return User.objects.filter(ban=False).order_by('-id')  # banned users not passed
+        return self.queryset.filter(ban=False, is_active=True)  # banned and deleted users not passed
 
     def list(self, request, *args, **kwargs):
         """
@@ -55,6 +61,19 @@ class UserViewSet(ModelViewSet):
         serializer = self.get_serializer(queryset, many=True)
         return Response(serializer.data)
 
+    def destroy(self, request, *args, **kwargs):
+        """
+        User is deactivated at once - his token stops working and his houses and posts are hidden.
+        Houses, posts and user are deleted by celery job - see 'main.purge'. Response is job
+        """
+        user = self.get_object()
+        with transaction.atomic():
+            User.objects.filter(pk=user.pk).update(is_active=False)
+            House.objects.filter(sales_department=user).update(hidden=True)
+            job = BackgroundJob.objects.create(kind='PURGE_USER', user=request.user, params={'user': user.pk})
+            transaction.on_commit(lambda: run_purge.delay(job.pk))
+        return Response(user_serializers.BackgroundJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
     def update(self, request, *args, **kwargs):
         """
         If user wants to change his admin status, he has to provide special admin token
@@ -159,12 +178,25 @@ class MessageApi(APIView):
     view_tags = ['User']
 
     def get(self, request, pk=None, format=None):
+        """
+        History of user, newest first, paginated by cursor - see 'next' and 'previous' links.
+        Set query param 'with' to get only messages with this user.
+        Every page costs the same number of queries
+        """
         if request.user.pk != pk:
             return Response({'Error': _('You can`t access this messages')})
-        messages = Message.objects.filter(sender__pk=pk) | Message.objects.filter(receiver__pk=pk)
-        messages = messages.order_by()
-        serializer = user_serializers.ReadableMessageSerializer(messages, many=True)
-        return Response(serializer.data)
+        counterpart = request.query_params.get('with')
+        if counterpart:
+            if not counterpart.isdigit():
+                return Response({'Error': _('Invalid user')}, status=status.HTTP_400_BAD_REQUEST)
+            messages = Message.objects.filter(Q(sender=pk, receiver=counterpart) | Q(sender=counterpart, receiver=pk))
+        else:
+            messages = Message.objects.filter(Q(sender=pk) | Q(receiver=pk))
+        messages = messages.select_related('sender', 'receiver').prefetch_related('attach')
+        paginator = MessageKeysetPagination()
+        page = paginator.paginate_queryset(messages, request, self)
+        serializer = user_serializers.ReadableMessageSerializer(page, many=True, context={'request': request})
+        return paginator.get_paginated_response(serializer.data)
 
     def post(self, request, pk=None, format=None):
         if request.user.pk != int(request.data.get('sender')):
@@ -197,10 +229,32 @@ class MessageApi(APIView):
         return Response(status=status.HTTP_200_OK)
 
 
-class AttachmentApi(APIView):
+class ConversationApi(APIView):
+    """
+    Inbox of current user - conversations with last message and number of unread messages,
+    the most recent first. Paginated by cursor
+    """
     permission_classes = (IsAuthenticated, )
     view_tags = ['User']
 
+    def get(self, request, format=None):
+        conversations = Conversation.objects.filter(owner=request.user).select_related('counterpart', 'last_message')
+        paginator = ConversationKeysetPagination()
+        page = paginator.paginate_queryset(conversations, request, self)
+        serializer = user_serializers.ConversationSerializer(page, many=True, context={'request': request})
+        return paginator.get_paginated_response(serializer.data)
+
+    def post(self, request, pk, format=None):
+        """ Mark messages from user 'pk' as read """
+        if not mark_read(request.user, pk):
+            return Response({'Error': _('Conversation doesn`t exist')}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'counterpart': pk, 'unread_count': 0}, status=status.HTTP_200_OK)
+
+
+class AttachmentApi(APIView):
+    permission_classes = (IsAuthenticated, IsMessageSenderOrReceiver)
+    view_tags = ['User']
+
     def post(self, request, format=None):
         serializer = user_serializers.AttachmentSerializer(data=request.data)
         if serializer.is_valid():
@@ -209,8 +263,9 @@ class AttachmentApi(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     def get(self, request, pk, format=None):
-        attach = get_object_or_404(Attachment, pk=pk)
-        return generate_http_response_to_download(attach)
+        attach = get_object_or_404(Attachment.objects.select_related('message'), pk=pk)
+        self.check_object_permissions(request, attach.message)
+        return generate_http_response_to_download(attach, request)
 
 
 class NotaryUsersApi(ModelViewSet):
@@ -221,7 +276,7 @@ class NotaryUsersApi(ModelViewSet):
     """
     permission_classes = (IsAuthenticated, IsAdminUser)
     serializer_class = user_serializers.UserSerializer
-    queryset = User.objects.filter(role='NOTARY').order_by('-id')
+    queryset = User.objects.filter(role='NOTARY').prefetch_related('image_variants').order_by('-id')
     view_tags = ['Admin']
 
 
@@ -253,3 +308,14 @@ class UserFilterViewSet(ModelViewSet):
             return super().create(request, *args, **kwargs)
         return Response({'Error': _('You have reached limit. Please, delete another filter or subscribe')},
                         status=status.HTTP_400_BAD_REQUEST)
+
+
+class BackgroundJobViewSet(ReadOnlyModelViewSet):
+    """ User polls his background jobs to get progress and report """
+    permission_classes = (IsAuthenticated, )
+    serializer_class = user_serializers.BackgroundJobSerializer
+    queryset = BackgroundJob.objects.all().order_by('-id')
+    view_tags = ['User']
+
+    def get_queryset(self):
+        return self.queryset.filter(user=self.request.user)
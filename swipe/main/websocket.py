@@ -0,0 +1,83 @@
+"""
+Websocket of messages - ASGI application, routed by 'swipe.asgi'.
+Client connects with token: 'ws/messages/?token=<key>' or 'Authorization: Bearer <key>' header,
+and receives json events about messages where user is sender or receiver - see 'main.realtime.get_message_event'.
+Idle connection is one task and one queue, database is used only to check token.
+"""
+from django.db import close_old_connections
+
+from rest_framework.authtoken.models import Token
+
+from asgiref.sync import sync_to_async
+
+from urllib.parse import parse_qs
+import asyncio
+import json
+
+from main.realtime import get_channel_layer, get_user_group, OVERFLOW
+
+# Close codes. 4000-4999 are free for application
+CLOSE_UNAUTHORIZED = 4001
+CLOSE_OVERFLOW = 4008
+
+
+def get_token_key(scope):
+    key = parse_qs(scope.get('query_string', b'').decode()).get('token')
+    if key:
+        return key[0]
+    for name, value in scope.get('headers', ()):
+        if name == b'authorization':
+            keyword, _, key = value.decode().partition(' ')
+            if keyword == 'Bearer':
+                return key.strip()
+    return None
+
+
+def get_user_pk(key):
+    """ The same check as 'user_auth.authentication.BearerTokenAuthentication' """
+    close_old_connections()
+    try:
+        token = Token.objects.select_related('user').get(key=key)
+    except Token.DoesNotExist:
+        return None
+    finally:
+        close_old_connections()
+    return token.user_id if token.user.is_active else None
+
+
+async def send_events(queue, send):
+    while True:
+        event = await queue.get()
+        if event is OVERFLOW:
+            await send({'type': 'websocket.close', 'code': CLOSE_OVERFLOW})
+            return
+        await send({'type': 'websocket.send', 'text': json.dumps(event)})
+
+
+async def websocket_application(scope, receive, send):
+    event = await receive()
+    if event['type'] != 'websocket.connect':
+        return
+    key = get_token_key(scope)
+    user = await sync_to_async(get_user_pk)(key) if key else None
+    if user is None:
+        # Close before accept - client gets 403
+        await send({'type': 'websocket.close', 'code': CLOSE_UNAUTHORIZED})
+        return
+
+    layer = get_channel_layer()
+    group = get_user_group(user)
+    queue = await layer.subscribe(group)
+    await send({'type': 'websocket.accept'})
+    sender = asyncio.ensure_future(send_events(queue, send))
+    try:
+        while True:
+            event = await receive()
+            if event['type'] == 'websocket.disconnect':
+                break
+            # Keepalive for proxies. Other client frames are ignored - messages are sent by api
+            if event.get('text') == 'ping':
+                await send({'type': 'websocket.send', 'text': 'pong'})
+    finally:
+        sender.cancel()
+        await layer.unsubscribe(group, queue)
@@ -2,6 +2,7 @@
 ASGI config for swipe project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Websocket of messages is served by 'main.websocket', other connections by Django.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
@@ -9,8 +10,66 @@ https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+from django.core.exceptions import ImproperlyConfigured
+from django.core.handlers.asgi import ASGIHandler
+
+from asgiref.sync import sync_to_async
+
+from itertools import islice
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'swipe.settings')
 
-application = get_asgi_application()
+
+class StreamingASGIHandler(ASGIHandler):
+    """
+    Django 3.2 iterates streaming response inside event loop, so iterators which use database
+    (CSV exports - see 'main.services.generate_csv_streaming_response') fail.
+    Parts are read in thread of views by batches instead.
+    'send_response' is internal method of Django 3.2 handler, so other versions are refused on start -
+    check the override against new handler when Django is upgraded
+    """
+    parts_per_read = 100
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+        parts = iter(response)
+        read = sync_to_async(lambda: list(islice(parts, self.parts_per_read)), thread_sensitive=True)
+        batch = await read()
+        response_headers = [(header.encode('ascii'), value.encode('latin1')) for header, value in response.items()]
+        response_headers.extend((b'Set-Cookie', cookie.output(header='').encode('ascii').strip())
+                                for cookie in response.cookies.values())
+        await send({'type': 'http.response.start', 'status': response.status_code, 'headers': response_headers})
+        while batch:
+            for part in batch:
+                for chunk, _ in self.chunk_bytes(part):
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            batch = await read()
+        await send({'type': 'http.response.body'})
+        await sync_to_async(response.close, thread_sensitive=True)()
+
+
+if django.VERSION[:2] != (3, 2):
+    raise ImproperlyConfigured('StreamingASGIHandler overrides internal ASGIHandler.send_response of Django 3.2')
+
+# Django is set up before modules with models are imported
+django.setup(set_prefix=False)
+django_application = StreamingASGIHandler()
+
+from main.websocket import websocket_application  # noqa: E402
+
+WEBSOCKET_ROUTES = {
+    '/ws/messages/': websocket_application,
+}
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        route = WEBSOCKET_ROUTES.get(scope['path'])
+        if route is None:
+            await receive()
+            await send({'type': 'websocket.close'})
+            return
+        return await route(scope, receive, send)
+    return await django_application(scope, receive, send)
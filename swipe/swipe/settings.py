@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 import os
+import sys
 from pathlib import Path
 
 try:
@@ -27,6 +28,9 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 # SECURITY WARNING: keep the secret key used in production secret!
 SECRET_KEY = os.environ.get('SECRET_KEY', 'changekey')  # if you clone project - set new secret ket
 
+# Test runner. Celery tasks are run in process and local caches are allowed
+TESTING = len(sys.argv) > 1 and sys.argv[1] == 'test'
+
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = int(os.environ.get('DEBUG', 1))
 
@@ -97,6 +101,48 @@ DATABASES = {
         'PORT': os.environ.get('POSTGRES_PORT', '5432')
     }
 }
+if TESTING and DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # Test database is a file, so tests with threads share it. Writers wait for lock instead of failing
+    DATABASES['default']['TEST'] = {'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3')}
+    DATABASES['default']['OPTIONS'] = {'timeout': 20}
+
+# Full text search for posts. Dotted path to backend class, e.g. 'main.full_text_search.SqliteSearchBackend'.
+# If it is not set - backend is chosen by database engine
+SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND')
+
+CACHES = {
+    # Shared by web and celery processes - e.g. chessboards are invalidated by import and repricing in worker
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    } if TESTING else {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'redis://localhost:6379/2'),
+    },
+    # Buffer for post counters - see main.counters. Has to be redis, local memory is allowed only in tests
+    'counters': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'counters',
+        'OPTIONS': {'MAX_ENTRIES': 1000000},
+    } if TESTING else {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': os.environ.get('COUNTERS_CACHE_LOCATION', 'redis://localhost:6379/1'),
+    },
+}
+
+# Celery. Worker and beat are run by docker-compose, tasks run in process only in tests
+CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'memory://' if TESTING else 'redis://localhost:6379/0')
+CELERY_TASK_ALWAYS_EAGER = int(os.environ.get('CELERY_TASK_ALWAYS_EAGER', TESTING))
+
+# Downloads of documents and attachments. If it is set - nginx sends files from internal location,
+# see 'nginx/default.conf'. Prefix + file name is path in 'X-Accel-Redirect' header
+SENDFILE_X_ACCEL = int(os.environ.get('SENDFILE_X_ACCEL', 0))
+SENDFILE_X_ACCEL_PREFIX = '/protected/'
+
+# Websocket pushes. Dotted path to channel layer class - see main.realtime.
+# Default in-memory layer works only when all websockets and writers are in one process,
+# 'main.realtime.RedisChannelLayer' works with several workers and celery
+CHANNEL_LAYER = os.environ.get('CHANNEL_LAYER', 'main.realtime.InMemoryChannelLayer')
+CHANNEL_LAYER_LOCATION = os.environ.get('CHANNEL_LAYER_LOCATION', 'redis://localhost:6379/3')
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -1,5 +1,15 @@
 from rest_framework.authentication import TokenAuthentication
+from rest_framework import exceptions
 
 
 class BearerTokenAuthentication(TokenAuthentication):
     keyword = 'Bearer'
+
+
+class OptionalBearerTokenAuthentication(BearerTokenAuthentication):
+    """ For public views - invalid or stale token means anonymous user instead of 401 """
+    def authenticate(self, request):
+        try:
+            return super().authenticate(request)
+        except exceptions.AuthenticationFailed:
+            return None